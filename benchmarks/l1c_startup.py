@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the import time and resident memory of the level-1c runner of each service.
+
+Each measure is made in a fresh interpreter, importing what
+`level1c_runner.py` imports and the level1c4pps processor of the service.
+The `all` line imports the processors of all the services, as the runner
+did before they were imported lazily::
+
+    python benchmarks/l1c_startup.py --repeat 5
+    python benchmarks/l1c_startup.py --services viirs-l1c avhrr-l1c
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from nwcsafpps_runner.l1c_processing import SUPPORTED_SERVICE_NAMES
+
+MEASURE = """
+import json, resource, time
+start = time.monotonic()
+import posttroll.publisher, posttroll.subscriber
+import nwcsafpps_runner.message_utils
+from nwcsafpps_runner.l1c_processing import get_l1c_processor
+for service in {services!r}:
+    get_l1c_processor(service)
+seconds = time.monotonic() - start
+print(json.dumps({{'seconds': seconds, 'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}}))
+"""
+
+
+def measure(services, python=sys.executable):
+    """Get the import time and peak resident memory of a fresh interpreter importing the processors."""
+    output = subprocess.run([python, '-c', MEASURE.format(services=list(services))],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def report(name, results):
+    """Print the median import time and memory of the results."""
+    print("%-14s import median %.2f s (min %.2f s), peak RSS median %.0f MB" % (
+        name,
+        statistics.median(result['seconds'] for result in results),
+        min(result['seconds'] for result in results),
+        statistics.median(result['rss_mb'] for result in results)))
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--services', nargs='*', default=SUPPORTED_SERVICE_NAMES, help="Services to measure")
+    parser.add_argument('--python', default=sys.executable, help="Python interpreter")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of runs of each service")
+    args = parser.parse_args()
+
+    # Warm the file system cache, the first import is much slower
+    measure(SUPPORTED_SERVICE_NAMES, args.python)
+    report('none', [measure([], args.python) for _ in range(args.repeat)])
+    for service in args.services:
+        report(service, [measure([service], args.python) for _ in range(args.repeat)])
+    report('all', [measure(SUPPORTED_SERVICE_NAMES, args.python) for _ in range(args.repeat)])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare the startup time of a PPS script started with Popen and forked from the warm launcher.
+
+By default the script only imports the preloaded modules, so the time
+measured is the interpreter startup and import time of each job::
+
+    python benchmarks/pps_startup.py --preload numpy netCDF4 --repeat 20
+    python benchmarks/pps_startup.py --script /path/to/ppsRunAll.py --preload numpy netCDF4 pps_runall -- -h
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from nwcsafpps_runner.process_supervisor import SupervisedProcess
+from nwcsafpps_runner.warm_launcher import WarmLauncher
+
+
+def time_jobs(cmd, repeat, launcher=None):
+    """Run the command *repeat* times, and get the wall clock time of each run."""
+    durations = []
+    for _ in range(repeat):
+        start = time.monotonic()
+        proc = SupervisedProcess(cmd, 'benchmark', 600, log_func=lambda line: None, launcher=launcher)
+        proc.start()
+        proc.wait()
+        durations.append(time.monotonic() - start)
+    return durations
+
+
+def report(name, durations):
+    """Print the statistics of the durations."""
+    print("%-8s median %.3f s, mean %.3f s, min %.3f s, max %.3f s" % (
+        name, statistics.median(durations), statistics.mean(durations), min(durations), max(durations)))
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--preload', nargs='*', default=['numpy'], help="Modules to preload")
+    parser.add_argument('--script', help="Script to run, by default one importing the preloaded modules")
+    parser.add_argument('--python', default=sys.executable, help="Python interpreter")
+    parser.add_argument('--repeat', type=int, default=10, help="Number of runs of each kind")
+    parser.add_argument('script_args', nargs='*', help="Arguments of the script")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        script = args.script
+        if script is None:
+            script = os.path.join(tmpdir, 'import_only.py')
+            with open(script, 'w') as fpt:
+                fpt.write(''.join('import %s\n' % module for module in args.preload))
+        cmd = [args.python, script] + args.script_args
+
+        launcher = WarmLauncher(args.preload, python=args.python)
+        launcher.start()
+        # The first fork waits for the fork server to preload the modules
+        report('first', time_jobs(cmd, 1, launcher))
+        report('popen', time_jobs(cmd, args.repeat))
+        report('warm', time_jobs(cmd, args.repeat, launcher))
+
+
+if __name__ == '__main__':
+    main()
@@ -25,6 +25,8 @@
 import argparse
 import logging
 import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from posttroll.publisher import Publish
 from posttroll.subscriber import Subscribe
@@ -39,8 +41,30 @@ LOOP = True
 LOG = logging.getLogger('l1c-runner')
 
 
+def _process_and_publish(l1c_proc, job, publisher, publish_lock):
+    """Process the level-1c job, and publish the level-1c file as soon as it is done."""
+    try:
+        l1c_proc.process(job)
+    except Exception:
+        LOG.exception("L1C processing has failed.")
+        return
+    if job.l1cfile is not None:
+        pub_msg = prepare_l1c_message(job.l1cfile,
+                                      job.message_data,
+                                      orbit=job.orbit_number)
+        with publish_lock:
+            publish_l1c(publisher, pub_msg,
+                        publish_topic=l1c_proc.publish_topic)
+        LOG.info("L1C processing has completed.")
+    else:
+        LOG.warning("L1C processing has failed.")
+
+
 def _run_subscribe_publisher(l1c_proc, service_name, subscriber, publisher):
-    """The porsttroll subscribe/publisher runner."""
+    """The porsttroll subscribe/publisher runner.
+
+    Up to `num_of_cpus` messages are processed at once, each in its own job.
+    """
 
     def signal_handler(sig, frame):
         LOG.warning('You pressed Ctrl+C!')
@@ -49,28 +73,34 @@ def _run_subscribe_publisher(l1c_proc, service_name, subscriber, publisher):
 
     signal.signal(signal.SIGINT, signal_handler)
 
-    while LOOP:
-        for msg in subscriber.recv():
-            l1c_proc.initialize(service_name)
-            LOG.debug(
-                "Received message data = %s", l1c_proc.message_data)
-
-            if not msg:
-                continue
-            try:
-                l1c_proc.run(msg)
-            except MessageTypeNotSupported as err:
-                LOG.warning(err)
-                continue
-            if l1c_proc.l1cfile is not None:
-                pub_msg = prepare_l1c_message(l1c_proc.l1cfile,
-                                              l1c_proc.message_data,
-                                              orbit=l1c_proc.orbit_number)
-                publish_l1c(publisher, pub_msg,
-                            publish_topic=l1c_proc.publish_topic)
-                LOG.info("L1C processing has completed.")
-            else:
-                LOG.warning("L1C processing has failed.")
+    LOG.info("Processing up to %d messages at once", l1c_proc.num_of_cpus)
+    executor = ThreadPoolExecutor(max_workers=l1c_proc.num_of_cpus, thread_name_prefix='l1c-job')
+    # Wait for a free job before taking the next message, the messages left are kept by the subscriber
+    free_jobs = threading.BoundedSemaphore(l1c_proc.num_of_cpus)
+    publish_lock = threading.Lock()
+
+    def run_job(job):
+        try:
+            _process_and_publish(l1c_proc, job, publisher, publish_lock)
+        finally:
+            free_jobs.release()
+
+    try:
+        while LOOP:
+            for msg in subscriber.recv():
+                if not msg:
+                    continue
+                try:
+                    job = l1c_proc.create_job(msg)
+                except MessageTypeNotSupported as err:
+                    LOG.warning(err)
+                    continue
+                LOG.debug(
+                    "Received message data = %s", job.message_data)
+                free_jobs.acquire()
+                executor.submit(run_job, job)
+    finally:
+        executor.shutdown(wait=True)
 
 
 def l1c_runner(config_filename, service_name):
@@ -81,7 +111,11 @@ def l1c_runner(config_filename, service_name):
     publish_name = service_name + '-runner'
     with Subscribe('', l1c_proc.subscribe_topics, True) as sub:
         with Publish(publish_name, 0, nameservers=l1c_proc.nameservers) as pub:
-            _run_subscribe_publisher(l1c_proc, service_name, sub, pub)
+            try:
+                l1c_proc.start()
+                _run_subscribe_publisher(l1c_proc, service_name, sub, pub)
+            finally:
+                l1c_proc.close()
 
 
 def get_arguments():
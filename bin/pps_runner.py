@@ -28,19 +28,30 @@ import logging
 import os
 import sys
 import threading
-from datetime import datetime, timezone
-from queue import Empty, Queue
-from subprocess import PIPE, Popen
+from queue import Empty, Full, Queue
 
+from nwcsafpps_runner import job_journal
+from nwcsafpps_runner.batch import run_batch
+from nwcsafpps_runner.concurrency import (create_concurrency_controller,
+                                          get_concurrency_bounds)
 from nwcsafpps_runner.config import get_config
+from nwcsafpps_runner.cpu_slots import create_pool_cpu_slots
+from nwcsafpps_runner.dedup import create_dedup_index, report_duplicate
+from nwcsafpps_runner.granule_coalescing import create_granule_coalescer
+from nwcsafpps_runner.job_failures import create_job_failures
+from nwcsafpps_runner.job_journal import record_scene
 from nwcsafpps_runner.publish_and_listen import FileListener, FilePublisher
-from nwcsafpps_runner.utils import (SENSOR_LIST, PpsRunError,
-                                    create_pps_call_command,
-                                    create_xml_timestat_from_lvl1c,
-                                    find_product_statistics_from_lvl1c,
-                                    get_lvl1c_file_from_msg, logreader,
-                                    publish_pps_files, ready2run,
-                                    terminate_process)
+from nwcsafpps_runner.metrics import (register_pool, start_metrics_server,
+                                      time_phase)
+from nwcsafpps_runner.nwp_dependency import create_nwp_gate, start_nwp_listener
+from nwcsafpps_runner.pge_progress import get_running_jobs
+from nwcsafpps_runner.pps_jobs import handle_late_scene, run_pps_if_fresh
+from nwcsafpps_runner.resource_classes import (create_resource_classes,
+                                               find_resource_class)
+from nwcsafpps_runner.runtime_model import create_runtime_model
+from nwcsafpps_runner.scheduler import NewestFirstScheduler, create_scheduler
+from nwcsafpps_runner.utils import create_scene_from_msg, ready2run, scene_is_too_old
+from nwcsafpps_runner.worker_pool import WorkerPool
 
 LOG = logging.getLogger(__name__)
 
@@ -55,155 +66,17 @@ _DEFAULT_LOG_FORMAT = '[%(levelname)s: %(asctime)s : %(name)s] %(message)s'
 LOG.debug("PYTHONPATH: " + str(sys.path))
 
 
-class ThreadPool(object):
+def open_job_journal(options):
+    """Open the job journal, if configured, and get the messages of the jobs to resume."""
+    filename = options.get('job_journal')
+    if not filename:
+        return None, []
 
-    def __init__(self, max_nthreads=None):
-
-        self.jobs = set()
-        self.sema = threading.Semaphore(max_nthreads)
-        self.lock = threading.Lock()
-
-    def new_thread(self, job_id, group=None, target=None, name=None, args=(), kwargs={}):
-
-        def new_target(*args, **kwargs):
-            with self.sema:
-                result = target(*args, **kwargs)
-
-            self.jobs.remove(job_id)
-            return result
-
-        with self.lock:
-            if job_id in self.jobs:
-                LOG.info("Job with id %s already running!", str(job_id))
-                return
-
-            self.jobs.add(job_id)
-
-        thread = threading.Thread(group, new_target, name, args, kwargs)
-        thread.start()
-
-
-def pps_worker(scene, publish_q, input_msg, options):
-    """Start PPS on a scene.
-
-    scene = {'platform_name': platform_name,
-             'orbit_number': orbit_number,
-             'satday': satday, 'sathour': sathour,
-             'starttime': starttime, 'endtime': endtime}
-    """
-
-    try:
-        LOG.info("Starting pps runner for scene %s", str(scene))
-        job_start_time = datetime.now(tz=timezone.utc)
-
-        LOG.debug("Level-1c file: %s", scene['file4pps'])
-        LOG.debug("Platform name: %s", scene['platform_name'])
-        LOG.debug("Orbit number: %s", str(scene['orbit_number']))
-
-        min_thr = options['maximum_pps_processing_time_in_minutes']
-        LOG.debug("Maximum allowed  PPS processing time in minutes: %d", min_thr)
-
-        py_exec = options.get('python')
-        pps_run_all = options.get('run_all_script')
-        pps_script = pps_run_all.get('name')
-        pps_run_all_flags = pps_run_all.get('flags')
-        if not pps_run_all_flags:
-            pps_run_all_flags = []
-
-        cmd_str = create_pps_call_command(py_exec, pps_script, scene)
-        for flag in pps_run_all_flags:
-            cmd_str = cmd_str + ' %s' % flag
-
-        my_env = os.environ.copy()
-        for envkey in my_env:
-            LOG.debug("ENV: " + str(envkey) + " " + str(my_env[envkey]))
-
-        pps_output_dir = my_env.get('SM_PRODUCT_DIR', options.get('pps_outdir', './'))
-        LOG.debug("PPS_OUTPUT_DIR = " + str(pps_output_dir))
-        LOG.debug("...from config file = " + str(options['pps_outdir']))
-
-        LOG.debug("Run command: " + str(cmd_str))
-        try:
-            pps_all_proc = Popen(cmd_str.split(" "), shell=False, stderr=PIPE, stdout=PIPE)
-        except PpsRunError:
-            LOG.exception("Failed in PPS...")
-
-        t__ = threading.Timer(min_thr * 60.0, terminate_process, args=(pps_all_proc, scene, ))
-        t__.start()
-
-        out_reader = threading.Thread(
-            target=logreader, args=(pps_all_proc.stdout, LOG.info))
-        err_reader = threading.Thread(
-            target=logreader, args=(pps_all_proc.stderr, LOG.info))
-        out_reader.start()
-        err_reader.start()
-        out_reader.join()
-        err_reader.join()
-
-        LOG.info("Ready with PPS level-2 processing on scene: " + str(scene))
-
-        if options['run_cmask_prob']:
-            pps_script = options.get('run_cmaprob_script')
-            cmdl = create_pps_call_command(py_exec, pps_script, scene)
-
-            LOG.debug("Run command: " + str(cmdl))
-            try:
-                pps_cmaprob_proc = Popen(cmdl.split(" "), shell=False, stderr=PIPE, stdout=PIPE)
-            except PpsRunError:
-                LOG.exception("Failed when trying to run the PPS Cma-prob")
-            timer_cmaprob = threading.Timer(min_thr * 60.0, terminate_process,
-                                            args=(pps_cmaprob_proc, scene, ))
-            timer_cmaprob.start()
-
-            out_reader2 = threading.Thread(
-                target=logreader, args=(pps_cmaprob_proc.stdout, LOG.info))
-            err_reader2 = threading.Thread(
-                target=logreader, args=(pps_cmaprob_proc.stderr, LOG.info))
-            out_reader2.start()
-            err_reader2.start()
-            out_reader2.join()
-            err_reader2.join()
-
-        pps_control_path = my_env.get('SM_STATISTICS_DIR', options.get('pps_statistics_dir', './'))
-        xml_files = create_xml_timestat_from_lvl1c(scene, pps_control_path)
-        xml_files += find_product_statistics_from_lvl1c(scene, pps_control_path)
-        LOG.info("PPS summary statistics files: %s", str(xml_files))
-
-        # The PPS post-hooks takes care of publishing the PPS cloud products
-        # For the XML files we keep the publishing from here:
-        publish_pps_files(input_msg, publish_q, scene, xml_files,
-                          servername=options['servername'],
-                          station=options['station'])
-
-        dt_ = datetime.now(tz=timezone.utc) - job_start_time
-        LOG.info("PPS on scene " + str(scene) + " finished. It took: " + str(dt_))
-
-        t__.cancel()
-        if options['run_cmask_prob']:
-            timer_cmaprob.cancel()
-
-    except Exception:
-        LOG.exception('Failed in pps_worker...')
-        raise
-
-
-def check_threads(threads):
-    """Scan all threads and join those that are finished (dead)."""
-
-    # LOG.debug(str(threading.enumerate()))
-    for i, thread in enumerate(threads):
-        if thread.is_alive():
-            LOG.info("Thread " + str(i) + " alive...")
-        else:
-            LOG.info(
-                "Thread " + str(i) + " is no more alive...")
-            thread.join()
-            threads.remove(thread)
-
-
-def run_pps(scene, publish_q, input_msg, options):
-    """Run pps. No parallel running here."""
-    pps_worker(scene, publish_q, input_msg, options)
+    journal = job_journal.JobJournal(filename)
+    journal.prune(options.get('job_journal_keep_days', 7))
+    resumed = journal.get_unfinished_messages(max_attempts=options.get('job_journal_max_attempts', 3))
+    LOG.info("Job journal %s: resuming %d unfinished jobs", filename, len(resumed))
+    return journal, resumed
 
 
 def pps(options):
@@ -216,67 +89,211 @@ def pps(options):
     LOG.info("Use level-1c file as input")
 
     LOG.info("Number of threads: %d", options['number_of_threads'])
-    thread_pool = ThreadPool(options['number_of_threads'])
+    max_pending = int(options.get('max_pending_jobs', 100))
+    overflow_policy = options.get('job_queue_overflow_policy', 'block')
+    LOG.info("Pending job queue size: %d, overflow policy: %s", max_pending, overflow_policy)
+
+    journal, resumed = open_job_journal(options)
 
-    listener_q = Queue()
+    if options.get('execution_engine', 'threads') == 'asyncio':
+        from nwcsafpps_runner.async_runner import pps_async
+        try:
+            pps_async(options, journal, resumed)
+        finally:
+            if journal is not None:
+                journal.close()
+        return
+
+    runtime_model = create_runtime_model(options)
+
+    def drop_job(job):
+        if journal is not None:
+            journal.record(job.job_id, job_journal.DROPPED)
+        if dedup is not None:
+            dedup.job_failed(job.scene)
+
+    nworkers, _ = get_concurrency_bounds(options)
+    worker_pool = WorkerPool(nworkers, max_pending=max_pending,
+                             overflow_policy=overflow_policy,
+                             scheduler=create_scheduler(options, runtime_model),
+                             on_evict=drop_job)
+    controller = create_concurrency_controller(options, worker_pool)
+    if controller is not None:
+        controller.start()
+
+    resource_classes = create_resource_classes(options)
+    reprocess_late = options.get('late_scene_policy', 'skip') == 'reprocess'
+    late_threads = options.get('late_scene_threads', 1) if reprocess_late else 0
+    cpu_slots, class_cpu_slots, late_cpu_slots = create_pool_cpu_slots(options, resource_classes, late_threads)
+    class_pools = {}
+    for resource_class in resource_classes:
+        class_options = resource_class.options
+        class_pools[resource_class.name] = WorkerPool(int(class_options['number_of_threads']),
+                                                      max_pending=int(class_options.get('max_pending_jobs', 100)),
+                                                      overflow_policy=class_options['job_queue_overflow_policy'],
+                                                      scheduler=create_scheduler(class_options, runtime_model),
+                                                      name='pps-%s-worker' % resource_class.name,
+                                                      on_evict=drop_job)
+
+    if overflow_policy == 'block':
+        # Let a full job queue propagate back to the listener
+        listener_q = Queue(maxsize=max(max_pending, 0))
+    else:
+        listener_q = Queue()
     publisher_q = Queue()
 
+    def dispatch_fallback(msg):
+        try:
+            listener_q.put_nowait(msg)
+        except Full:
+            LOG.warning("Listener queue full, can not dispatch the duplicate: %s", str(msg))
+
+    dedup = create_dedup_index(options, on_fallback=dispatch_fallback)
+    failures = create_job_failures(options, publisher_q)
+
+    late_pool = None
+    if reprocess_late:
+        LOG.info("Scenes too old to be processed in time are put in the reprocess-later lane")
+        late_pool = WorkerPool(options.get('late_scene_threads', 1), max_pending=max_pending,
+                               overflow_policy='drop_oldest',
+                               scheduler=NewestFirstScheduler(),
+                               name='pps-late-worker',
+                               on_evict=drop_job)
+
     pub_thread = FilePublisher(publisher_q, options['publish_topic'], runner_name='pps_runner',
                                nameservers=options.get('nameservers', None))
     pub_thread.start()
     listen_thread = FileListener(listener_q, options['subscribe_topics'])
     listen_thread.start()
 
+    for pool in [worker_pool, late_pool] + list(class_pools.values()):
+        if pool is not None:
+            register_pool(pool)
+    metrics_server = start_metrics_server(options)
+
+    coalescer = create_granule_coalescer(options)
+    nwp_gate = create_nwp_gate(options)
+    nwp_listener = start_nwp_listener(options, nwp_gate)
+    # With the coalescer, the NWP gate or the job retries, wake up regularly to dispatch the granule groups
+    # whose window has passed, the scenes whose NWP data has come and the jobs due for a retry
+    listener_timeout = 1 if coalescer is not None or nwp_gate is not None or failures is not None else None
+
+    def submit_job(scene, msg):
+        if failures is not None and failures.hold(scene, msg):
+            return
+        LOG.debug("Files for PPS: %s", str(scene.get('files4pps', scene['file4pps'])))
+        resource_class = find_resource_class(resource_classes, scene)
+        if resource_class is None:
+            pool, job_options, job_cpu_slots = worker_pool, options, cpu_slots
+        else:
+            pool, job_options = class_pools[resource_class.name], resource_class.options
+            job_cpu_slots = class_cpu_slots[resource_class.name]
+        if pool.is_pending(scene['file4pps']):
+            LOG.info("Job with id %s already pending or running!", str(scene['file4pps']))
+            return
+        LOG.info('Put pps job on the %s queue...', pool.name)
+
+        # Record the job before a worker can pick it up and record it running
+        record_scene(journal, scene, job_journal.ACCEPTED, msg)
+        accepted = pool.submit(scene['file4pps'],
+                               target=run_pps_if_fresh, args=(scene,
+                                                              publisher_q,
+                                                              msg, job_options),
+                               kwargs={'late_pool': late_pool,
+                                       'journal': journal,
+                                       'cpu_slots': job_cpu_slots,
+                                       'dedup': dedup,
+                                       'runtime_model': runtime_model,
+                                       'failures': failures,
+                                       'late_cpu_slots': late_cpu_slots},
+                               scene=scene)
+        if not accepted:
+            record_scene(journal, scene, job_journal.DROPPED)
+            if dedup is not None:
+                # Let the scene from another station run instead
+                dedup.job_failed(scene)
+
+    def submit_jobs(ready):
+        if nwp_gate is not None:
+            ready = [job for ready_scene, ready_msg in ready for job in nwp_gate.add(ready_scene, ready_msg)]
+        for ready_scene, ready_msg in ready:
+            submit_job(ready_scene, ready_msg)
+
     while True:
-        try:
-            msg = listener_q.get()
-        except Empty:
-            continue
+        if coalescer is not None:
+            submit_jobs(coalescer.flush_expired())
+        if nwp_gate is not None:
+            for ready_scene, ready_msg in nwp_gate.flush():
+                submit_job(ready_scene, ready_msg)
+        if failures is not None:
+            for ready_scene, ready_msg in failures.flush():
+                submit_job(ready_scene, ready_msg)
+
+        from_journal = bool(resumed)
+        if resumed:
+            msg = resumed.pop(0)
+        else:
+            try:
+                msg = listener_q.get(timeout=listener_timeout)
+            except Empty:
+                continue
 
         LOG.debug(
             "Number of threads currently alive: " + str(threading.active_count()))
-        if 'sensor' in msg.data and isinstance(msg.data['sensor'], list):
-            msg.data['sensor'] = msg.data['sensor'][0]
-        if 'orbit_number' not in msg.data:
-            msg.data.update({'orbit_number': 99999})
-        if 'end_time' not in msg.data:
-            msg.data.update({'end_time': 99999})
-
-        orbit_number = int(msg.data['orbit_number'])
-        platform_name = msg.data['platform_name']
-        starttime = msg.data['start_time']
-        endtime = msg.data['end_time']
-
-        satday = starttime.strftime('%Y%m%d')
-        sathour = starttime.strftime('%H%M')
-        sensors = SENSOR_LIST.get(platform_name, None)
-        scene = {'platform_name': platform_name,
-                 'orbit_number': orbit_number,
-                 'satday': satday, 'sathour': sathour,
-                 'starttime': starttime, 'endtime': endtime,
-                 'sensor': sensors
-                 }
-
-        scene['file4pps'] = get_lvl1c_file_from_msg(msg)
-        status = ready2run(msg, scene)
+        scene = create_scene_from_msg(msg)
+        with time_phase('checks'):
+            status = ready2run(msg, scene)
+        if status and scene_is_too_old(scene, options.get('max_scene_age_minutes')):
+            handle_late_scene(scene, publisher_q, msg, options, late_pool, journal, late_cpu_slots, dedup,
+                              runtime_model)
+            status = False
+        if status and dedup is not None and not from_journal:
+            original = dedup.check(scene, msg)
+            if original is not None:
+                report_duplicate(dedup, scene, publisher_q, msg, original, options)
+                status = False
 
         if status:
-
-            LOG.debug("Files for PPS: %s", str(scene['file4pps']))
-            LOG.info('Start a thread runing pps...')
-
-            if options['number_of_threads'] == 1:
-                run_pps(scene, publisher_q, msg, options)
+            if coalescer is not None:
+                submit_jobs(coalescer.add(scene, msg))
             else:
-                thread_pool.new_thread(scene['file4pps'],
-                                       target=run_pps, args=(scene,
-                                                             publisher_q,
-                                                             msg, options))
+                submit_jobs([(scene, msg)])
 
             LOG.debug("Number of threads currently alive: %s", str(threading.active_count()))
-
-    # FIXME! Should I clean up the thread_pool (open threads?) here at the end!?
-
+            LOG.debug("Worker pool metrics: %s", str(worker_pool.get_metrics()))
+            for name, class_pool in class_pools.items():
+                LOG.debug("Worker pool metrics of resource class %s: %s", name, str(class_pool.get_metrics()))
+            if cpu_slots is not None:
+                LOG.debug("Cpu slot metrics: %s", str(cpu_slots.get_metrics()))
+            if controller is not None:
+                LOG.debug("Concurrency controller metrics: %s", str(controller.get_metrics()))
+            if dedup is not None:
+                LOG.debug("Dedup index metrics: %s", str(dedup.get_metrics()))
+            if runtime_model is not None:
+                LOG.debug("Runtime model metrics: %s", str(runtime_model.get_metrics()))
+            if nwp_gate is not None:
+                LOG.debug("NWP gate metrics: %s", str(nwp_gate.get_metrics()))
+            if failures is not None:
+                LOG.debug("Job failure metrics: %s", str(failures.get_metrics()))
+            LOG.debug("Running PGEs: %s", str(get_running_jobs()))
+
+    if controller is not None:
+        controller.stop()
+    worker_pool.shutdown()
+    for class_pool in class_pools.values():
+        class_pool.shutdown()
+    if late_pool is not None:
+        late_pool.shutdown()
+    if journal is not None:
+        journal.close()
+    if dedup is not None:
+        dedup.close()
+    if runtime_model is not None:
+        runtime_model.close()
+    if metrics_server is not None:
+        metrics_server.stop()
+    if nwp_listener is not None:
+        nwp_listener.stop()
     pub_thread.stop()
     listen_thread.stop()
 
@@ -284,10 +301,18 @@ def pps(options):
 def get_arguments():
     """Get command line arguments."""
     parser = argparse.ArgumentParser()
-    parser.add_argument('test_with_l1c_files',
-                        metavar='fileN', type=str, nargs='+',
+    parser.add_argument('--batch',
+                        metavar='PATH', type=str, nargs='+',
                         default=[],
-                        help="To test for l1c file with patched subscriber")
+                        help="Reprocess these level-1c files and exit: directories, glob patterns, " +
+                        "files or @files listing level-1c files")
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=None,
+                        help="Number of jobs in parallel in batch mode, default = number_of_threads")
+    parser.add_argument('--publish',
+                        action='store_true',
+                        help="Publish the products in batch mode")
     parser.add_argument('-c', '--config_file',
                         type=str,
                         dest='config_file',
@@ -338,15 +363,7 @@ if __name__ == "__main__":
     LOG = logging.getLogger('pps_runner')
     LOG.debug("Path to PPS-runner config file = {:s}".format(args.config_file))
 
-    if args.test_with_l1c_files != []:
-        from posttroll.message import Message
-        from posttroll.testing import patched_subscriber_recv
-        some_files = args.test_with_l1c_files
-        messages = [Message("some_topic", "file", data={"uri": f, "orbit_number": 00000, "sensor": "avhrr",
-                                                        'platform_name': "EOS-Aqua",
-                                                        "start_time": datetime(2024, 4, 9, 8, 3)})
-                    for f in some_files]
-        subscriber_settings = dict(nameserver=False, addresses=["ipc://bla"])
-        with patched_subscriber_recv(messages):
-            pps(OPTIONS)
+    if args.batch:
+        summary = run_batch(OPTIONS, args.batch, args.jobs, args.publish).log()
+        sys.exit(1 if summary['failed'] else 0)
     pps(OPTIONS)
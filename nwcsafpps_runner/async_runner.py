@@ -0,0 +1,755 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""An asyncio execution engine for the PPS runner.
+
+Scheduling, the PPS subprocesses, the reading of their output, the time
+outs and the publishing of the results all run in one event loop, instead
+of one thread per job plus two log reader threads and a timer thread per
+subprocess. Only the posttroll listener keeps its own thread, and each
+subprocess a thread waiting for it with wait4, for its resource usage.
+The steps of a job around the PPS processes are the ones of the thread
+based runner (see `nwcsafpps_runner.pps_jobs`), run in the default
+executor of the loop as they read and write files and the job journal.
+
+The engine is selected with `execution_engine: asyncio` in the runner
+config, and uses the same config keys as the thread based runner.
+"""
+
+import asyncio
+import functools
+import logging
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from subprocess import PIPE, STDOUT, Popen
+
+from posttroll.publisher import Publish
+
+from nwcsafpps_runner import job_journal
+from nwcsafpps_runner.concurrency import (create_concurrency_controller,
+                                          get_concurrency_bounds)
+from nwcsafpps_runner.cpu_slots import (create_pool_cpu_slots, format_slot,
+                                        get_slot_env, split_slot)
+from nwcsafpps_runner.metrics import (count_event, observe_phase,
+                                      register_pool, start_metrics_server,
+                                      time_phase)
+from nwcsafpps_runner.process_supervisor import (DEFAULT_KILL_GRACE_SECONDS,
+                                                 ProcessResult,
+                                                 get_process_limits,
+                                                 get_process_limits_prefix,
+                                                 process_group_alive,
+                                                 run_supervised,
+                                                 signal_process_group,
+                                                 wait_for_process)
+from nwcsafpps_runner.dedup import create_dedup_index, report_duplicate
+from nwcsafpps_runner.granule_coalescing import (create_granule_coalescer,
+                                                 get_multi_granule_mode,
+                                                 iter_granules)
+from nwcsafpps_runner.job_failures import (check_exit_status,
+                                           create_job_failures)
+from nwcsafpps_runner.job_journal import record_scene
+from nwcsafpps_runner.job_logs import create_job_log
+from nwcsafpps_runner.nwp_dependency import create_nwp_gate, start_nwp_listener
+from nwcsafpps_runner.output_watcher import start_output_watcher
+from nwcsafpps_runner.pge_progress import (create_job_progress,
+                                           get_running_jobs)
+from nwcsafpps_runner.pps_jobs import (get_cmask_prob_command,
+                                       get_pps_output_dir, log_job_end,
+                                       log_job_start, make_product_publisher,
+                                       publish_job_statistics,
+                                       record_job_failed, record_job_finished,
+                                       record_job_started, record_time_out,
+                                       report_late_scene,
+                                       republish_existing_products)
+from nwcsafpps_runner.publish_and_listen import FileListener
+from nwcsafpps_runner.resource_classes import (create_resource_classes,
+                                               find_resource_class)
+from nwcsafpps_runner.runtime_model import (create_runtime_model,
+                                            get_timeout_seconds)
+from nwcsafpps_runner.scheduler import NewestFirstScheduler, create_scheduler
+from nwcsafpps_runner.utils import (CMASK_PROB_POLL_SECONDS,
+                                    cmask_prob_dependencies_ready,
+                                    create_pps_run_all_command,
+                                    create_scene_from_msg,
+                                    get_cmask_prob_mode, ready2run,
+                                    scene_is_too_old)
+from nwcsafpps_runner.warm_launcher import get_warm_launcher
+from nwcsafpps_runner.worker_pool import JobQueue
+
+LOG = logging.getLogger(__name__)
+
+#: Seconds between two tries to get a free cpu slot
+CPU_SLOT_POLL_SECONDS = 0.5
+
+
+async def to_thread(func, *args, **kwargs):
+    """Run the blocking call in the default executor of the loop, like asyncio.to_thread of python 3.9."""
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+class AsyncQueueAdaptor(object):
+    """Let a thread put items on an asyncio queue, waiting while the queue is full."""
+
+    def __init__(self, aqueue, loop):
+        self.aqueue = aqueue
+        self.loop = loop
+
+    def put(self, item):
+        """Put the item on the queue."""
+        try:
+            in_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            self.aqueue.put_nowait(item)
+        else:
+            asyncio.run_coroutine_threadsafe(self.aqueue.put(item), self.loop).result()
+
+
+class PublisherAdaptor(object):
+    """Send the messages put on this 'queue' directly with the publisher, from the event loop."""
+
+    def __init__(self, publisher, loop=None):
+        self.publisher = publisher
+        self.loop = loop
+
+    def put(self, msg):
+        """Send the message, handing it over to the event loop when put from another thread."""
+        try:
+            in_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            in_loop = False
+        if self.loop is None or in_loop:
+            LOG.info("Publish the files...")
+            self.publisher.send(msg)
+        else:
+            self.loop.call_soon_threadsafe(self.put, msg)
+
+
+class AsyncLane(JobQueue):
+    """A number of worker coroutines fed from a bounded, scheduled job queue.
+
+    This is the asyncio counterpart of the WorkerPool, sharing its job queue.
+    """
+
+    def __init__(self, nworkers, max_pending=0, overflow_policy='block', scheduler=None,
+                 name='pps-worker', on_evict=None):
+        JobQueue.__init__(self, nworkers, max_pending=max_pending, overflow_policy=overflow_policy,
+                          scheduler=scheduler, name=name, on_evict=on_evict)
+        self._cond = None
+        self._loop = None
+        self._tasks = []
+
+    def start(self):
+        """Start the worker coroutines, from within the running event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._cond = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._work(), name="%s-%d" % (self.name, idx))
+                       for idx in range(self.nworkers)]
+
+    def get_metrics(self):
+        """Return a snapshot of the queue and job counters."""
+        return self._get_metrics()
+
+    def get_recent_durations(self):
+        """Return the durations in seconds of the last jobs, oldest first."""
+        return list(self.recent_durations)
+
+    def set_concurrency(self, nworkers):
+        """Set how many jobs may run at the same time, from the event loop or another thread.
+
+        Return the limit actually set.
+        """
+        limit = self._set_concurrency(nworkers)
+        if self._cond is not None:
+            # The workers are woken up in the event loop, also when the controller runs in the executor
+            asyncio.run_coroutine_threadsafe(self._notify_all(), self._loop)
+        return limit
+
+    async def _notify_all(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+    async def submit(self, job_id, target, args=(), kwargs=None, scene=None):
+        """Put a coroutine function call on the job queue, return True if accepted."""
+        async with self._cond:
+            admitted = self._admit(job_id)
+            if admitted is None:
+                await self._cond.wait_for(lambda: not self._queue_full())
+            elif not admitted:
+                return False
+            self._put(job_id, target, args, kwargs, scene)
+            self._cond.notify_all()
+        return True
+
+    async def _work(self):
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(self._can_start)
+                job = self._take()
+                self._cond.notify_all()
+            failed = False
+            start_time = time.monotonic()
+            if job.submitted is not None:
+                observe_phase('queue_wait', start_time - job.submitted)
+            try:
+                await job.target(*job.args, **job.kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                failed = True
+                LOG.exception("Job %s failed", str(job.job_id))
+            finally:
+                async with self._cond:
+                    self._done(job, failed, start_time)
+                    self._cond.notify_all()
+
+    async def shutdown(self):
+        """Cancel the worker coroutines."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+async def open_stream_reader(pipe):
+    """Get an asyncio stream reading the pipe of a subprocess."""
+    reader = asyncio.StreamReader()
+    await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    return reader
+
+
+async def drain_stream(stream, log_func):
+    """Read the stream line by line until it is closed, and log each line."""
+    while True:
+        line = await stream.readline()
+        if not line:
+            break
+        log_func(line.decode(errors='replace').strip())
+
+
+async def terminate_process_group_async(pgid, grace_seconds=DEFAULT_KILL_GRACE_SECONDS):
+    """Terminate all processes of the group, with SIGTERM first and SIGKILL after *grace_seconds*."""
+    if not signal_process_group(pgid, signal.SIGTERM):
+        return
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + grace_seconds
+    while loop.time() < deadline:
+        if not process_group_alive(pgid):
+            return
+        await asyncio.sleep(0.1)
+    LOG.warning("Process group %d still alive %.0f s after SIGTERM, sending SIGKILL", pgid, grace_seconds)
+    signal_process_group(pgid, signal.SIGKILL)
+
+
+async def run_subprocess(cmd_str, scene, timeout_seconds, options=None, cpu_slot=None, executor=None):
+    """Run the command in its own process group, log its output and kill the group if not finished in time.
+
+    If a *cpu_slot* is given, the process is pinned to its cpus. The output
+    is written to a job log instead of logged if `job_logs` are configured,
+    and the PGEs run by the command are followed from it. The process (or
+    the command forked from the warm launcher) is waited for in a thread of
+    *executor*, the default executor if None.
+
+    Return a ProcessResult with the resource usage of the process, as
+    `run_supervised` does.
+    """
+    options = options or {}
+    loop = asyncio.get_running_loop()
+    if get_warm_launcher(options) is not None:
+        # Forking from the warm interpreter and waiting for the fork block, keep them out of the event loop
+        return await loop.run_in_executor(executor, run_supervised, cmd_str, scene, timeout_seconds, options, None,
+                                          cpu_slot)
+    limits = get_process_limits(options)
+    grace_seconds = options.get('kill_grace_seconds', DEFAULT_KILL_GRACE_SECONDS)
+    cpus = cpu_slot.cpus if cpu_slot is not None else None
+    cmd = get_process_limits_prefix(limits, cpus) + cmd_str.split(" ")
+    LOG.debug("Run command: " + str(cmd))
+    progress = create_job_progress(scene, cmd_str)
+    job_log = create_job_log(options, scene, cmd_str, progress)
+
+    def log_line(line):
+        progress.feed(line)
+        LOG.info(line)
+
+    # Not started with asyncio, whose child watcher would reap the process before wait4 gets its resource usage.
+    # The job log gets stdout and stderr together.
+    proc = Popen(cmd, stdout=PIPE, stderr=STDOUT if job_log else PIPE, env=get_slot_env(cpu_slot),
+                 start_new_session=True)
+    if job_log is not None:
+        drained = asyncio.ensure_future(job_log.drain_async(await open_stream_reader(proc.stdout)))
+    else:
+        drained = asyncio.gather(drain_stream(await open_stream_reader(proc.stdout), log_line),
+                                 drain_stream(await open_stream_reader(proc.stderr), log_line))
+    waited = loop.run_in_executor(executor, wait_for_process, proc.pid)
+    timed_out = False
+    try:
+        proc.returncode, rusage = await asyncio.wait_for(asyncio.shield(waited), timeout_seconds)
+    except asyncio.TimeoutError:
+        timed_out = True
+        LOG.info("Process timed out and pre-maturely terminated. Scene: " + str(scene))
+        count_event('process_timeouts')
+        await terminate_process_group_async(proc.pid, grace_seconds)
+        proc.returncode, rusage = await waited
+    if process_group_alive(proc.pid):
+        LOG.info("Processes left in the group after the main process ended, terminating them")
+        await terminate_process_group_async(proc.pid, grace_seconds)
+    await drained
+    if job_log is not None:
+        job_log.close()
+    progress.finish()
+    if not timed_out:
+        LOG.info("Process finished before time out - workerScene: " + str(scene))
+    LOG.info("Process exit code: %s, %s, resource usage: %s", str(proc.returncode), format_slot(cpu_slot),
+             str(rusage))
+    return ProcessResult(proc.returncode, timed_out, rusage)
+
+
+async def acquire_cpu_slot(cpu_slots, job_id):
+    """Get a free cpu slot for the job, waiting in the event loop for one if needed."""
+    while True:
+        cpu_slot = cpu_slots.acquire(job_id, timeout=0)
+        if cpu_slot is not None:
+            return cpu_slot
+        await asyncio.sleep(CPU_SLOT_POLL_SECONDS)
+
+
+async def run_cmask_prob_async(scene, options, deadline, run_all_done=None, pps_output_dir='./', cpu_slot=None,
+                               executor=None, abort=None):
+    """Run ppsCmaskProb before the *deadline* (an event loop time).
+
+    If *run_all_done* is given, wait until it is set (ppsRunAll has
+    finished) or the products listed in `cmask_prob_depends_on` are found
+    in *pps_output_dir* before starting. If the *abort* event is set
+    (ppsRunAll has failed), ppsCmaskProb is not started.
+    """
+    loop = asyncio.get_running_loop()
+    if run_all_done is not None:
+        depends_on = options.get('cmask_prob_depends_on') or []
+        while not (run_all_done.is_set() or
+                   await to_thread(cmask_prob_dependencies_ready, scene, pps_output_dir, depends_on)):
+            if loop.time() >= deadline:
+                break
+            try:
+                await asyncio.wait_for(run_all_done.wait(), CMASK_PROB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    if abort is not None and abort.is_set():
+        LOG.info("ppsRunAll failed, ppsCmaskProb not run on scene: %s", str(scene))
+        return None
+    remaining_seconds = deadline - loop.time()
+    if remaining_seconds <= 0:
+        LOG.warning("No time left to run ppsCmaskProb on scene: %s", str(scene))
+        return ProcessResult(None, True, None)
+    cmdl = get_cmask_prob_command(options, scene)
+    with time_phase('cmask_prob'):
+        result = await run_subprocess(cmdl, scene, remaining_seconds, options, cpu_slot, executor)
+    LOG.info("Ready with ppsCmaskProb on scene: %s", str(scene))
+    return result
+
+
+async def run_pps_scripts_async(scene, options, pps_output_dir, cpu_slot=None, runtime_model=None, executor=None):
+    """Run ppsRunAll, and ppsCmaskProb if configured, on the scene."""
+    timeout_seconds = get_timeout_seconds(scene, options, runtime_model)
+    run_all_cmd = create_pps_run_all_command(options, scene)
+
+    cmask_prob_mode = get_cmask_prob_mode(options)
+    if options['run_cmask_prob'] and cmask_prob_mode != 'sequential':
+        # Both scripts share the time out, and the cpus of the slot
+        deadline = asyncio.get_running_loop().time() + timeout_seconds
+        run_all_slot, cmask_prob_slot = split_slot(cpu_slot)
+        run_all_done = asyncio.Event() if cmask_prob_mode == 'after_pges' else None
+        abort = asyncio.Event()
+        cmask_prob_task = asyncio.create_task(run_cmask_prob_async(scene, options, deadline, run_all_done,
+                                                                   pps_output_dir, cmask_prob_slot, executor, abort))
+        run_all_ok = False
+        try:
+            with time_phase('run_all'):
+                result = await run_subprocess(run_all_cmd, scene, timeout_seconds, options, run_all_slot, executor)
+            if result.timed_out:
+                await to_thread(record_time_out, scene, result, timeout_seconds, runtime_model)
+            check_exit_status(run_all_cmd, result.returncode, result.timed_out)
+            run_all_ok = True
+            LOG.info("Ready with PPS level-2 processing on scene: " + str(scene))
+        finally:
+            if not run_all_ok:
+                abort.set()
+            if run_all_done is not None:
+                run_all_done.set()
+            # The error of ppsRunAll, if any, is the one raised
+            outcome, = await asyncio.gather(cmask_prob_task, return_exceptions=True)
+            if not run_all_ok and isinstance(outcome, Exception):
+                LOG.error("Failed running ppsCmaskProb: %s", str(outcome))
+        if isinstance(outcome, BaseException):
+            raise outcome
+        check_exit_status(get_cmask_prob_command(options, scene), outcome.returncode, outcome.timed_out)
+    else:
+        with time_phase('run_all'):
+            result = await run_subprocess(run_all_cmd, scene, timeout_seconds, options, cpu_slot, executor)
+        if result.timed_out:
+            await to_thread(record_time_out, scene, result, timeout_seconds, runtime_model)
+        check_exit_status(run_all_cmd, result.returncode, result.timed_out)
+        LOG.info("Ready with PPS level-2 processing on scene: " + str(scene))
+
+        if options['run_cmask_prob']:
+            cmdl = get_cmask_prob_command(options, scene)
+            with time_phase('cmask_prob'):
+                result = await run_subprocess(cmdl, scene, timeout_seconds, options, cpu_slot, executor)
+            check_exit_status(cmdl, result.returncode, result.timed_out)
+
+
+async def pps_worker_async(scene, publish_q, input_msg, options, cpu_slot=None, runtime_model=None, executor=None):
+    """Start PPS on a scene, the asyncio way, pinned to the cpus of *cpu_slot* if given.
+
+    This is `pps_jobs.pps_worker` with the PPS processes run in the event
+    loop, and the other steps in its default executor.
+    """
+    log_job_start(scene, options, cpu_slot)
+    job_start_time = datetime.now(tz=timezone.utc)
+
+    pps_output_dir = get_pps_output_dir(options)
+    if await to_thread(republish_existing_products, scene, publish_q, input_msg, options, pps_output_dir):
+        return
+
+    watcher = await to_thread(start_output_watcher, options, pps_output_dir, iter_granules(scene, input_msg),
+                              make_product_publisher(publish_q, options))
+    try:
+        if 'granules' in scene and get_multi_granule_mode(options) == 'sequential':
+            for granule in scene['granules']:
+                await run_pps_scripts_async(granule, options, pps_output_dir, cpu_slot, runtime_model, executor)
+        else:
+            await run_pps_scripts_async(scene, options, pps_output_dir, cpu_slot, runtime_model, executor)
+    finally:
+        if watcher is not None:
+            await to_thread(watcher.stop)
+
+    await to_thread(publish_job_statistics, scene, publish_q, input_msg, options)
+    log_job_end(scene, job_start_time, runtime_model)
+
+
+class AsyncPpsRunner(object):
+    """Dispatch the level-1c messages to PPS jobs in an event loop."""
+
+    def __init__(self, options, publish_q, journal=None, on_fallback=None):
+        self.options = options
+        self.publish_q = publish_q
+        self.journal = journal
+        self.runtime_model = create_runtime_model(options)
+        max_pending = int(options.get('max_pending_jobs', 100))
+        nworkers, _ = get_concurrency_bounds(options)
+        self.lane = AsyncLane(nworkers, max_pending=max_pending,
+                              overflow_policy=options.get('job_queue_overflow_policy', 'block'),
+                              scheduler=create_scheduler(options, self.runtime_model),
+                              on_evict=self._drop_job)
+        self.controller = create_concurrency_controller(options, self.lane)
+        self.resource_classes = create_resource_classes(options)
+        reprocess_late = options.get('late_scene_policy', 'skip') == 'reprocess'
+        late_threads = options.get('late_scene_threads', 1) if reprocess_late else 0
+        self.cpu_slots, self.class_cpu_slots, self.late_cpu_slots = create_pool_cpu_slots(
+            options, self.resource_classes, late_threads)
+        self.class_lanes = {}
+        for resource_class in self.resource_classes:
+            class_options = resource_class.options
+            self.class_lanes[resource_class.name] = AsyncLane(
+                int(class_options['number_of_threads']),
+                max_pending=int(class_options.get('max_pending_jobs', 100)),
+                overflow_policy=class_options['job_queue_overflow_policy'],
+                scheduler=create_scheduler(class_options, self.runtime_model),
+                name='pps-%s-worker' % resource_class.name,
+                on_evict=self._drop_job)
+        self.coalescer = create_granule_coalescer(options)
+        self.nwp_gate = create_nwp_gate(options)
+        self.dedup = create_dedup_index(options, on_fallback=on_fallback)
+        self.failures = create_job_failures(options, publish_q)
+        self.late_lane = None
+        if reprocess_late:
+            self.late_lane = AsyncLane(options.get('late_scene_threads', 1), max_pending=max_pending,
+                                       overflow_policy='drop_oldest',
+                                       scheduler=NewestFirstScheduler(),
+                                       name='pps-late-worker',
+                                       on_evict=self._drop_job)
+        # The PPS processes are waited for in threads, one per process (ppsRunAll and ppsCmaskProb may run at
+        # the same time), kept apart from the default executor
+        self.process_executor = ThreadPoolExecutor(2 * sum(lane.nworkers for lane in self.lanes),
+                                                   thread_name_prefix='pps-process-wait')
+
+    @property
+    def lanes(self):
+        """Get all the lanes of the runner."""
+        lanes = [self.lane] + list(self.class_lanes.values())
+        if self.late_lane is not None:
+            lanes.append(self.late_lane)
+        return lanes
+
+    def _drop_job(self, job):
+        # Called by a lane from the event loop, the journal and dedup index are written to in the executor
+        asyncio.get_running_loop().run_in_executor(None, self._record_dropped_job, job)
+
+    def _record_dropped_job(self, job):
+        if self.journal is not None:
+            self.journal.record(job.job_id, job_journal.DROPPED)
+        if self.dedup is not None:
+            self.dedup.job_failed(job.scene)
+
+    def get_job_options(self, scene):
+        """Get the runner config for the job of the scene, the one of its resource class if any."""
+        resource_class = find_resource_class(self.resource_classes, scene)
+        return self.options if resource_class is None else resource_class.options
+
+    def get_lane(self, scene):
+        """Get the lane of the resource class of the scene, the default lane if it has no class."""
+        resource_class = find_resource_class(self.resource_classes, scene)
+        return self.lane if resource_class is None else self.class_lanes[resource_class.name]
+
+    def get_cpu_slots(self, scene):
+        """Get the cpu slots of the lane of the scene, None if no slots are configured."""
+        resource_class = find_resource_class(self.resource_classes, scene)
+        return self.cpu_slots if resource_class is None else self.class_cpu_slots[resource_class.name]
+
+    async def run_pps(self, scene, input_msg, cpu_slots=None):
+        """Run pps on the scene, on one of the *cpu_slots* of its lane, keeping the journal up to date.
+
+        A job whose platform has been paused while it was waiting in the
+        lane is held until the pause is over.
+        """
+        if self.failures is not None and self.failures.hold(scene, input_msg):
+            return
+        cpu_slot = None
+        if cpu_slots is not None:
+            cpu_slot = await acquire_cpu_slot(cpu_slots, scene['file4pps'])
+        try:
+            await to_thread(record_job_started, scene, self.journal)
+            try:
+                await pps_worker_async(scene, self.publish_q, input_msg, self.get_job_options(scene), cpu_slot,
+                                       self.runtime_model, self.process_executor)
+            except Exception as err:
+                await to_thread(record_job_failed, scene, input_msg, err, self.journal, self.dedup, self.failures)
+                raise
+            await to_thread(record_job_finished, scene, self.journal, self.dedup, self.failures)
+        finally:
+            if cpu_slots is not None:
+                cpu_slots.release(cpu_slot)
+
+    async def handle_late_scene(self, scene, input_msg):
+        """Skip a scene that is too old, or defer it to the reprocess-later lane."""
+        deferred = False
+        if self.late_lane is not None:
+            LOG.info("Put the late scene in the reprocess-later lane: %s", str(scene['file4pps']))
+            await to_thread(record_scene, self.journal, scene, job_journal.ACCEPTED, input_msg)
+            deferred = await self.late_lane.submit(scene['file4pps'], self.run_pps,
+                                                   args=(scene, input_msg, self.late_cpu_slots), scene=scene)
+        await to_thread(report_late_scene, scene, self.publish_q, input_msg, self.options, deferred, self.journal)
+
+    async def run_pps_if_fresh(self, scene, input_msg):
+        """Run pps, unless the scene has become too old while waiting in the queue."""
+        if scene_is_too_old(scene, self.options.get('max_scene_age_minutes')):
+            await self.handle_late_scene(scene, input_msg)
+            return
+        await self.run_pps(scene, input_msg, self.get_cpu_slots(scene))
+
+    def check_message(self, msg, from_journal=False):
+        """Get the scene of the message if it is ok to run and not a duplicate, None otherwise.
+
+        The checks read the file system and the dedup index, this is run in
+        the default executor.
+        """
+        scene = create_scene_from_msg(msg)
+        with time_phase('checks'):
+            status = ready2run(msg, scene)
+        if not status:
+            return None
+        if scene_is_too_old(scene, self.options.get('max_scene_age_minutes')):
+            return scene
+        if self.dedup is not None and not from_journal:
+            original = self.dedup.check(scene, msg)
+            if original is not None:
+                report_duplicate(self.dedup, scene, self.publish_q, msg, original, self.options)
+                return None
+        return scene
+
+    async def dispatch(self, msg, from_journal=False):
+        """Check the message and put a PPS job on the queue if it is ok to run."""
+        scene = await to_thread(self.check_message, msg, from_journal)
+        if scene is None:
+            return
+        if scene_is_too_old(scene, self.options.get('max_scene_age_minutes')):
+            await self.handle_late_scene(scene, msg)
+            return
+
+        if self.coalescer is not None:
+            await self.submit_jobs(self.coalescer.add(scene, msg))
+        else:
+            await self.submit_jobs([(scene, msg)])
+
+    async def submit_jobs(self, ready):
+        """Put the PPS jobs on the queue, parking those whose NWP data is not there yet."""
+        if self.nwp_gate is not None:
+            ready = await to_thread(lambda: [job for scene, msg in ready for job in self.nwp_gate.add(scene, msg)])
+        for scene, msg in ready:
+            await self.submit_job(scene, msg)
+
+    async def submit_job(self, scene, msg):
+        """Put a PPS job on the queue, unless its platform is paused."""
+        if self.failures is not None and self.failures.hold(scene, msg):
+            return
+        LOG.debug("Files for PPS: %s", str(scene.get('files4pps', scene['file4pps'])))
+        lane = self.get_lane(scene)
+        if lane.is_pending(scene['file4pps']):
+            LOG.info("Job with id %s already pending or running!", str(scene['file4pps']))
+            return
+        # Record the job before a worker can pick it up and record it running
+        await to_thread(record_scene, self.journal, scene, job_journal.ACCEPTED, msg)
+        accepted = await lane.submit(scene['file4pps'], self.run_pps_if_fresh,
+                                     args=(scene, msg), scene=scene)
+        if not accepted:
+            await to_thread(record_scene, self.journal, scene, job_journal.DROPPED)
+            if self.dedup is not None:
+                # Let the scene from another station run instead
+                await to_thread(self.dedup.job_failed, scene)
+        LOG.debug("Worker pool metrics of %s: %s", lane.name, str(lane.get_metrics()))
+        if self.dedup is not None:
+            LOG.debug("Dedup index metrics: %s", str(self.dedup.get_metrics()))
+        if self.cpu_slots is not None:
+            LOG.debug("Cpu slot metrics: %s", str(self.cpu_slots.get_metrics()))
+        if self.controller is not None:
+            LOG.debug("Concurrency controller metrics: %s", str(self.controller.get_metrics()))
+        if self.runtime_model is not None:
+            LOG.debug("Runtime model metrics: %s", str(self.runtime_model.get_metrics()))
+        if self.nwp_gate is not None:
+            LOG.debug("NWP gate metrics: %s", str(self.nwp_gate.get_metrics()))
+        if self.failures is not None:
+            LOG.debug("Job failure metrics: %s", str(self.failures.get_metrics()))
+        LOG.debug("Running PGEs: %s", str(get_running_jobs()))
+
+    async def flush_granules(self):
+        """Dispatch the granule groups whose window has passed, regularly."""
+        while True:
+            await asyncio.sleep(1)
+            await self.submit_jobs(self.coalescer.flush_expired())
+
+    async def release_parked_scenes(self):
+        """Dispatch the parked scenes whose NWP data has come or that have waited too long, regularly."""
+        while True:
+            await asyncio.sleep(1)
+            for ready_scene, ready_msg in await to_thread(self.nwp_gate.flush):
+                await self.submit_job(ready_scene, ready_msg)
+
+    async def retry_failed_jobs(self):
+        """Dispatch the failed jobs due for a retry and the held jobs of the resumed platforms, regularly."""
+        while True:
+            await asyncio.sleep(1)
+            for ready_scene, ready_msg in self.failures.flush():
+                await self.submit_job(ready_scene, ready_msg)
+
+    async def control_concurrency(self):
+        """Let the controller adjust the concurrency limit of the lane regularly."""
+        while True:
+            await asyncio.sleep(self.controller.settings['interval_seconds'])
+            try:
+                # Reads /proc
+                await to_thread(self.controller.step)
+            except Exception:
+                LOG.exception("Failed adjusting the concurrency limit")
+
+    async def run(self, listener_q, resumed=()):
+        """Dispatch the resumed messages, then the messages from the listener queue until None comes."""
+        self.lane.start()
+        for lane in self.class_lanes.values():
+            lane.start()
+        if self.late_lane is not None:
+            self.late_lane.start()
+        background_tasks = []
+        if self.controller is not None:
+            background_tasks.append(asyncio.create_task(self.control_concurrency()))
+        if self.coalescer is not None:
+            background_tasks.append(asyncio.create_task(self.flush_granules()))
+        if self.nwp_gate is not None:
+            background_tasks.append(asyncio.create_task(self.release_parked_scenes()))
+        if self.failures is not None:
+            background_tasks.append(asyncio.create_task(self.retry_failed_jobs()))
+        try:
+            for msg in resumed:
+                await self.dispatch(msg, from_journal=True)
+            while True:
+                msg = await listener_q.get()
+                if msg is None:
+                    break
+                await self.dispatch(msg)
+        finally:
+            for task in background_tasks:
+                task.cancel()
+            await self.lane.shutdown()
+            for lane in self.class_lanes.values():
+                await lane.shutdown()
+            if self.late_lane is not None:
+                await self.late_lane.shutdown()
+            self.process_executor.shutdown(wait=False)
+            if self.dedup is not None:
+                self.dedup.close()
+            if self.runtime_model is not None:
+                self.runtime_model.close()
+
+
+async def _pps_async(options, journal, resumed):
+    loop = asyncio.get_running_loop()
+    max_pending = int(options.get('max_pending_jobs', 100))
+    if options.get('job_queue_overflow_policy', 'block') == 'block':
+        listener_q = asyncio.Queue(maxsize=max(max_pending, 0))
+    else:
+        listener_q = asyncio.Queue()
+
+    nameservers = options.get('nameservers', None)
+    if isinstance(nameservers, str):
+        nameservers = nameservers.split(',')
+    with Publish('pps_runner', 0, options['publish_topic'], nameservers=nameservers) as publisher:
+        listen_thread = FileListener(AsyncQueueAdaptor(listener_q, loop), options['subscribe_topics'])
+        listen_thread.daemon = True
+        listen_thread.start()
+
+        def put_fallback(msg):
+            try:
+                listener_q.put_nowait(msg)
+            except asyncio.QueueFull:
+                LOG.warning("Listener queue full, can not dispatch the duplicate: %s", str(msg))
+
+        def dispatch_fallback(msg):
+            # Called from the executor threads when a job fails
+            loop.call_soon_threadsafe(put_fallback, msg)
+
+        runner = AsyncPpsRunner(options, PublisherAdaptor(publisher, loop), journal, on_fallback=dispatch_fallback)
+        nwp_listener = start_nwp_listener(options, runner.nwp_gate)
+        for lane in runner.lanes:
+            register_pool(lane)
+        metrics_server = start_metrics_server(options)
+        try:
+            await runner.run(listener_q, resumed)
+        finally:
+            listen_thread.loop = False
+            if nwp_listener is not None:
+                nwp_listener.stop()
+            if metrics_server is not None:
+                metrics_server.stop()
+
+
+def pps_async(options, journal=None, resumed=()):
+    """The asyncio PPS runner."""
+    LOG.info("*** Start the PPS level-2 runner, asyncio engine:")
+    LOG.info("Number of parallel jobs: %d", options['number_of_threads'])
+    asyncio.run(_pps_async(options, journal, resumed))
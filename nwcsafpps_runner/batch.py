@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Reprocessing of archived level-1c files in batch.
+
+The level-1c files are given as directories, glob patterns, files, or
+`@list.txt` files with one level-1c file per line::
+
+    pps_runner.py -c pps_config.yaml --batch /archive/2024/04/09 '/archive/2024/04/1[0-2]/*.nc' --jobs 8
+
+The platform, orbit and times are taken from the file names, and the files
+are run by the worker pool of the runner. With a `job_journal` in the
+config, the files already processed are skipped when a batch is run again.
+A throughput and latency report is logged when the batch is done.
+"""
+
+import glob
+import logging
+import os
+import statistics
+import threading
+import time
+from queue import Queue
+
+from posttroll.message import Message
+from trollsift import parse
+
+from nwcsafpps_runner import job_journal
+from nwcsafpps_runner.cpu_slots import create_cpu_slot_allocator
+from nwcsafpps_runner.job_journal import record_scene
+from nwcsafpps_runner.metrics import register_pool
+from nwcsafpps_runner.pps_jobs import run_pps
+from nwcsafpps_runner.pps_posttroll_hook import PLATFORM_CONVERSION_PPS2OSCAR
+from nwcsafpps_runner.publish_and_listen import FilePublisher
+from nwcsafpps_runner.runtime_model import create_runtime_model, percentile
+from nwcsafpps_runner.utils import create_scene_from_msg
+from nwcsafpps_runner.worker_pool import WorkerPool
+
+LOG = logging.getLogger(__name__)
+
+LVL1C_PATTERN = ("S_NWC_{sensor}_{platform_id}_{orbit_number:05d}_" +
+                 "{start_time:%Y%m%dT%H%M%S%f}Z_{end_time:%Y%m%dT%H%M%S%f}Z.nc")
+
+BATCH_TOPIC = '/pps_runner/batch'
+
+
+def find_lvl1c_files(paths):
+    """Get the sorted level-1c files from directories, glob patterns, files and @file lists."""
+    files = set()
+    for path in paths:
+        if path.startswith('@'):
+            with open(path[1:]) as fd:
+                files.update(line.strip() for line in fd if line.strip())
+        elif os.path.isdir(path):
+            files.update(glob.glob(os.path.join(path, 'S_NWC_*.nc')))
+        elif glob.has_magic(path):
+            files.update(glob.glob(path))
+        else:
+            files.add(path)
+    return sorted(os.path.abspath(filename) for filename in files)
+
+
+def create_msg_from_lvl1c(filename):
+    """Make the message of a level-1c file from its name, as it would have come from the level-1c runner."""
+    info = parse(LVL1C_PATTERN, os.path.basename(filename))
+    platform_name = PLATFORM_CONVERSION_PPS2OSCAR.get(info['platform_id'])
+    if platform_name is None:
+        raise ValueError("Unknown platform %s in %s" % (info['platform_id'], filename))
+    return Message(BATCH_TOPIC, 'file', {'uri': filename,
+                                         'uid': os.path.basename(filename),
+                                         'platform_name': platform_name,
+                                         'orbit_number': info['orbit_number'],
+                                         'sensor': info['sensor'],
+                                         'start_time': info['start_time'],
+                                         'end_time': info['end_time']})
+
+
+class DiscardQueue(object):
+    """A publish 'queue' dropping the messages, when the reprocessed files are not to be published."""
+
+    def put(self, msg):
+        """Drop the message."""
+        LOG.debug("Not published in batch mode: %s", str(msg))
+
+
+class BatchReport(object):
+    """The outcome and processing times of the jobs of a batch."""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Condition()
+        self.start_time = clock()
+        self.end_time = None
+        self.job_seconds = []
+        self.failed = []
+        self.skipped = 0
+
+    def record(self, file4pps, seconds, ok=True):
+        """Record a job done."""
+        with self._lock:
+            self.job_seconds.append(seconds)
+            if not ok:
+                self.failed.append(file4pps)
+            self._lock.notify_all()
+
+    def wait(self, njobs):
+        """Wait until *njobs* jobs are done."""
+        with self._lock:
+            self._lock.wait_for(lambda: len(self.job_seconds) >= njobs)
+
+    def finish(self):
+        """Stop the batch clock."""
+        self.end_time = self._clock()
+
+    def get_summary(self):
+        """Get the counts, the throughput and the percentiles of the job times."""
+        wall_seconds = (self.end_time or self._clock()) - self.start_time
+        with self._lock:
+            job_seconds = list(self.job_seconds)
+            nfailed = len(self.failed)
+        summary = {'jobs': len(job_seconds),
+                   'failed': nfailed,
+                   'skipped': self.skipped,
+                   'wall_seconds': wall_seconds,
+                   'scenes_per_hour': len(job_seconds) * 3600.0 / wall_seconds if wall_seconds > 0 else 0.0}
+        if job_seconds:
+            summary.update({'job_seconds_median': statistics.median(job_seconds),
+                            'job_seconds_p95': percentile(job_seconds, 95),
+                            'job_seconds_max': max(job_seconds)})
+        return summary
+
+    def log(self):
+        """Log the report."""
+        summary = self.get_summary()
+        LOG.info("Batch done: %d jobs (%d failed, %d skipped) in %.0f s, %.1f scenes per hour",
+                 summary['jobs'], summary['failed'], summary['skipped'], summary['wall_seconds'],
+                 summary['scenes_per_hour'])
+        if summary['jobs']:
+            LOG.info("Job time: median %.0f s, 95th percentile %.0f s, max %.0f s",
+                     summary['job_seconds_median'], summary['job_seconds_p95'], summary['job_seconds_max'])
+        for file4pps in self.failed:
+            LOG.warning("Failed: %s", file4pps)
+        return summary
+
+
+def run_batch(options, paths, nworkers=None, publish=False):
+    """Reprocess the level-1c files of *paths* with *nworkers* jobs in parallel, and get the batch report.
+
+    The files are published only if *publish* is True. The files recorded
+    as finished in the job journal, if configured, are skipped.
+    """
+    files = find_lvl1c_files(paths)
+    nworkers = int(nworkers or options['number_of_threads'])
+    LOG.info("*** Reprocess %d level-1c files, %d jobs in parallel", len(files), nworkers)
+    journal = job_journal.JobJournal(options['job_journal']) if options.get('job_journal') else None
+    cpu_slots = create_cpu_slot_allocator(options)
+    runtime_model = create_runtime_model(options)
+    pub_thread = None
+    if publish:
+        publisher_q = Queue()
+        pub_thread = FilePublisher(publisher_q, options['publish_topic'], runner_name='pps_runner',
+                                   nameservers=options.get('nameservers', None))
+        pub_thread.start()
+    else:
+        publisher_q = DiscardQueue()
+    worker_pool = WorkerPool(nworkers, max_pending=nworkers, overflow_policy='block', name='pps-batch-worker')
+    register_pool(worker_pool)
+    report = BatchReport()
+
+    def run_batch_job(scene, msg):
+        start_time = time.monotonic()
+        ok = False
+        try:
+            run_pps(scene, publisher_q, msg, options, journal, cpu_slots, runtime_model=runtime_model)
+            ok = True
+        finally:
+            report.record(scene['file4pps'], time.monotonic() - start_time, ok)
+
+    njobs = 0
+    for filename in files:
+        try:
+            msg = create_msg_from_lvl1c(filename)
+        except ValueError as err:
+            LOG.warning("Skip %s: %s", filename, str(err))
+            report.skipped += 1
+            continue
+        scene = create_scene_from_msg(msg)
+        if scene['file4pps'] is None:
+            LOG.warning("Skip %s: file not found", filename)
+            report.skipped += 1
+            continue
+        if journal is not None and journal.is_finished(scene['file4pps']):
+            LOG.debug("Already processed: %s", filename)
+            report.skipped += 1
+            continue
+        record_scene(journal, scene, job_journal.ACCEPTED, msg)
+        if worker_pool.submit(scene['file4pps'], target=run_batch_job, args=(scene, msg), scene=scene):
+            njobs += 1
+        else:
+            record_scene(journal, scene, job_journal.DROPPED)
+
+    report.wait(njobs)
+    report.finish()
+    worker_pool.shutdown()
+    if journal is not None:
+        journal.close()
+    if runtime_model is not None:
+        runtime_model.close()
+    if pub_thread is not None:
+        pub_thread.stop()
+    return report
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Adapt the number of parallel PPS jobs to the load of the node.
+
+The controller samples the load average, the available memory, the
+pressure stall information (/proc/pressure) and the durations of the last
+jobs, and lowers or raises the concurrency limit of the worker pool
+between the configured bounds::
+
+    adaptive_concurrency:
+      min_jobs: 2
+      max_jobs: 12
+      interval_seconds: 30
+      max_load_per_cpu: 1.0
+      min_available_memory_mb: 4000
+      max_cpu_pressure: 40
+      max_memory_pressure: 10
+      max_io_pressure: 40
+      max_duration_growth: 1.5
+
+The pressures are the 'some avg10' percentages. The limit is lowered by
+one job when any of the thresholds is exceeded (halved if the available
+memory is below half of its threshold), and raised by one job when jobs
+are waiting, all running slots are used and the node is well below all
+thresholds.
+"""
+
+import logging
+import os
+import statistics
+import threading
+
+LOG = logging.getLogger(__name__)
+
+PROC_DIR = '/proc'
+
+DEFAULT_SETTINGS = {'interval_seconds': 30,
+                    'max_load_per_cpu': 1.0,
+                    'min_available_memory_mb': 2000,
+                    'max_cpu_pressure': 40.0,
+                    'max_memory_pressure': 10.0,
+                    'max_io_pressure': 40.0,
+                    'max_duration_growth': 1.5}
+
+#: Fraction of the thresholds under which the node is considered to have room for more jobs
+LOW_WATERMARK = 0.6
+
+#: Number of last job durations compared to the longer history
+SHORT_DURATION_WINDOW = 5
+
+
+def read_loadavg(proc_dir=PROC_DIR):
+    """Read the 1 minute load average."""
+    try:
+        with open(os.path.join(proc_dir, 'loadavg')) as fpt:
+            return float(fpt.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def read_available_memory_mb(proc_dir=PROC_DIR):
+    """Read the available memory in MB from meminfo."""
+    try:
+        with open(os.path.join(proc_dir, 'meminfo')) as fpt:
+            for line in fpt:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024.0
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def read_pressure(resource, proc_dir=PROC_DIR):
+    """Read the 'some avg10' stall percentage of the resource (cpu, memory or io), None if not available."""
+    try:
+        with open(os.path.join(proc_dir, 'pressure', resource)) as fpt:
+            for line in fpt:
+                fields = line.split()
+                if fields and fields[0] == 'some':
+                    return float(dict(field.split('=') for field in fields[1:])['avg10'])
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def sample_system(proc_dir=PROC_DIR):
+    """Sample the load of the node."""
+    loadavg = read_loadavg(proc_dir)
+    ncpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    return {'load_per_cpu': loadavg / ncpus if loadavg is not None else None,
+            'available_memory_mb': read_available_memory_mb(proc_dir),
+            'cpu_pressure': read_pressure('cpu', proc_dir),
+            'memory_pressure': read_pressure('memory', proc_dir),
+            'io_pressure': read_pressure('io', proc_dir)}
+
+
+def get_duration_growth(durations):
+    """Get how much longer the last jobs took compared to the median of the older ones."""
+    if len(durations) < 2 * SHORT_DURATION_WINDOW:
+        return None
+    baseline = statistics.median(durations[:-SHORT_DURATION_WINDOW])
+    if baseline <= 0:
+        return None
+    return statistics.median(durations[-SHORT_DURATION_WINDOW:]) / baseline
+
+
+class ConcurrencyController(object):
+    """Adjust the concurrency limit of a worker pool (or asyncio lane) to the load of the node."""
+
+    def __init__(self, pool, min_jobs, max_jobs, proc_dir=PROC_DIR, **settings):
+        """Init the controller of the *pool*, with limits between *min_jobs* and *max_jobs*."""
+        self.pool = pool
+        self.min_jobs = max(1, int(min_jobs))
+        self.max_jobs = max(self.min_jobs, int(max_jobs))
+        self.proc_dir = proc_dir
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(settings)
+        self.last_sample = {}
+        self.last_decision = None
+        self.stats = {'increases': 0, 'decreases': 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _overloaded(self, sample, factor=1.0):
+        """Get the reasons the node is above the thresholds times *factor*."""
+        reasons = []
+        settings = self.settings
+        if sample['load_per_cpu'] is not None and sample['load_per_cpu'] > settings['max_load_per_cpu'] * factor:
+            reasons.append("load per cpu %.2f" % sample['load_per_cpu'])
+        for resource in ['cpu', 'memory', 'io']:
+            pressure = sample[resource + '_pressure']
+            if pressure is not None and pressure > settings['max_%s_pressure' % resource] * factor:
+                reasons.append("%s pressure %.1f%%" % (resource, pressure))
+        growth = sample.get('duration_growth')
+        if growth is not None and growth > 1 + (settings['max_duration_growth'] - 1) * factor:
+            reasons.append("jobs %.1f times slower" % growth)
+        memory = sample['available_memory_mb']
+        if memory is not None and memory * factor < settings['min_available_memory_mb']:
+            reasons.append("available memory %.0f MB" % memory)
+        return reasons
+
+    def decide(self, sample, current, queue_depth, active_jobs):
+        """Decide the new concurrency limit, return it with the reason of the decision."""
+        reasons = self._overloaded(sample)
+        if reasons:
+            memory = sample['available_memory_mb']
+            if memory is not None and memory < self.settings['min_available_memory_mb'] / 2.0:
+                new = current // 2
+            else:
+                new = current - 1
+            return max(self.min_jobs, new), "overloaded: " + ", ".join(reasons)
+        if queue_depth > 0 and active_jobs >= current and not self._overloaded(sample, LOW_WATERMARK):
+            return min(self.max_jobs, current + 1), "jobs waiting and room for more"
+        return current, "steady"
+
+    def step(self):
+        """Sample the node and apply a new concurrency limit if needed. Return the limit."""
+        sample = sample_system(self.proc_dir)
+        sample['duration_growth'] = get_duration_growth(self.pool.get_recent_durations())
+        metrics = self.pool.get_metrics()
+        current = metrics['concurrency_limit']
+        new, reason = self.decide(sample, current, metrics['queue_depth'], metrics['active_jobs'])
+        self.last_sample = sample
+        self.last_decision = reason
+        if new != current:
+            new = self.pool.set_concurrency(new)
+            self.stats['increases' if new > current else 'decreases'] += 1
+            LOG.info("Concurrency limit changed from %d to %d jobs (%s), node load: %s",
+                     current, new, reason, str(sample))
+        else:
+            LOG.debug("Concurrency limit kept at %d jobs (%s), node load: %s", current, reason, str(sample))
+        return new
+
+    def get_metrics(self):
+        """Get the last sample, decision and the number of changes."""
+        metrics = dict(self.stats)
+        metrics['concurrency_limit'] = self.pool.get_metrics()['concurrency_limit']
+        metrics['last_decision'] = self.last_decision
+        metrics.update(self.last_sample)
+        return metrics
+
+    def _run(self):
+        while not self._stop.wait(self.settings['interval_seconds']):
+            try:
+                self.step()
+            except Exception:
+                LOG.exception("Failed adjusting the concurrency limit")
+
+    def start(self):
+        """Adjust the limit regularly in a thread."""
+        self._thread = threading.Thread(target=self._run, name='pps-concurrency-controller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the controller thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def get_concurrency_bounds(options):
+    """Get the number of workers to start and the initial concurrency limit.
+
+    Without adaptive concurrency both are `number_of_threads`.
+    """
+    nthreads = int(options['number_of_threads'])
+    adaptive = options.get('adaptive_concurrency')
+    if not adaptive:
+        return nthreads, nthreads
+    max_jobs = int(adaptive.get('max_jobs', nthreads))
+    min_jobs = int(adaptive.get('min_jobs', 1))
+    return max_jobs, max(min_jobs, min(nthreads, max_jobs))
+
+
+def create_concurrency_controller(options, pool):
+    """Create the controller of the pool from the runner config, None if not configured."""
+    adaptive = options.get('adaptive_concurrency')
+    if not adaptive:
+        return None
+    settings = {key: value for key, value in adaptive.items() if key in DEFAULT_SETTINGS}
+    max_jobs, initial = get_concurrency_bounds(options)
+    controller = ConcurrencyController(pool, adaptive.get('min_jobs', 1), max_jobs, **settings)
+    pool.set_concurrency(initial)
+    LOG.info("Adaptive concurrency between %d and %d jobs, starting with %d",
+             controller.min_jobs, controller.max_jobs, initial)
+    return controller
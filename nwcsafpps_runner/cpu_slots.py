@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""CPU slots for the parallel PPS jobs.
+
+The cpus available to the runner are split in slots, and each PPS job is
+pinned to the cpus of one slot, with the OpenMP/MKL/OpenBLAS thread
+counts set to the size of the slot. The slots are given in the runner
+config, either explicitly as cpu lists::
+
+    cpu_slots: ["0-3", "4-7", "8-11", "12-15"]
+
+or split automatically in `number_of_threads` slots, optionally keeping
+each slot within one NUMA node (memory is then allocated on the local
+node by the default first-touch policy)::
+
+    cpu_slots: auto
+    cpu_slots_numa: true
+
+A job running ppsCmaskProb next to ppsRunAll (`cmask_prob_mode: parallel`
+or `after_pges`) splits its slot in two halves, one per process.
+
+Each worker pool has its own slots, on cpus of its own: the default pool,
+each resource class and the reprocess-later lane, so that the jobs of a
+pool never wait for, nor run on the cpus of, another pool. A resource class
+can have its own `cpu_slots` list. The other pools share the `cpu_slots` of
+the runner config (the automatic slots are then made for the parallel jobs
+of all these pools): each class and the reprocess-later lane get one slot
+per parallel job, at least one, and the default pool gets the rest.
+"""
+
+import glob
+import logging
+import os
+import threading
+from collections import namedtuple
+
+LOG = logging.getLogger(__name__)
+
+#: The environment variables setting the number of threads of the numerical libraries
+THREAD_ENV_VARIABLES = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
+
+NUMA_NODE_DIR = '/sys/devices/system/node'
+
+CpuSlot = namedtuple('CpuSlot', ['index', 'cpus', 'numa_node'])
+
+
+def parse_cpu_list(cpu_list):
+    """Parse a cpu list like "0-3,8,10-11" (or a list of ints) to a sorted list of cpus."""
+    if isinstance(cpu_list, int):
+        return [cpu_list]
+    if not isinstance(cpu_list, str):
+        return sorted(int(cpu) for cpu in cpu_list)
+    cpus = set()
+    for part in cpu_list.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def get_available_cpus():
+    """Get the cpus the runner is allowed to run on."""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def get_numa_nodes(node_dir=NUMA_NODE_DIR):
+    """Get the cpus of each NUMA node, as a dict."""
+    nodes = {}
+    for path in sorted(glob.glob(os.path.join(node_dir, 'node[0-9]*'))):
+        try:
+            with open(os.path.join(path, 'cpulist')) as fpt:
+                cpus = parse_cpu_list(fpt.read())
+        except OSError:
+            continue
+        if cpus:
+            nodes[int(os.path.basename(path)[4:])] = cpus
+    return nodes
+
+
+def split_cpus(cpus, nslots):
+    """Split the cpus in *nslots* contiguous chunks of (almost) equal size."""
+    nslots = max(1, min(nslots, len(cpus)))
+    size, extra = divmod(len(cpus), nslots)
+    chunks = []
+    start = 0
+    for idx in range(nslots):
+        end = start + size + (1 if idx < extra else 0)
+        chunks.append(cpus[start:end])
+        start = end
+    return chunks
+
+
+def make_auto_slots(nslots, numa=False, node_dir=NUMA_NODE_DIR, cpus=None):
+    """Split the available cpus (or *cpus*) in *nslots* slots, within the NUMA nodes if *numa*."""
+    available = get_available_cpus() if cpus is None else sorted(cpus)
+    nodes = get_numa_nodes(node_dir) if numa else {}
+    node_cpus = {node: [cpu for cpu in cpus if cpu in available] for node, cpus in nodes.items()}
+    node_cpus = {node: cpus for node, cpus in node_cpus.items() if cpus}
+    if len(node_cpus) < 2:
+        return [CpuSlot(idx, cpus, None) for idx, cpus in enumerate(split_cpus(available, nslots))]
+
+    # Give each node a share of the slots proportional to its cpus, and
+    # interleave the nodes so that the first slots taken are spread out
+    total = sum(len(cpus) for cpus in node_cpus.values())
+    per_node = []
+    for node, cpus in sorted(node_cpus.items()):
+        nnode_slots = max(1, round(nslots * len(cpus) / total))
+        per_node.append([(node, chunk) for chunk in split_cpus(cpus, nnode_slots)])
+    slots = []
+    while any(per_node):
+        for node_slots in per_node:
+            if node_slots:
+                node, chunk = node_slots.pop(0)
+                slots.append(CpuSlot(len(slots), chunk, node))
+    return slots[:nslots]
+
+
+def split_slot(slot):
+    """Split the slot in two halves, for the two processes of a job running at the same time.
+
+    The thread counts of each process are then set to the cpus of its
+    half. A slot of one cpu is not split, both processes get all of it.
+    """
+    if slot is None or len(slot.cpus) < 2:
+        return slot, slot
+    first, second = split_cpus(slot.cpus, 2)
+    return slot._replace(cpus=first), slot._replace(cpus=second)
+
+
+def get_slot_env(slot, env=None):
+    """Get the environment for a job running in the slot."""
+    env = dict(os.environ if env is None else env)
+    if slot is not None:
+        for var in THREAD_ENV_VARIABLES:
+            env[var] = str(len(slot.cpus))
+    return env
+
+
+def format_slot(slot):
+    """Format the slot for the logs."""
+    if slot is None:
+        return "no cpu slot"
+    text = "cpu slot %d (cpus %s" % (slot.index, ','.join(str(cpu) for cpu in slot.cpus))
+    if slot.numa_node is not None:
+        text += ", numa node %d" % slot.numa_node
+    return text + ")"
+
+
+class CpuSlotAllocator(object):
+    """Hand out the cpu slots to the running jobs."""
+
+    def __init__(self, slots):
+        """Init the allocator with a list of CpuSlot."""
+        self.slots = list(slots)
+        self._free = list(self.slots)
+        self._jobs = {}
+        self._cond = threading.Condition()
+
+    def acquire(self, job_id, timeout=None):
+        """Get a free slot for the job, waiting for one if needed. Return None on time out."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._free, timeout):
+                return None
+            slot = self._free.pop(0)
+            self._jobs[slot.index] = job_id
+        LOG.debug("Job %s got %s", str(job_id), format_slot(slot))
+        return slot
+
+    def release(self, slot):
+        """Give back the slot."""
+        if slot is None:
+            return
+        with self._cond:
+            self._jobs.pop(slot.index, None)
+            self._free.append(slot)
+            self._free.sort(key=lambda free_slot: free_slot.index)
+            self._cond.notify()
+
+    def get_metrics(self):
+        """Get the slot usage."""
+        with self._cond:
+            return {'cpu_slots': len(self.slots),
+                    'cpu_slots_in_use': len(self._jobs),
+                    'cpu_slot_jobs': dict(self._jobs)}
+
+
+def make_slots(options, nslots, cpus=None):
+    """Make the cpu slots of the runner config, the automatic ones for *nslots* jobs on the *cpus*."""
+    cpu_slots = options.get('cpu_slots')
+    if cpu_slots == 'auto':
+        return make_auto_slots(nslots, numa=options.get('cpu_slots_numa', False), cpus=cpus)
+    if isinstance(cpu_slots, (list, tuple)):
+        return [CpuSlot(idx, parse_cpu_list(cpus), None) for idx, cpus in enumerate(cpu_slots)]
+    raise ValueError("cpu_slots should be 'auto' or a list of cpu lists, got %s" % str(cpu_slots))
+
+
+def make_allocator(slots, njobs, name='PPS'):
+    """Make the allocator of the slots, for *njobs* parallel jobs."""
+    for slot in slots:
+        LOG.info("%s jobs can run on %s", name, format_slot(slot))
+    if len(slots) < njobs:
+        LOG.warning("Fewer cpu slots (%d) than parallel %s jobs (%d), jobs will wait for a free slot",
+                    len(slots), name, njobs)
+    return CpuSlotAllocator(slots)
+
+
+def create_cpu_slot_allocator(options):
+    """Create the cpu slot allocator from the runner config, None if no slots are configured."""
+    if not options.get('cpu_slots'):
+        return None
+    return make_allocator(make_slots(options, int(options['number_of_threads'])), int(options['number_of_threads']))
+
+
+def share_slots(slots, njobs):
+    """Share the slots between pools of *njobs* parallel jobs, the first pool getting the rest.
+
+    Each pool gets one slot per job, and at least one slot.
+    """
+    if len(slots) < len(njobs):
+        raise ValueError("%d cpu slots can not be shared by %d worker pools, each needs cpus of its own" %
+                         (len(slots), len(njobs)))
+    spare = len(slots) - len(njobs)
+    shares = [1] * len(njobs)
+    for idx in range(1, len(njobs)):
+        extra = min(spare, njobs[idx] - 1)
+        shares[idx] += extra
+        spare -= extra
+    shares[0] += spare
+    pool_slots = []
+    start = 0
+    for share in shares:
+        pool_slots.append(slots[start:start + share])
+        start += share
+    return pool_slots
+
+
+def create_pool_cpu_slots(options, resource_classes=(), late_threads=0):
+    """Create the cpu slot allocators of the worker pools from the runner config, on disjoint cpus.
+
+    The pools are the default pool, the pools of the *resource_classes* and
+    the reprocess-later lane if it has *late_threads*. Return the allocator
+    of the default pool, a dict of the allocators of the classes and the
+    allocator of the reprocess-later lane, None where no slots are configured.
+    """
+    class_cpu_slots = {}
+    reserved = set()
+    for resource_class in resource_classes:
+        cpu_slots = resource_class.options.get('cpu_slots')
+        if not cpu_slots:
+            continue
+        if not isinstance(cpu_slots, (list, tuple)):
+            raise ValueError("The cpu_slots of resource class %s should be a list of cpu lists, got %s" %
+                             (resource_class.name, str(cpu_slots)))
+        slots = make_slots(resource_class.options, 0)
+        cpus = set(cpu for slot in slots for cpu in slot.cpus)
+        if cpus & reserved:
+            raise ValueError("The cpu slots of resource class %s overlap the ones of another class" %
+                             resource_class.name)
+        reserved |= cpus
+        class_cpu_slots[resource_class.name] = make_allocator(slots, int(resource_class.options['number_of_threads']),
+                                                              name=resource_class.name)
+
+    shared_classes = [resource_class for resource_class in resource_classes
+                      if resource_class.name not in class_cpu_slots]
+    if not options.get('cpu_slots'):
+        class_cpu_slots.update({resource_class.name: None for resource_class in shared_classes})
+        return None, class_cpu_slots, None
+
+    njobs = [int(options['number_of_threads'])]
+    njobs += [int(resource_class.options['number_of_threads']) for resource_class in shared_classes]
+    if late_threads:
+        njobs.append(int(late_threads))
+    slots = make_slots(options, sum(njobs), cpus=[cpu for cpu in get_available_cpus() if cpu not in reserved])
+    if reserved & set(cpu for slot in slots for cpu in slot.cpus):
+        raise ValueError("The cpu slots of the runner config overlap the ones of a resource class")
+    pool_slots = share_slots(slots, njobs)
+    cpu_slots = make_allocator(pool_slots.pop(0), njobs[0])
+    for resource_class, slots in zip(shared_classes, pool_slots):
+        class_cpu_slots[resource_class.name] = make_allocator(slots, int(resource_class.options['number_of_threads']),
+                                                              name=resource_class.name)
+    late_cpu_slots = make_allocator(pool_slots[-1], int(late_threads), name='Late') if late_threads else None
+    return cpu_slots, class_cpu_slots, late_cpu_slots
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Detect the same scene arriving several times.
+
+Scenes are identified by (platform_name, orbit_number, start_time, sensor),
+so the same scene received from two stations or topics, or announced again
+after it was processed, is recognised before any PPS process is started::
+
+    dedup_ttl_minutes: 720
+    dedup_policy: reject
+    dedup_index: /var/lib/pps_runner/pps_dedup.db
+
+A scene is a duplicate if it was seen less than `dedup_ttl_minutes` ago.
+With the `reject` policy duplicates are dropped. With the `merge` policy
+they are kept as fallbacks of the first job: if that job fails, the first
+duplicate is dispatched instead. The index can be kept on disk (SQLite)
+to survive restarts, the fallbacks are only kept in memory.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+
+from nwcsafpps_runner.granule_coalescing import iter_granules
+from nwcsafpps_runner.utils import get_scene_sensor, publish_skip_message
+
+LOG = logging.getLogger(__name__)
+
+DEDUP_POLICIES = ['reject', 'merge']
+
+
+def make_dedup_key(scene):
+    """Make the key identifying the scene."""
+    starttime = scene.get('starttime')
+    starttime = starttime.isoformat() if hasattr(starttime, 'isoformat') else str(starttime)
+    return '|'.join([str(scene.get('platform_name')), str(scene.get('orbit_number')),
+                     starttime, str(get_scene_sensor(scene))])
+
+
+class DedupIndex(object):
+    """An index of the scenes seen in the last *ttl_seconds*, optionally backed by a SQLite file."""
+
+    def __init__(self, ttl_seconds, filename=None, policy='reject', on_fallback=None):
+        """Init the index.
+
+        The *on_fallback* callable is called with the message of a merged
+        duplicate when the job it is a fallback for fails.
+        """
+        if policy not in DEDUP_POLICIES:
+            raise ValueError("Unknown dedup_policy %s, should be one of %s" % (str(policy), str(DEDUP_POLICIES)))
+        self.ttl_seconds = ttl_seconds
+        self.policy = policy
+        self.on_fallback = on_fallback
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._seen = {}
+        self._fallbacks = {}
+        self.stats = {'duplicates': 0, 'merged': 0, 'fallbacks_dispatched': 0}
+        self._last_prune = time.time()
+        self._conn = None
+        if filename:
+            self._conn = sqlite3.connect(filename, check_same_thread=False)
+            with self._conn:
+                self._conn.execute("CREATE TABLE IF NOT EXISTS scenes ("
+                                   "key TEXT PRIMARY KEY, "
+                                   "file4pps TEXT, "
+                                   "updated REAL NOT NULL)")
+            self.prune()
+            rows = self._conn.execute("SELECT key, file4pps, updated FROM scenes").fetchall()
+            self._seen = {key: (file4pps, updated) for key, file4pps, updated in rows}
+            LOG.info("Dedup index %s: %d scenes seen in the last %d minutes",
+                     filename, len(self._seen), self.ttl_seconds / 60)
+
+    def _is_fresh(self, entry, now):
+        return entry is not None and now - entry[1] < self.ttl_seconds
+
+    def check(self, scene, msg=None, now=None):
+        """Check the scene, and register it if it is new.
+
+        Return None for a new scene, or the level-1c file of the scene
+        already seen. With the merge policy the *msg* of the duplicate is
+        kept as a fallback.
+        """
+        now = time.time() if now is None else now
+        if now - self._last_prune > self.ttl_seconds / 10.0:
+            self.prune(now)
+        key = make_dedup_key(scene)
+        with self._lock:
+            entry = self._seen.get(key)
+            if self._is_fresh(entry, now):
+                self.stats['duplicates'] += 1
+                if self.policy == 'merge' and msg is not None and entry[0] != scene.get('file4pps'):
+                    self._fallbacks.setdefault(key, []).append(msg)
+                    self.stats['merged'] += 1
+                return entry[0]
+            self._set(key, scene.get('file4pps'), now)
+        return None
+
+    def _set(self, key, file4pps, now):
+        self._seen[key] = (file4pps, now)
+        if self._conn is not None:
+            with self._conn:
+                self._conn.execute("INSERT OR REPLACE INTO scenes (key, file4pps, updated) VALUES (?, ?, ?)",
+                                   (key, file4pps, now))
+
+    def _forget(self, key):
+        self._seen.pop(key, None)
+        if self._conn is not None:
+            with self._conn:
+                self._conn.execute("DELETE FROM scenes WHERE key = ?", (key, ))
+
+    def job_finished(self, scene, now=None):
+        """Restart the time to live of the scene (each granule) from the end of the job, drop the fallbacks."""
+        now = time.time() if now is None else now
+        for granule, _ in iter_granules(scene, None):
+            key = make_dedup_key(granule)
+            with self._lock:
+                self._fallbacks.pop(key, None)
+                self._set(key, granule.get('file4pps'), now)
+
+    def job_failed(self, scene):
+        """Forget the scene (each granule) so it can be processed again, and dispatch merged duplicates."""
+        for granule, _ in iter_granules(scene, None):
+            key = make_dedup_key(granule)
+            with self._lock:
+                self._forget(key)
+                fallbacks = self._fallbacks.pop(key, [])
+            if fallbacks and self.on_fallback is not None:
+                LOG.info("Job failed on %s, dispatching a duplicate of the scene instead",
+                         str(granule.get('file4pps')))
+                self.stats['fallbacks_dispatched'] += 1
+                self.on_fallback(fallbacks[0])
+
+    def prune(self, now=None):
+        """Remove the scenes older than the time to live."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._last_prune = now
+            for key in [key for key, entry in self._seen.items() if not self._is_fresh(entry, now)]:
+                del self._seen[key]
+                self._fallbacks.pop(key, None)
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute("DELETE FROM scenes WHERE updated < ?", (now - self.ttl_seconds, ))
+
+    def get_metrics(self):
+        """Get the number of scenes in the index and of duplicates found."""
+        with self._lock:
+            metrics = dict(self.stats)
+            metrics['scenes'] = len(self._seen)
+        return metrics
+
+    def close(self):
+        """Close the on-disk index."""
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+
+
+def report_duplicate(dedup, scene, publish_q, input_msg, original, options):
+    """Log and publish that the scene is a duplicate and was not queued."""
+    status = 'merged' if dedup.policy == 'merge' else 'duplicate'
+    LOG.info("Scene %s is a duplicate of %s (%s)", str(scene.get('file4pps')), str(original), status)
+    publish_skip_message(input_msg, publish_q, scene, 'duplicate of %s' % str(original),
+                         status=status,
+                         station=options['station'],
+                         topic=options.get('skip_topic'))
+
+
+def create_dedup_index(options, on_fallback=None):
+    """Create the dedup index from the runner config, None if not configured."""
+    ttl_minutes = options.get('dedup_ttl_minutes')
+    if not ttl_minutes:
+        return None
+    return DedupIndex(float(ttl_minutes) * 60, filename=options.get('dedup_index'),
+                      policy=options.get('dedup_policy', 'reject'), on_fallback=on_fallback)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Coalesce consecutive granules into one multi-granule PPS job.
+
+Consecutive granules of the same platform and orbit arriving within a
+time window are grouped, and processed as one job instead of one PPS
+process per granule::
+
+    granule_coalescing:
+      sensors: [viirs]
+      window_seconds: 120
+      max_granules: 10
+      max_gap_seconds: 10
+      multi_granule_mode: single_call
+
+A group is dispatched when the window after its first granule has passed,
+when it has max_granules granules, or when a granule that does not follow
+it arrives. In the `single_call` mode the PPS scripts are called once with
+all the level-1c files after `-af`, in the `sequential` mode they are
+called for one granule after the other within the same job. The
+statistics of each granule are published with the message of that
+granule.
+"""
+
+import logging
+import time
+from datetime import datetime
+
+from nwcsafpps_runner.utils import get_scene_sensor
+
+LOG = logging.getLogger(__name__)
+
+MULTI_GRANULE_MODES = ['single_call', 'sequential']
+
+
+class GranuleCoalescer(object):
+    """Group consecutive granules of the same platform and orbit."""
+
+    def __init__(self, sensors=('viirs', ), window_seconds=120, max_granules=10, max_gap_seconds=10):
+        self.sensors = list(sensors)
+        self.window_seconds = window_seconds
+        self.max_granules = max(1, int(max_granules))
+        self.max_gap_seconds = max_gap_seconds
+        self._groups = {}
+
+    def __len__(self):
+        """Get the number of granules held back."""
+        return sum(len(group['granules']) for group in self._groups.values())
+
+    def accepts(self, scene):
+        """Check if the scene can be coalesced with others."""
+        return (get_scene_sensor(scene) in self.sensors and
+                isinstance(scene.get('starttime'), datetime) and
+                isinstance(scene.get('endtime'), datetime))
+
+    def _follows(self, group, scene):
+        last = group['granules'][-1][0]
+        gap = (scene['starttime'] - last['endtime']).total_seconds()
+        return -self.max_gap_seconds <= gap <= self.max_gap_seconds
+
+    def add(self, scene, msg, now=None):
+        """Add a granule, and get the list of (scene, msg) jobs ready to be dispatched."""
+        if not self.accepts(scene):
+            return [(scene, msg)]
+        now = time.monotonic() if now is None else now
+        key = (scene['platform_name'], scene['orbit_number'])
+        ready = []
+        group = self._groups.get(key)
+        if group is not None and not self._follows(group, scene):
+            ready.append(self._pop(key))
+            group = None
+        if group is None:
+            group = self._groups[key] = {'granules': [], 'first_arrival': now}
+        group['granules'].append((scene, msg))
+        LOG.debug("Holding granule %d of %s: %s", len(group['granules']), str(key), str(scene['file4pps']))
+        if len(group['granules']) >= self.max_granules:
+            ready.append(self._pop(key))
+        return ready
+
+    def flush_expired(self, now=None):
+        """Get the jobs of the groups whose window has passed."""
+        now = time.monotonic() if now is None else now
+        expired = [key for key, group in self._groups.items()
+                   if now - group['first_arrival'] >= self.window_seconds]
+        return [self._pop(key) for key in expired]
+
+    def flush_all(self):
+        """Get the jobs of all the groups."""
+        return [self._pop(key) for key in list(self._groups)]
+
+    def _pop(self, key):
+        granules = self._groups.pop(key)['granules']
+        if len(granules) == 1:
+            return granules[0]
+        LOG.info("Coalesced %d granules of %s orbit %s into one job",
+                 len(granules), str(key[0]), str(key[1]))
+        return merge_granules(granules), granules[0][1]
+
+
+def merge_granules(granules):
+    """Make the scene of a multi-granule job from a list of (scene, msg)."""
+    scenes = [scene for scene, _ in granules]
+    scene = dict(scenes[0])
+    scene['endtime'] = scenes[-1]['endtime']
+    scene['files4pps'] = [granule['file4pps'] for granule in scenes]
+    scene['granules'] = scenes
+    scene['granule_msgs'] = [msg for _, msg in granules]
+    return scene
+
+
+def iter_granules(scene, input_msg):
+    """Get the (scene, msg) of each granule of the job, for a single or multi-granule job."""
+    if 'granules' not in scene:
+        return [(scene, input_msg)]
+    return list(zip(scene['granules'], scene['granule_msgs']))
+
+
+def get_multi_granule_mode(options):
+    """Get how multi-granule jobs call PPS, checking the config value."""
+    mode = (options.get('granule_coalescing') or {}).get('multi_granule_mode', 'single_call')
+    if mode not in MULTI_GRANULE_MODES:
+        raise ValueError("Unknown multi_granule_mode %s, should be one of %s" % (
+            str(mode), str(MULTI_GRANULE_MODES)))
+    return mode
+
+
+def create_granule_coalescer(options):
+    """Create the coalescer from the runner config, None if not configured."""
+    settings = options.get('granule_coalescing')
+    if not settings:
+        return None
+    get_multi_granule_mode(options)
+    coalescer = GranuleCoalescer(sensors=settings.get('sensors', ['viirs']),
+                                 window_seconds=settings.get('window_seconds', 120),
+                                 max_granules=settings.get('max_granules', 10),
+                                 max_gap_seconds=settings.get('max_gap_seconds', 10))
+    LOG.info("Coalescing up to %d granules of %s within %s seconds",
+             coalescer.max_granules, str(coalescer.sensors), str(coalescer.window_seconds))
+    return coalescer
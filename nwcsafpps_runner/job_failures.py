@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Retry the failed PPS jobs, and pause the platforms failing systematically.
+
+A PPS process exiting with a non-zero code or killed (time out) fails the
+job. The failed jobs are requeued with an exponential backoff, and a
+platform is paused after a number of consecutive failures, as a missing NWP
+or a broken PPS installation would otherwise burn a full time out on every
+scene::
+
+    job_failures:
+      max_attempts: 2
+      backoff_seconds: 120
+      backoff_factor: 2
+      max_backoff_seconds: 1800
+      retry_timeouts: true
+      retry_exit_codes: []
+      max_consecutive_failures: 5
+      pause_minutes: 30
+      alert_topic: /PPS/alert/norrkoping/polar/direct_readout/
+
+With an empty `retry_exit_codes` any non-zero exit code is retried. The
+scenes of a paused platform are held until the pause is over, and an alert
+message is published when a platform is paused. After the pause, the next
+failure pauses the platform again, and the next success resumes it.
+"""
+
+import logging
+import threading
+import time
+
+from nwcsafpps_runner.metrics import count_event
+from nwcsafpps_runner.utils import publish_alert_message
+
+LOG = logging.getLogger(__name__)
+
+
+class PpsProcessFailed(Exception):
+    """A PPS process exited with a non-zero code, or was killed."""
+
+    def __init__(self, cmd, returncode, timed_out=False):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.timed_out = timed_out
+        self.killed = timed_out or returncode is None or returncode < 0
+        Exception.__init__(self, "%s: %s" % (get_exit_status(returncode, timed_out), cmd))
+
+    @property
+    def exit_status(self):
+        """Get the exit status of the process as a string."""
+        return get_exit_status(self.returncode, self.timed_out)
+
+
+def get_exit_status(returncode, timed_out=False):
+    """Get the exit status of a process as a string: the exit code, 'timeout' or 'signal N'."""
+    if timed_out or returncode is None:
+        return 'timeout'
+    if returncode < 0:
+        return 'signal %d' % -returncode
+    return str(returncode)
+
+
+def check_exit_status(cmd, returncode, timed_out=False):
+    """Raise PpsProcessFailed if the process has not exited successfully."""
+    if timed_out or returncode != 0:
+        raise PpsProcessFailed(cmd, returncode, timed_out)
+
+
+def get_job_exit_status(err):
+    """Get the exit status to record for a job failing with *err*."""
+    if isinstance(err, PpsProcessFailed):
+        return err.exit_status
+    return err.__class__.__name__
+
+
+class CircuitBreaker(object):
+    """Pause a platform after a number of consecutive job failures."""
+
+    def __init__(self, max_consecutive_failures=5, pause_minutes=30):
+        self.max_consecutive_failures = max_consecutive_failures
+        self.pause_seconds = pause_minutes * 60.0
+        self.failures = {}
+        self.paused_until = {}
+
+    def is_open(self, platform_name, now):
+        """Check if the platform is paused."""
+        paused_until = self.paused_until.get(platform_name)
+        return paused_until is not None and now < paused_until
+
+    def record_success(self, platform_name):
+        """Reset the failures of the platform."""
+        self.failures[platform_name] = 0
+        self.paused_until.pop(platform_name, None)
+
+    def record_failure(self, platform_name, now):
+        """Count a failure of the platform, and tell if it pauses the platform."""
+        self.failures[platform_name] = self.failures.get(platform_name, 0) + 1
+        if self.failures[platform_name] < self.max_consecutive_failures or self.is_open(platform_name, now):
+            return False
+        self.paused_until[platform_name] = now + self.pause_seconds
+        return True
+
+
+class JobFailures(object):
+    """Requeue the transient job failures with backoff, and hold the jobs of the paused platforms."""
+
+    def __init__(self, breaker, max_attempts=2, backoff_seconds=120, backoff_factor=2, max_backoff_seconds=1800,
+                 retry_timeouts=True, retry_exit_codes=None, on_alert=None):
+        self.breaker = breaker
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.backoff_factor = backoff_factor
+        self.max_backoff_seconds = max_backoff_seconds
+        self.retry_timeouts = retry_timeouts
+        self.retry_exit_codes = retry_exit_codes or []
+        self.on_alert = on_alert
+        # The failures come from the worker threads
+        self._lock = threading.Lock()
+        self._attempts = {}
+        self._waiting = []
+        self.stats = {'retried': 0, 'given_up': 0, 'held': 0, 'pauses': 0}
+
+    def __len__(self):
+        """Get the number of jobs waiting to be retried or for their platform to resume."""
+        return len(self._waiting)
+
+    def is_transient(self, err):
+        """Check if the failure is worth retrying."""
+        if not isinstance(err, PpsProcessFailed):
+            return False
+        if err.killed:
+            return self.retry_timeouts
+        return not self.retry_exit_codes or err.returncode in self.retry_exit_codes
+
+    def get_backoff_seconds(self, attempt):
+        """Get the time to wait before retrying after the failed *attempt* (1 for the first run)."""
+        return min(self.backoff_seconds * self.backoff_factor ** (attempt - 1), self.max_backoff_seconds)
+
+    def hold(self, scene, msg, now=None):
+        """Hold the job if its platform is paused, and tell if it was held."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if not self.breaker.is_open(scene['platform_name'], now):
+                return False
+            self._waiting.append((now, scene, msg))
+            self.stats['held'] += 1
+        LOG.info("%s is paused, holding the scene %s", scene['platform_name'], str(scene['file4pps']))
+        return True
+
+    def job_succeeded(self, scene):
+        """Forget the failures of the job and of its platform."""
+        with self._lock:
+            self._attempts.pop(scene['file4pps'], None)
+            self.breaker.record_success(scene['platform_name'])
+
+    def job_failed(self, scene, msg, err, now=None):
+        """Count the failure, requeue the job if it is worth it, and tell if it was requeued."""
+        now = time.monotonic() if now is None else now
+        platform_name = scene['platform_name']
+        with self._lock:
+            paused = self.breaker.record_failure(platform_name, now)
+            attempt = self._attempts.get(scene['file4pps'], 0) + 1
+            requeued = self.is_transient(err) and attempt < self.max_attempts
+            if requeued:
+                self._attempts[scene['file4pps']] = attempt
+                delay = self.get_backoff_seconds(attempt)
+                self._waiting.append((now + delay, scene, msg))
+                self.stats['retried'] += 1
+            else:
+                self._attempts.pop(scene['file4pps'], None)
+                self.stats['given_up'] += 1
+            if paused:
+                self.stats['pauses'] += 1
+        if requeued:
+            count_event('job_retries')
+            LOG.warning("Job failed (%s), retrying in %.0f s: %s", str(err), delay, str(scene['file4pps']))
+        else:
+            LOG.error("Job failed (%s) after %d attempts, giving up: %s", str(err), attempt,
+                      str(scene['file4pps']))
+        if paused:
+            count_event('platform_pauses')
+            reason = "%d consecutive failures, last: %s" % (self.breaker.failures[platform_name], str(err))
+            LOG.error("Pausing %s for %.0f minutes: %s", platform_name, self.breaker.pause_seconds / 60, reason)
+            if self.on_alert is not None:
+                self.on_alert(scene, msg, reason)
+        return requeued
+
+    def flush(self, now=None):
+        """Get the (scene, msg) of the jobs due for a retry, whose platform is not paused."""
+        now = time.monotonic() if now is None else now
+        ready = []
+        waiting = []
+        with self._lock:
+            for due, scene, msg in self._waiting:
+                if due <= now and not self.breaker.is_open(scene['platform_name'], now):
+                    ready.append((scene, msg))
+                else:
+                    waiting.append((due, scene, msg))
+            self._waiting = waiting
+        return ready
+
+    def get_metrics(self, now=None):
+        """Get the number of waiting jobs, the paused platforms and the counters."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            metrics = dict(self.stats)
+            metrics['waiting'] = len(self._waiting)
+            metrics['paused_platforms'] = [platform_name for platform_name in self.breaker.paused_until
+                                           if self.breaker.is_open(platform_name, now)]
+        return metrics
+
+
+def create_job_failures(options, publish_q):
+    """Create the job failure handling from the runner config, None if not configured."""
+    settings = options.get('job_failures')
+    if not settings:
+        return None
+    if settings is True:
+        settings = {}
+
+    def publish_alert(scene, msg, reason):
+        publish_alert_message(msg, publish_q, scene, reason,
+                              station=options.get('station', 'unknown'),
+                              topic=settings.get('alert_topic'))
+
+    breaker = CircuitBreaker(max_consecutive_failures=settings.get('max_consecutive_failures', 5),
+                             pause_minutes=settings.get('pause_minutes', 30))
+    return JobFailures(breaker,
+                       max_attempts=settings.get('max_attempts', 2),
+                       backoff_seconds=settings.get('backoff_seconds', 120),
+                       backoff_factor=settings.get('backoff_factor', 2),
+                       max_backoff_seconds=settings.get('max_backoff_seconds', 1800),
+                       retry_timeouts=settings.get('retry_timeouts', True),
+                       retry_exit_codes=settings.get('retry_exit_codes'),
+                       on_alert=publish_alert)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A persistent journal of the PPS jobs, used to resume jobs after a restart.
+
+The journal is a small SQLite database with one row per level-1c file
+(the `file4pps` of the scene), holding the last state of the job, the exit
+status of its last run and the posttroll message that triggered it.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+
+from posttroll.message import Message
+
+from nwcsafpps_runner.granule_coalescing import iter_granules
+
+LOG = logging.getLogger(__name__)
+
+ACCEPTED = 'accepted'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+DROPPED = 'dropped'
+
+#: Jobs in these states were not completed and are resumed after a restart
+UNFINISHED_STATES = [ACCEPTED, RUNNING]
+
+
+class JobJournal(object):
+    """Keep track of the state of the PPS jobs in a SQLite database."""
+
+    def __init__(self, filename):
+        """Open (or create) the journal."""
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                               "file4pps TEXT PRIMARY KEY, "
+                               "state TEXT NOT NULL, "
+                               "message TEXT, "
+                               "attempts INTEGER NOT NULL DEFAULT 0, "
+                               "updated REAL NOT NULL, "
+                               "exit_status TEXT)")
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+            if 'exit_status' not in columns:
+                # Journals made before the exit status was recorded
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN exit_status TEXT")
+
+    def record(self, file4pps, state, msg=None, exit_status=None):
+        """Record the new state of the job, and the triggering message and the exit status if given."""
+        now = time.time()
+        rawmsg = msg.encode() if msg is not None else None
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO jobs (file4pps, state, message, updated, exit_status) "
+                               "VALUES (?, ?, ?, ?, ?) "
+                               "ON CONFLICT(file4pps) DO UPDATE SET state=excluded.state, "
+                               "message=COALESCE(excluded.message, jobs.message), updated=excluded.updated, "
+                               "exit_status=COALESCE(excluded.exit_status, jobs.exit_status)",
+                               (file4pps, state, rawmsg, now, exit_status))
+            if state == RUNNING:
+                self._conn.execute("UPDATE jobs SET attempts = attempts + 1 WHERE file4pps = ?", (file4pps, ))
+
+    def get_state(self, file4pps):
+        """Get the last recorded state of the job, or None if unknown."""
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM jobs WHERE file4pps = ?", (file4pps, )).fetchone()
+        return row[0] if row else None
+
+    def get_exit_status(self, file4pps):
+        """Get the exit status of the last run of the job, or None if unknown."""
+        with self._lock:
+            row = self._conn.execute("SELECT exit_status FROM jobs WHERE file4pps = ?", (file4pps, )).fetchone()
+        return row[0] if row else None
+
+    def get_attempts(self, file4pps):
+        """Get the number of times the job has been started."""
+        with self._lock:
+            row = self._conn.execute("SELECT attempts FROM jobs WHERE file4pps = ?", (file4pps, )).fetchone()
+        return row[0] if row else 0
+
+    def is_finished(self, file4pps):
+        """Check if the job has been successfully processed."""
+        return self.get_state(file4pps) == FINISHED
+
+    def get_unfinished_messages(self, max_attempts=None):
+        """Get the messages of the jobs that were accepted or running but never completed.
+
+        Jobs already started *max_attempts* times are left out, so that a job
+        crashing the runner is not restarted forever.
+        """
+        query = "SELECT file4pps, message, attempts FROM jobs WHERE state IN (%s) ORDER BY updated" % (
+            ','.join('?' * len(UNFINISHED_STATES)))
+        with self._lock:
+            rows = self._conn.execute(query, UNFINISHED_STATES).fetchall()
+
+        messages = []
+        for file4pps, rawmsg, attempts in rows:
+            if max_attempts is not None and attempts >= max_attempts:
+                LOG.warning("Job started %d times already, will not resume it: %s", attempts, file4pps)
+                self.record(file4pps, FAILED)
+                continue
+            if rawmsg is None:
+                continue
+            try:
+                messages.append(Message(rawstr=rawmsg))
+            except Exception:
+                LOG.exception("Failed decoding the journal message for %s", file4pps)
+        return messages
+
+    def prune(self, max_age_days):
+        """Remove the jobs not updated in the last *max_age_days* days."""
+        oldest = time.time() - max_age_days * 24 * 3600
+        with self._lock, self._conn:
+            nrows = self._conn.execute("DELETE FROM jobs WHERE updated < ?", (oldest, )).rowcount
+        LOG.debug("Pruned %d old jobs from the journal", nrows)
+        return nrows
+
+    def close(self):
+        """Close the journal."""
+        with self._lock:
+            self._conn.close()
+
+
+def record_scene(journal, scene, state, msg=None, exit_status=None):
+    """Record the state of the job of each granule of the scene, if there is a journal."""
+    if journal is None:
+        return
+    for granule, granule_msg in iter_granules(scene, msg):
+        journal.record(granule['file4pps'], state, granule_msg if msg is not None else None, exit_status)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Capture the output of the PPS processes in one log file per job.
+
+Instead of logging every line of the PPS output with the runner logger,
+the raw output (stdout and stderr together) of each PPS process is written
+in large chunks to its own file, named after the level-1c file and the
+script::
+
+    job_logs:
+      directory: /var/log/pps_runner/jobs
+      compress: true
+      buffer_bytes: 1048576
+      max_bytes: 100000000
+      backup_count: 3
+      error_patterns: [ERROR, CRITICAL, Traceback]
+      max_error_lines: 20
+
+Only the lines matching one of the `error_patterns` (up to
+`max_error_lines` of them) and a summary go to the runner log. The output
+beyond `max_bytes` is dropped. The log of a previous run on the same scene
+is rotated to `.1`, `.2`... keeping `backup_count` of them.
+"""
+
+import gzip
+import io
+import logging
+import os
+import re
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {'compress': False,
+                    'buffer_bytes': 1024 * 1024,
+                    'max_bytes': 100 * 1000 * 1000,
+                    'backup_count': 3,
+                    'error_patterns': ['ERROR', 'CRITICAL', 'Traceback'],
+                    'max_error_lines': 20}
+
+
+def get_command_name(cmd):
+    """Get the name of the script run by a python command, or of the program."""
+    for arg in cmd:
+        if arg.endswith('.py'):
+            return os.path.splitext(os.path.basename(arg))[0]
+    return os.path.basename(cmd[0])
+
+
+def get_job_name(scene, cmd):
+    """Get the name of the command run on the scene, from the level-1c file and the script."""
+    if isinstance(cmd, str):
+        cmd = cmd.split(" ")
+    try:
+        basename = os.path.splitext(os.path.basename(scene['file4pps']))[0]
+    except (KeyError, TypeError):
+        basename = str(scene)
+    return "%s_%s" % (basename, get_command_name(cmd))
+
+
+def rotate(path, backup_count):
+    """Rotate the file to path.1, path.1 to path.2 and so on, keeping *backup_count* files."""
+    if not os.path.exists(path):
+        return
+    if backup_count <= 0:
+        os.remove(path)
+        return
+    for idx in range(backup_count - 1, 0, -1):
+        older = "%s.%d" % (path, idx)
+        if os.path.exists(older):
+            os.replace(older, "%s.%d" % (path, idx + 1))
+    os.replace(path, path + '.1')
+
+
+class JobLog(object):
+    """The output of one PPS process, written to a file."""
+
+    def __init__(self, path, compress=False, buffer_bytes=DEFAULT_SETTINGS['buffer_bytes'],
+                 max_bytes=DEFAULT_SETTINGS['max_bytes'], backup_count=DEFAULT_SETTINGS['backup_count'],
+                 error_patterns=DEFAULT_SETTINGS['error_patterns'],
+                 max_error_lines=DEFAULT_SETTINGS['max_error_lines'], progress=None):
+        """Init the job log, the complete lines of output are also fed to the PGE *progress* if given."""
+        self.path = path + '.gz' if compress else path
+        self.buffer_bytes = int(buffer_bytes)
+        self.max_bytes = int(max_bytes)
+        self.max_error_lines = int(max_error_lines)
+        self._error_re = None
+        if error_patterns:
+            alternatives = b'|'.join(re.escape(pattern.encode()) for pattern in error_patterns)
+            self._error_re = re.compile(b'^.*(?:' + alternatives + b').*$', re.MULTILINE)
+        self.written = 0
+        self.dropped = 0
+        self.error_lines = 0
+        self.progress = progress
+        self._partial = b''
+        rotate(self.path, int(backup_count))
+        if compress:
+            self._file = io.BufferedWriter(gzip.GzipFile(self.path, 'wb', compresslevel=6),
+                                           buffer_size=self.buffer_bytes)
+        else:
+            self._file = open(self.path, 'wb', buffering=self.buffer_bytes)
+
+    def write(self, chunk):
+        """Write a chunk of output, and log the error lines in it."""
+        if self.written < self.max_bytes:
+            kept = chunk[:self.max_bytes - self.written]
+            self._file.write(kept)
+            self.written += len(kept)
+            if self.written >= self.max_bytes:
+                self._file.write(b'\n[output truncated after %d bytes]\n' % self.max_bytes)
+            self.dropped += len(chunk) - len(kept)
+        else:
+            self.dropped += len(chunk)
+        self._scan(chunk)
+
+    def _scan(self, chunk):
+        if self._error_re is None and self.progress is None:
+            return
+        # Lines cut at the end of a chunk are scanned with the next chunk
+        text = self._partial + chunk
+        end = text.rfind(b'\n') + 1
+        self._partial = text[end:][-self.buffer_bytes:]
+        self._scan_lines(text[:end])
+
+    def _scan_lines(self, text):
+        if self.progress is not None:
+            self.progress.feed(text)
+        if self._error_re is None:
+            return
+        for match in self._error_re.finditer(text):
+            self.error_lines += 1
+            if self.error_lines <= self.max_error_lines:
+                LOG.error("%s: %s", os.path.basename(self.path), match.group(0).decode(errors='replace').strip())
+
+    def drain(self, stream):
+        """Read the stream in large chunks until it is closed, writing the output to the file."""
+        read = getattr(stream, 'read1', stream.read)
+        while True:
+            chunk = read(self.buffer_bytes)
+            if not chunk:
+                break
+            self.write(chunk)
+        stream.close()
+
+    async def drain_async(self, stream):
+        """Read the asyncio stream in large chunks until it is closed, writing the output to the file."""
+        while True:
+            chunk = await stream.read(self.buffer_bytes)
+            if not chunk:
+                break
+            self.write(chunk)
+
+    def close(self):
+        """Close the file, and log a summary of the output."""
+        if self._partial:
+            self._scan_lines(self._partial)
+        self._file.close()
+        LOG.info("Process output: %d bytes in %s%s, %d error lines", self.written, self.path,
+                 ", %d bytes dropped" % self.dropped if self.dropped else "", self.error_lines)
+
+
+def create_job_log(options, scene, cmd, progress=None):
+    """Create the log of the command run on the scene, None if job logs are not configured."""
+    settings = options.get('job_logs')
+    if not settings:
+        return None
+    directory = settings['directory']
+    os.makedirs(directory, exist_ok=True)
+    kwargs = {key: settings.get(key, default) for key, default in DEFAULT_SETTINGS.items()}
+    return JobLog(os.path.join(directory, get_job_name(scene, cmd) + '.log'), progress=progress, **kwargs)
@@ -22,17 +22,13 @@
 
 """The level-1c processing tools."""
 
+import importlib
 import logging
-from multiprocessing import Manager, Process, cpu_count
+from multiprocessing import cpu_count
 from urllib.parse import urlparse
 
-from level1c4pps.avhrr2pps_lib import process_one_scene as process_avhrr
-from level1c4pps.metimage2pps_lib import process_one_scene as process_metimage
-from level1c4pps.modis2pps_lib import process_one_scene as process_modis
-from level1c4pps.seviri2pps_lib import process_one_scan as process_seviri
-from level1c4pps.viirs2pps_lib import process_one_scene as process_viirs
-
 from nwcsafpps_runner.config import get_config
+from nwcsafpps_runner.l1c_workers import L1cWorkerPool
 
 LOG = logging.getLogger(__name__)
 
@@ -45,11 +41,13 @@ SUPPORTED_SATELLITES = {'seviri-l1c': ['meteosat-8', 'meteosat-9', 'meteosat-10'
                         'modis-l1c': ['eos-terra', 'eos-aqua']
                         }
 
-LVL1C_PROCESSOR_MAPPING = {'seviri-l1c': process_seviri,
-                           'metimage-l1c': process_metimage,
-                           'viirs-l1c': process_viirs,
-                           'modis-l1c': process_modis,
-                           'avhrr-l1c': process_avhrr}
+#: The level1c4pps processing function of each service, as 'module:function' imported when first used,
+#: so that a service does not import the readers of the other sensors
+LVL1C_PROCESSOR_MAPPING = {'seviri-l1c': 'level1c4pps.seviri2pps_lib:process_one_scan',
+                           'metimage-l1c': 'level1c4pps.metimage2pps_lib:process_one_scene',
+                           'viirs-l1c': 'level1c4pps.viirs2pps_lib:process_one_scene',
+                           'modis-l1c': 'level1c4pps.modis2pps_lib:process_one_scene',
+                           'avhrr-l1c': 'level1c4pps.avhrr2pps_lib:process_one_scene'}
 
 
 class ServiceNameNotSupported(Exception):
@@ -99,6 +97,14 @@ class L1cProcessor(object):
         if self.nameservers is not None and not isinstance(self.nameservers, list):
             self.nameservers = [self.nameservers]
         self.orbit_number_from_msg = options.get('orbit_number_from_msg', False)
+        self.num_of_cpus = int(options.get('num_of_cpus', 1))
+        # The workers are forked from a server with the processor already imported
+        self.workers = L1cWorkerPool(nworkers=self.num_of_cpus,
+                                     time_limit_seconds=self.time_limit_seconds,
+                                     max_jobs_per_worker=options.get('worker_max_jobs', 50),
+                                     max_rss_mb=options.get('worker_max_rss_mb'),
+                                     name=service_name + '-worker',
+                                     preload=[get_l1c_processor(service_name).__module__])
 
     def initialize(self, service):
         """Initialize the processor."""
@@ -109,31 +115,79 @@ class L1cProcessor(object):
         self.level1_files = []
         self.service = service
 
-    def run_inner(self, l1c_proc_func, result_dict):
-        """Start the L1c processing using the relevant sensor specific function from level1c4pps."""
-        result_dict["l1cfile"] = l1c_proc_func(self.level1_files,
-                                               self.result_home,
-                                               **self._l1c_processor_call_kwargs)
+    def create_job(self, msg):
+        """Check the message and get the level-1c job for it."""
+        return L1cJob(msg, self.service, self.orbit_number_from_msg)
+
+    def process(self, job):
+        """Start the L1c processing of the job using the relevant sensor specific function from level1c4pps.
+
+        The job is run in one of the worker processes, so that several jobs
+        can be processed at once from different threads.
+        """
+        l1c_proc = get_l1c_processor(self.service)
+        LOG.debug(
+            "Starting level1c processing in a worker process.")
+        # Normally takes 3-8s for VIIRS
+        job.l1cfile = self.workers.run(l1c_proc, job.level1_files, self.result_home,
+                                       self._l1c_processor_call_kwargs)
+        LOG.debug("Level-1c worker metrics: %s", str(self.workers.get_metrics()))
+        return job
 
     def run(self, msg):
-        """Start the L1c processing using the relevant sensor specific function from level1c4pps."""
+        """Start the L1c processing using the relevant sensor specific function from level1c4pps.
+
+        The state of the job is kept in the processor.
+        """
+        job = self.create_job(msg)
+        self.platform_name = job.platform_name
+        self.sensor = job.sensor
+        self.message_data = job.message_data
+        self.orbit_number = job.orbit_number
+        self.level1_files = job.level1_files
+        self.process(job)
+        self.l1cfile = job.l1cfile
+
+    def start(self):
+        """Start the worker processes, from the main thread before the jobs come."""
+        self.workers.start()
+
+    def close(self):
+        """Stop the worker processes."""
+        self.workers.close()
+
+    def get_level1_files_from_dataset(self, level1_dataset):
+        """Get the level-1 files from the dataset."""
+        self.level1_files = get_level1_files_from_dataset(self.service, level1_dataset)
+
+    def check_platform_name_consistent_with_service(self):
+        """Check that the platform name is consistent with the service name."""
+        check_platform_name_consistent_with_service(self.platform_name, self.service)
+
+
+class L1cJob(object):
+    """The level-1c processing of one message."""
+
+    def __init__(self, msg, service, orbit_number_from_msg=False):
         check_message_okay(msg)
 
+        self.service = service
         self.platform_name = str(msg.data['platform_name'])
-        self.check_platform_name_consistent_with_service()
+        check_platform_name_consistent_with_service(self.platform_name, service)
 
         self.sensor = str(msg.data['sensor'])
-        self.message_data = self._get_message_data(msg)
+        self.message_data = msg.data
+        self.orbit_number = 99999  # Initialized orbit number
+        self.l1cfile = None
 
-        if self.orbit_number_from_msg:
+        if orbit_number_from_msg:
             if 'orbit_number' in self.message_data:
                 self.orbit_number = int(self.message_data.get('orbit_number'))
             else:
                 LOG.warning("You asked for orbit_number from the message, but its not there. Keep init orbit.")
 
         if msg.type == 'dataset':
-            level1_dataset = self.message_data.get('dataset')
-            self.get_level1_files_from_dataset(level1_dataset)
+            self.level1_files = get_level1_files_from_dataset(service, self.message_data.get('dataset'))
         else:
             # Just one file; e.g. NOAA-POES or Metop AVHRR level-1 data
             self.level1_files = [urlparse(self.message_data.get('uri')).path]
@@ -141,46 +195,31 @@ class L1cProcessor(object):
         if len(self.level1_files) < 1:
             raise DatasetIsEmpty('No level-1 data in dataset!')
 
-        l1c_proc = LVL1C_PROCESSOR_MAPPING.get(self.service)
-        if not l1c_proc:
-            raise AttributeError("Could not find suitable level-1c processor! Service = %s" % self.service)
-        LOG.debug(
-            "Starting level1c processing in separate process.")
-        manager = Manager()
-        result_dict = manager.dict()
-        process1 = Process(
-            name="Process one level1c file in a separate process.",
-            target=self.run_inner,
-            args=(l1c_proc, result_dict))
-        process1.start()
-        process1.join(self.time_limit_seconds)  # Normally takes 3-8s for VIIRS
-        self.l1cfile = result_dict.get("l1cfile", None)
-        try:
-            process1.close()
-        except ValueError:
-            # if process1.is_alive():
-            LOG.warning(
-                "Processing level1c file not terminated after {:d}s.".format(int(self.time_limit_seconds)))
-            process1.terminate()
-
-    def _get_message_data(self, message):
-        """Return the data dict in the Posttroll message."""
-        return message.data
 
-    def get_level1_files_from_dataset(self, level1_dataset):
-        """Get the level-1 files from the dataset."""
-        if self.service in ['seviri-l1c']:
-            self.level1_files = get_seviri_level1_files_from_dataset(level1_dataset)
-        else:
-            for level1 in level1_dataset:
-                self.level1_files.append(urlparse(level1['uri']).path)
+def get_l1c_processor(service):
+    """Get the level1c4pps processing function of the service, importing it if needed."""
+    l1c_proc = LVL1C_PROCESSOR_MAPPING.get(service)
+    if not l1c_proc:
+        raise AttributeError("Could not find suitable level-1c processor! Service = %s" % service)
+    if isinstance(l1c_proc, str):
+        module_name, function_name = l1c_proc.split(':')
+        l1c_proc = getattr(importlib.import_module(module_name), function_name)
+    return l1c_proc
 
-    def check_platform_name_consistent_with_service(self):
-        """Check that the platform name is consistent with the service name."""
-        if self.platform_name.lower() not in SUPPORTED_SATELLITES.get(self.service, []):
-            errmsg = ("%s: Platform name not supported for this service: %s",
-                      str(self.platform_name), self.service)
-            raise PlatformNameInconsistentWithService(errmsg)
+
+def get_level1_files_from_dataset(service, level1_dataset):
+    """Get the level-1 files from the dataset."""
+    if service in ['seviri-l1c']:
+        return get_seviri_level1_files_from_dataset(level1_dataset)
+    return [urlparse(level1['uri']).path for level1 in level1_dataset]
+
+
+def check_platform_name_consistent_with_service(platform_name, service):
+    """Check that the platform name is consistent with the service name."""
+    if platform_name.lower() not in SUPPORTED_SATELLITES.get(service, []):
+        errmsg = ("%s: Platform name not supported for this service: %s",
+                  str(platform_name), service)
+        raise PlatformNameInconsistentWithService(errmsg)
 
 
 def get_seviri_level1_files_from_dataset(level1_dataset):
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Long-lived worker processes for the level-1c processing.
+
+The level1c4pps processing of a message runs in a separate process, so
+that a hanging reader can be killed after `time_limit_seconds`. Instead of
+starting a new process (and a multiprocessing manager) per message, the
+jobs are sent over a pipe to worker processes kept alive between the
+messages, which keep the imported readers and their caches. A worker is
+recycled after `worker_max_jobs` jobs, or when its peak resident memory
+passes `worker_max_rss_mb`, and killed when a job goes over the time
+limit. The workers are forked from a fork server with the level1c4pps
+processor already imported, never from the threaded runner itself::
+
+    viirs-l1c:
+      time_limit_seconds: 60
+      worker_max_jobs: 50
+      worker_max_rss_mb: 4000
+"""
+
+import logging
+import multiprocessing
+import queue
+import resource
+import threading
+
+LOG = logging.getLogger(__name__)
+
+#: Seconds to wait for a worker to exit before killing it
+STOP_TIMEOUT_SECONDS = 5
+
+
+def get_peak_rss_mb():
+    """Get the peak resident memory of the process, in MB."""
+    # In kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _worker_loop(conn):
+    """Run the jobs received on the connection until None comes."""
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        l1c_proc_func, level1_files, result_home, kwargs = job
+        try:
+            l1cfile = l1c_proc_func(level1_files, result_home, **kwargs)
+        except Exception:
+            LOG.exception("Level-1c processing failed for %s", str(level1_files))
+            l1cfile = None
+        conn.send((l1cfile, get_peak_rss_mb()))
+    conn.close()
+
+
+class L1cWorker(object):
+    """A worker process running level-1c jobs sent over a pipe."""
+
+    def __init__(self, name, ctx=multiprocessing):
+        """Start the worker process, from the multiprocessing context *ctx*."""
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(name=name, target=_worker_loop, args=(child_conn, ), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.peak_rss_mb = 0.0
+        LOG.debug("Started the level-1c worker %s, pid %d", name, self.process.pid)
+
+    @property
+    def name(self):
+        """Get the name of the worker."""
+        return self.process.name
+
+    def run(self, l1c_proc_func, level1_files, result_home, kwargs, time_limit_seconds):
+        """Run the job, and get the level-1c file, or None if it failed.
+
+        Raise TimeoutError if the job is not done in time. The worker is
+        then killed.
+        """
+        self.jobs += 1
+        try:
+            self.conn.send((l1c_proc_func, level1_files, result_home, kwargs))
+            done = self.conn.poll(time_limit_seconds)
+            if done:
+                l1cfile, self.peak_rss_mb = self.conn.recv()
+        except (EOFError, OSError):
+            LOG.warning("Level-1c worker %s died, exit code %s", self.name, str(self.process.exitcode))
+            self.kill()
+            return None
+        if not done:
+            self.kill()
+            raise TimeoutError("Processing level1c file not terminated after {:d}s.".format(
+                int(time_limit_seconds)))
+        return l1cfile
+
+    def is_alive(self):
+        """Check the worker process is running."""
+        return self.process.is_alive()
+
+    def stop(self):
+        """Let the worker exit when done with the current job, kill it if it does not."""
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(STOP_TIMEOUT_SECONDS)
+        self.kill()
+
+    def kill(self):
+        """Kill the worker process."""
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class L1cWorkerPool(object):
+    """A pool of long-lived level-1c worker processes, started when first needed or by `start`.
+
+    The workers are forked from a fork server importing the *preload*
+    modules once: forking the runner from one of its threads could leave
+    the worker with a lock held by another thread.
+    """
+
+    def __init__(self, nworkers=1, time_limit_seconds=60, max_jobs_per_worker=50, max_rss_mb=None,
+                 name='l1c-worker', preload=()):
+        self._ctx = multiprocessing.get_context('forkserver')
+        self._ctx.set_forkserver_preload([__name__] + list(preload))
+        self.nworkers = nworkers
+        self.time_limit_seconds = time_limit_seconds
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_rss_mb = max_rss_mb
+        self.name = name
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._started = 0
+        self._workers = set()
+        for _ in range(nworkers):
+            # None is a slot for a worker not started yet
+            self._idle.put(None)
+        self.stats = {'jobs': 0, 'timeouts': 0, 'recycled': 0}
+
+    def start(self):
+        """Start the fork server and all the workers now, so that the first jobs do not wait for them."""
+        workers = [self._idle.get() for _ in range(self.nworkers)]
+        for worker in workers:
+            self._idle.put(worker if worker is not None else self._start_worker())
+        LOG.info("Started %d level-1c workers", self.nworkers)
+
+    def _start_worker(self):
+        with self._lock:
+            self._started += 1
+            worker = L1cWorker('%s-%d' % (self.name, self._started), self._ctx)
+            self._workers.add(worker)
+        return worker
+
+    def _retire(self, worker, reason):
+        LOG.debug("Recycling the level-1c worker %s: %s", worker.name, reason)
+        worker.stop()
+        with self._lock:
+            self._workers.discard(worker)
+            self.stats['recycled'] += 1
+
+    def _needs_recycling(self, worker):
+        if self.max_jobs_per_worker and worker.jobs >= self.max_jobs_per_worker:
+            return "%d jobs done" % worker.jobs
+        if self.max_rss_mb and worker.peak_rss_mb > self.max_rss_mb:
+            return "peak memory %.0f MB" % worker.peak_rss_mb
+        return None
+
+    def run(self, l1c_proc_func, level1_files, result_home, kwargs=None):
+        """Run *l1c_proc_func(level1_files, result_home, **kwargs)* in a worker, and get the level-1c file.
+
+        Wait for a free worker if they are all busy. Get None if the
+        processing failed or went over the time limit.
+        """
+        worker = self._idle.get()
+        try:
+            if worker is None or not worker.is_alive():
+                if worker is not None:
+                    self._discard(worker)
+                worker = self._start_worker()
+            with self._lock:
+                self.stats['jobs'] += 1
+            try:
+                return worker.run(l1c_proc_func, level1_files, result_home, kwargs or {}, self.time_limit_seconds)
+            except TimeoutError as err:
+                LOG.warning(str(err))
+                with self._lock:
+                    self.stats['timeouts'] += 1
+                self._discard(worker)
+                worker = None
+                return None
+        finally:
+            if worker is not None and not worker.is_alive():
+                self._discard(worker)
+                worker = None
+            if worker is not None:
+                reason = self._needs_recycling(worker)
+                if reason is not None:
+                    self._retire(worker, reason)
+                    worker = None
+            self._idle.put(worker)
+
+    def _discard(self, worker):
+        worker.kill()
+        with self._lock:
+            self._workers.discard(worker)
+
+    def get_metrics(self):
+        """Get the number of running workers and the job counters."""
+        with self._lock:
+            metrics = dict(self.stats)
+            metrics['workers'] = len(self._workers)
+        return metrics
+
+    def close(self):
+        """Stop the workers."""
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.stop()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Timing of the phases of the PPS jobs, served in the Prometheus text format.
+
+The time spent by each job waiting in the queue, checking the host and
+files, running ppsRunAll and ppsCmaskProb, making the XML statistics and
+publishing is kept as histograms, together with the queue depth and active
+jobs of the worker pools, the number of time outs and failed jobs, the time
+spent in each PGE and the current PGE of the running jobs. They are served
+on http://<metrics_host>:<metrics_port>/metrics if a port is given in the
+runner config::
+
+    metrics_port: 9120
+    metrics_host: 0.0.0.0
+
+The format is written here, so no Prometheus client library is needed.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOG = logging.getLogger(__name__)
+
+#: The phases of a PPS job
+PHASES = ['queue_wait', 'checks', 'run_all', 'cmask_prob', 'xml_statistics', 'publish', 'job']
+
+#: Upper bounds in seconds of the histogram buckets
+DEFAULT_BUCKETS = (0.1, 1, 5, 10, 30, 60, 120, 300, 600, 900, 1200, 1800, 3600)
+
+#: The counters of the runner, with their help text
+COUNTERS = {'process_timeouts': "PPS processes killed on time out",
+            'job_failures': "PPS jobs that failed",
+            'reruns_skipped': "PPS jobs not run again as their products were already there",
+            'job_retries': "Failed PPS jobs requeued for a retry",
+            'platform_pauses': "Platforms paused after consecutive job failures"}
+
+#: The pool counters exported per pool
+POOL_COUNTERS = ['submitted', 'rejected', 'evicted', 'completed', 'failed']
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+PREFIX = 'pps_runner_'
+
+
+def format_value(value):
+    """Format a number for the text format."""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram(object):
+    """Counts of the observed values per bucket, with their sum."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = sorted(buckets) + [float('inf')]
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Add a value."""
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[idx] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        """Get the lines of the histogram, with cumulative buckets."""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, format_value(bound), cumulative))
+        lines.append('%s_sum{%s} %s' % (name, labels, format_value(self.sum)))
+        lines.append('%s_count{%s} %d' % (name, labels, self.count))
+        return lines
+
+
+class MetricsRegistry(object):
+    """The phase histograms, counters and worker pools of the runner."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._lock = threading.Lock()
+        self.phases = {phase: Histogram(buckets) for phase in PHASES}
+        self.counters = {name: 0 for name in COUNTERS}
+        self.pools = []
+        self.pges = {}
+        self.jobs = []
+        self._buckets = buckets
+
+    def observe_phase(self, phase, seconds):
+        """Add the duration of a job phase."""
+        with self._lock:
+            self.phases[phase].observe(seconds)
+
+    def observe_pge(self, pge, seconds):
+        """Add the duration of a PGE."""
+        with self._lock:
+            if pge not in self.pges:
+                self.pges[pge] = Histogram(self._buckets)
+            self.pges[pge].observe(seconds)
+
+    def inc(self, name, amount=1):
+        """Increase a counter."""
+        with self._lock:
+            self.counters[name] += amount
+
+    def register_pool(self, pool):
+        """Export the queue depth, active jobs and counters of a worker pool (or asyncio lane)."""
+        with self._lock:
+            self.pools.append(pool)
+
+    def register_job(self, job):
+        """Export the current PGE of a running job."""
+        with self._lock:
+            self.jobs.append(job)
+
+    def unregister_job(self, job):
+        """Stop exporting the current PGE of a job that has ended."""
+        with self._lock:
+            if job in self.jobs:
+                self.jobs.remove(job)
+
+    def render(self):
+        """Get the metrics in the Prometheus text format."""
+        name = PREFIX + 'phase_duration_seconds'
+        lines = ['# HELP %s Time spent in each phase of the PPS jobs.' % name,
+                 '# TYPE %s histogram' % name]
+        with self._lock:
+            for phase, histogram in self.phases.items():
+                lines += histogram.render(name, 'phase="%s"' % phase)
+            name = PREFIX + 'pge_duration_seconds'
+            lines += ['# HELP %s Time spent in each PGE.' % name, '# TYPE %s histogram' % name]
+            for pge, histogram in sorted(self.pges.items()):
+                lines += histogram.render(name, 'pge="%s"' % pge)
+            for counter, help_text in COUNTERS.items():
+                name = PREFIX + counter + '_total'
+                lines += ['# HELP %s %s.' % (name, help_text),
+                          '# TYPE %s counter' % name,
+                          '%s %d' % (name, self.counters[counter])]
+            pools = list(self.pools)
+            jobs = list(self.jobs)
+
+        name = PREFIX + 'job_current_pge_seconds'
+        lines += ['# HELP %s Time spent so far in the current PGE of the running jobs.' % name,
+                  '# TYPE %s gauge' % name]
+        for job in jobs:
+            status = job.get_status()
+            if status['current_pge'] is not None:
+                lines.append('%s{job="%s",pge="%s"} %s' % (name, status['job'], status['current_pge'],
+                                                           format_value(status['current_pge_seconds'])))
+
+        pool_metrics = [(pool.name, pool.get_metrics()) for pool in pools]
+        for gauge, help_text in [('queue_depth', "Jobs waiting for a free worker"),
+                                 ('active_jobs', "Jobs running"),
+                                 ('concurrency_limit', "Jobs allowed to run at the same time")]:
+            name = PREFIX + gauge
+            lines += ['# HELP %s %s.' % (name, help_text), '# TYPE %s gauge' % name]
+            lines += ['%s{pool="%s"} %d' % (name, pool_name, metrics[gauge]) for pool_name, metrics in pool_metrics]
+        name = PREFIX + 'pool_jobs_total'
+        lines += ['# HELP %s Jobs of the worker pools, per event.' % name, '# TYPE %s counter' % name]
+        for pool_name, metrics in pool_metrics:
+            lines += ['%s{pool="%s",event="%s"} %d' % (name, pool_name, event, metrics[event])
+                      for event in POOL_COUNTERS]
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def observe_phase(phase, seconds):
+    """Add the duration of a job phase to the registry."""
+    REGISTRY.observe_phase(phase, seconds)
+
+
+@contextmanager
+def time_phase(phase):
+    """Time the code in the with block as the job *phase*."""
+    start_time = time.monotonic()
+    try:
+        yield
+    finally:
+        observe_phase(phase, time.monotonic() - start_time)
+
+
+def observe_pge(pge, seconds):
+    """Add the duration of a PGE to the registry."""
+    REGISTRY.observe_pge(pge, seconds)
+
+
+def count_event(name, amount=1):
+    """Increase the counter *name* of the registry."""
+    REGISTRY.inc(name, amount)
+
+
+def register_pool(pool):
+    """Export the metrics of the worker pool."""
+    REGISTRY.register_pool(pool)
+
+
+def register_job(job):
+    """Export the current PGE of the running job."""
+    REGISTRY.register_job(job)
+
+
+def unregister_job(job):
+    """Stop exporting the current PGE of the job."""
+    REGISTRY.unregister_job(job)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the metrics of the registry of the server."""
+
+    def do_GET(self):
+        """Send the metrics."""
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Log the requests at debug level."""
+        LOG.debug("Metrics request from %s: %s", self.address_string(), format % args)
+
+
+class MetricsServer(object):
+    """An HTTP server of the /metrics page, in a thread."""
+
+    def __init__(self, port, host='127.0.0.1', registry=REGISTRY):
+        self.httpd = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = registry
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='pps-metrics-server', daemon=True)
+
+    @property
+    def port(self):
+        """Get the port served, useful when started on port 0."""
+        return self.httpd.server_address[1]
+
+    def start(self):
+        """Start serving."""
+        self._thread.start()
+        LOG.info("Serving the metrics on http://%s:%d/metrics", self.httpd.server_address[0], self.port)
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+
+
+def start_metrics_server(options):
+    """Start the metrics server of the runner config, None if no port is configured."""
+    port = options.get('metrics_port')
+    if port is None:
+        return None
+    return MetricsServer(port, options.get('metrics_host', '127.0.0.1')).start()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Hold back the scenes until the NWP data they need have been prepared.
+
+The NWP files made by `run_nwp_preparation.py` are registered from its
+messages and from a scan of the NWP directory::
+
+    nwp_dependency:
+      file_pattern: 'LL02_NHSPSF_{analysis_time:%Y%m%d%H%M}+{forecast_step:d}H00M'
+      directory: /san1/pps/import/NWP_data/source
+      subscribe_topics: [/NWP/pps]
+      scan_interval_seconds: 60
+      max_forecast_interval_hours: 6
+      max_wait_minutes: 30
+      lookback_hours: 48
+
+A scene is run when there are forecasts valid at most
+`max_forecast_interval_hours` before and after its start time, which PPS
+interpolates between. Until then it is parked, for at most
+`max_wait_minutes`, after which it is run with whatever NWP data there is.
+The forecasts valid more than `lookback_hours` before the latest one are
+forgotten.
+"""
+
+import bisect
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from glob import glob
+
+import posttroll.subscriber
+from trollsift import Parser
+
+LOG = logging.getLogger(__name__)
+
+
+def get_naive_utc(dtime):
+    """Get the datetime as a naive UTC datetime."""
+    if dtime.tzinfo is not None:
+        dtime = dtime.astimezone(timezone.utc).replace(tzinfo=None)
+    return dtime
+
+
+class NwpRegistry(object):
+    """The valid times of the prepared NWP forecasts."""
+
+    def __init__(self, file_pattern, directory=None, scan_interval_seconds=60, lookback_hours=48):
+        self.parser = Parser(file_pattern)
+        self.file_pattern = file_pattern
+        self.directory = directory
+        self.scan_interval_seconds = scan_interval_seconds
+        self.lookback = timedelta(hours=lookback_hours)
+        self._lock = threading.Lock()
+        self._valid_times = []
+        self._last_scan = None
+
+    def __len__(self):
+        """Get the number of forecasts registered."""
+        return len(self._valid_times)
+
+    def get_valid_time(self, filename):
+        """Get the valid time of the forecast in the file, None if the name does not match the pattern."""
+        try:
+            info = self.parser.parse(os.path.basename(filename))
+        except ValueError:
+            return None
+        analysis_time = get_naive_utc(info['analysis_time'])
+        if analysis_time.year == 1900:
+            analysis_time = analysis_time.replace(year=datetime.now(timezone.utc).year)
+        return analysis_time + timedelta(hours=int(info['forecast_step']))
+
+    def add_file(self, filename):
+        """Register a prepared NWP file, and forget the forecasts older than the lookback window."""
+        valid_time = self.get_valid_time(filename)
+        if valid_time is None:
+            LOG.debug("Not an NWP file for PPS: %s", filename)
+            return
+        with self._lock:
+            if self._valid_times and valid_time < self._valid_times[-1] - self.lookback:
+                return
+            idx = bisect.bisect_left(self._valid_times, valid_time)
+            if idx < len(self._valid_times) and self._valid_times[idx] == valid_time:
+                return
+            self._valid_times.insert(idx, valid_time)
+            del self._valid_times[:bisect.bisect_left(self._valid_times, self._valid_times[-1] - self.lookback)]
+        LOG.debug("NWP forecast valid at %s: %s", valid_time.isoformat(), filename)
+
+    def scan(self, now=None):
+        """Register the files of the NWP directory, if configured and not scanned recently."""
+        now = time.monotonic() if now is None else now
+        if self.directory is None:
+            return
+        if self._last_scan is not None and now - self._last_scan < self.scan_interval_seconds:
+            return
+        self._last_scan = now
+        for filename in glob(os.path.join(self.directory, '*')):
+            self.add_file(filename)
+
+    def covers(self, dtime, max_interval):
+        """Check there are forecasts valid within *max_interval* before and after *dtime*."""
+        dtime = get_naive_utc(dtime)
+        with self._lock:
+            idx = bisect.bisect_right(self._valid_times, dtime)
+            before = self._valid_times[idx - 1] if idx > 0 else None
+            if before == dtime:
+                return True
+            after = self._valid_times[idx] if idx < len(self._valid_times) else None
+        return (before is not None and dtime - before <= max_interval and
+                after is not None and after - dtime <= max_interval)
+
+
+class NwpGate(object):
+    """Park the scenes whose NWP data is not there yet."""
+
+    def __init__(self, registry, max_forecast_interval_hours=6, max_wait_minutes=30):
+        self.registry = registry
+        self.max_interval = timedelta(hours=max_forecast_interval_hours)
+        self.max_wait_seconds = max_wait_minutes * 60.0
+        self._parked = []
+        self.stats = {'parked': 0, 'released': 0, 'expired': 0}
+
+    def __len__(self):
+        """Get the number of parked scenes."""
+        return len(self._parked)
+
+    def nwp_ready(self, scene):
+        """Check the NWP data for the scene is there."""
+        if not isinstance(scene.get('starttime'), datetime):
+            return True
+        return self.registry.covers(scene['starttime'], self.max_interval)
+
+    def add(self, scene, msg, now=None):
+        """Add a scene, and get the list of (scene, msg) jobs ready to be dispatched."""
+        if self.nwp_ready(scene):
+            return [(scene, msg)]
+        now = time.monotonic() if now is None else now
+        LOG.info("No NWP data for %s yet, parking the scene", str(scene['file4pps']))
+        self._parked.append((now, scene, msg))
+        self.stats['parked'] += 1
+        return []
+
+    def flush(self, now=None):
+        """Get the parked jobs whose NWP data has come, or that have waited too long."""
+        now = time.monotonic() if now is None else now
+        self.registry.scan(now)
+        ready = []
+        parked = []
+        for arrival, scene, msg in self._parked:
+            if self.nwp_ready(scene):
+                LOG.info("NWP data for %s is there, releasing the scene", str(scene['file4pps']))
+                self.stats['released'] += 1
+            elif now - arrival >= self.max_wait_seconds:
+                LOG.warning("No NWP data for %s after %.0f minutes, running it anyway",
+                            str(scene['file4pps']), self.max_wait_seconds / 60)
+                self.stats['expired'] += 1
+            else:
+                parked.append((arrival, scene, msg))
+                continue
+            ready.append((scene, msg))
+        self._parked = parked
+        return ready
+
+    def get_metrics(self):
+        """Get the number of parked scenes and forecasts, and the scene counters."""
+        metrics = dict(self.stats)
+        metrics['waiting'] = len(self._parked)
+        metrics['nwp_forecasts'] = len(self.registry)
+        return metrics
+
+
+class NwpListener(threading.Thread):
+    """Register the NWP files from the messages of the NWP preparation."""
+
+    def __init__(self, registry, subscribe_topics):
+        """Init the NWP listener."""
+        threading.Thread.__init__(self, name='nwp-listener', daemon=True)
+        self.loop = True
+        self.registry = registry
+        self.subscribe_topics = subscribe_topics
+
+    def stop(self):
+        """Stop the NWP listener."""
+        self.loop = False
+
+    def run(self):
+        """Run the NWP listener."""
+        LOG.debug("NWP subscribe topics = %s", str(self.subscribe_topics))
+        with posttroll.subscriber.Subscribe("", self.subscribe_topics, True) as subscr:
+            for msg in subscr.recv(timeout=90):
+                if not self.loop:
+                    break
+                if msg and 'uri' in msg.data:
+                    self.registry.add_file(msg.data['uri'])
+
+
+def create_nwp_gate(options):
+    """Create the NWP gate from the runner config, None if not configured."""
+    settings = options.get('nwp_dependency')
+    if not settings:
+        return None
+    if not settings.get('directory') and not settings.get('subscribe_topics'):
+        LOG.warning("No NWP directory nor topics configured, the scenes will wait %s minutes for nothing",
+                    str(settings.get('max_wait_minutes', 30)))
+    registry = NwpRegistry(settings['file_pattern'], directory=settings.get('directory'),
+                           scan_interval_seconds=settings.get('scan_interval_seconds', 60),
+                           lookback_hours=settings.get('lookback_hours', 48))
+    registry.scan()
+    LOG.info("Waiting for the NWP data of the scenes, %d forecasts there", len(registry))
+    return NwpGate(registry, max_forecast_interval_hours=settings.get('max_forecast_interval_hours', 6),
+                   max_wait_minutes=settings.get('max_wait_minutes', 30))
+
+
+def start_nwp_listener(options, gate):
+    """Start listening to the NWP messages if topics are configured, None otherwise."""
+    topics = (options.get('nwp_dependency') or {}).get('subscribe_topics')
+    if gate is None or not topics:
+        return None
+    listener = NwpListener(gate.registry, topics)
+    listener.start()
+    return listener
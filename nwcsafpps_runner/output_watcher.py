@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Publish the PPS products as soon as they are written.
+
+While a job runs, the PPS output directory is watched for the `S_NWC_*`
+products of the scene, and each product is published as soon as it is
+closed after writing (or renamed into the directory), so the cloud mask is
+out before CTTH and CMIC are done::
+
+    watch_output:
+      poll_seconds: 2
+      use_inotify: true
+
+inotify is used through the C library on Linux. Elsewhere, or if
+`use_inotify` is false, the directory is polled, and a product is
+published when its size and modification time have not changed between two
+polls. The directory is checked once more when the job ends, so no product
+is missed. The post hooks should then not publish the products as well.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+
+from trollsift import parse
+
+from nwcsafpps_runner.utils import PPS_OUT_PATTERN, PPS_OUT_PATTERN_MULTIPLE
+
+LOG = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def parse_product_name(filename):
+    """Get the platform, orbit and start time of a PPS product file, None if not a product name."""
+    basename = os.path.basename(filename)
+    for pattern in [PPS_OUT_PATTERN, PPS_OUT_PATTERN_MULTIPLE]:
+        try:
+            metadata = parse(pattern, basename)
+        except ValueError:
+            continue
+        return metadata['orig_platform_name'], metadata['orbit_number'], metadata['start_time']
+    return None
+
+
+def get_scene_key(scene):
+    """Get the platform, orbit and start time in the level-1c file name of the scene, the products have the same."""
+    return parse_product_name(scene['file4pps'])
+
+
+class Inotify(object):
+    """The close-write and moved-to events of a directory, with inotify through the C library."""
+
+    def __init__(self, directory):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if self._libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed on %s" % directory)
+
+    def read(self, timeout, wakeup_fd=None):
+        """Get the names of the files written or moved into the directory.
+
+        Wait at most *timeout* seconds, or until *wakeup_fd* is readable.
+        """
+        fds = [self.fd] if wakeup_fd is None else [self.fd, wakeup_fd]
+        readable, _, _ = select.select(fds, [], [], timeout)
+        if self.fd not in readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            names.append(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+            offset += length
+        return names
+
+    def close(self):
+        """Stop watching."""
+        os.close(self.fd)
+
+
+class OutputWatcher(threading.Thread):
+    """Publish the products of the granules of a job written to the output directory while the job runs."""
+
+    def __init__(self, directory, granules, on_product, poll_seconds=2, use_inotify=True):
+        """Init the watcher.
+
+        *granules* is the list of (scene, msg) of the job, and
+        *on_product(scene, msg, path)* is called once per product.
+        """
+        threading.Thread.__init__(self, name='pps-output-watcher', daemon=True)
+        self.directory = directory
+        self.on_product = on_product
+        self.poll_seconds = poll_seconds
+        self._granules = {}
+        self._l1c_files = set()
+        # Cheap test of the file names before parsing them, the output directory can be large
+        self._name_parts = set()
+        for scene, msg in granules:
+            key = get_scene_key(scene)
+            if key is not None:
+                self._granules[key] = (scene, msg)
+                self._name_parts.add('_%s_%05d_' % key[:2])
+            self._l1c_files.add(os.path.basename(scene['file4pps']))
+        self._published = set()
+        self._stop_event = threading.Event()
+        self._inotify = None
+        self._wakeup_r, self._wakeup_w = None, None
+        if use_inotify:
+            try:
+                self._inotify = Inotify(directory)
+                self._wakeup_r, self._wakeup_w = os.pipe()
+            except (OSError, AttributeError, TypeError) as err:
+                LOG.warning("Can not watch %s with inotify, polling instead: %s", directory, str(err))
+        self._initial = self._stat_products()
+        self._previous = dict(self._initial)
+
+    def _match(self, name):
+        if not name.startswith('S_NWC_') or name in self._l1c_files:
+            return None
+        if not any(part in name for part in self._name_parts):
+            return None
+        key = parse_product_name(name)
+        return self._granules.get(key) if key is not None else None
+
+    def _stat_products(self):
+        stats = {}
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return stats
+        for name in names:
+            if self._match(name) is None:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            stats[name] = (stat.st_size, stat.st_mtime_ns)
+        return stats
+
+    def _publish(self, name):
+        granule = self._match(name)
+        if granule is None or name in self._published:
+            return
+        self._published.add(name)
+        path = os.path.join(self.directory, name)
+        LOG.info("PPS product written: %s", path)
+        try:
+            self.on_product(granule[0], granule[1], path)
+        except Exception:
+            LOG.exception("Failed publishing %s", path)
+
+    def _poll(self):
+        current = self._stat_products()
+        for name, stat in current.items():
+            # Written during the job, and unchanged since the last poll
+            if stat != self._initial.get(name) and self._previous.get(name) == stat:
+                self._publish(name)
+        self._previous = current
+
+    def run(self):
+        """Publish the products as they come, until stopped."""
+        while not self._stop_event.is_set():
+            if self._inotify is not None:
+                for name in self._inotify.read(self.poll_seconds, self._wakeup_r):
+                    self._publish(name)
+            else:
+                self._stop_event.wait(self.poll_seconds)
+                self._poll()
+
+    def stop(self):
+        """Stop watching, and publish the products written during the job not published yet."""
+        self._stop_event.set()
+        if self._wakeup_w is not None:
+            os.write(self._wakeup_w, b'\0')
+        self.join()
+        if self._inotify is not None:
+            for name in self._inotify.read(0):
+                self._publish(name)
+            self._inotify.close()
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+        for name, stat in self._stat_products().items():
+            if stat != self._initial.get(name):
+                self._publish(name)
+        LOG.debug("Published %d products of the job from %s", len(self._published), self.directory)
+
+
+def start_output_watcher(options, pps_output_dir, granules, on_product):
+    """Start watching the output directory for the products of the granules, None if not configured."""
+    settings = options.get('watch_output')
+    if not settings:
+        return None
+    if settings is True:
+        settings = {}
+    watcher = OutputWatcher(pps_output_dir, granules, on_product,
+                            poll_seconds=settings.get('poll_seconds', 2),
+                            use_inotify=settings.get('use_inotify', True))
+    watcher.start()
+    return watcher
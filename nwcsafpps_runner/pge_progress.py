@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Follow the PGEs run by a PPS process from its output, while it runs.
+
+ppsRunAll runs the PGEs (ppsMakeNwp, ppsCmask, ppsCtth...) one after the
+other, and each of them logs lines with its name. A line naming a PGE
+starts it (ending the previous one), and a line naming it together with one
+of the `END_WORDS` ends it. This gives the current PGE of each running job
+and the time spent in each PGE without waiting for the time control XML
+file made after the run. The running jobs and the PGE durations are served
+with the other metrics.
+"""
+
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from nwcsafpps_runner.job_logs import get_job_name
+from nwcsafpps_runner.metrics import (REGISTRY, observe_pge, register_job,
+                                      unregister_job)
+from nwcsafpps_runner.pps_posttroll_hook import PPS_PRODUCT_FILE_ID
+
+LOG = logging.getLogger(__name__)
+
+#: Words in a line naming a PGE telling that the PGE has ended
+END_WORDS = ['SUCCEED', 'FAILED', 'finished', 'Finished', 'done', 'Done']
+
+
+def make_pge_regex(modules):
+    """Make the regex finding the first PGE named on each line, with the longest names tried first."""
+    names = sorted(modules, key=len, reverse=True)
+    return re.compile(r'^.*?\b(' + '|'.join(re.escape(name) for name in names) + r')\b(.*)$', re.MULTILINE)
+
+
+PGE_REGEX = make_pge_regex(PPS_PRODUCT_FILE_ID)
+END_REGEX = re.compile(r'\b(?:' + '|'.join(END_WORDS) + r')\b')
+
+
+class JobProgress(object):
+    """The current PGE of a PPS process, and the time spent in each of its PGEs."""
+
+    def __init__(self, name, clock=time.monotonic):
+        self.name = name
+        self.current = None
+        self.started = None
+        self.pge_seconds = OrderedDict()
+        self._clock = clock
+        # The status is read by the metrics server while the output is followed
+        self._lock = threading.Lock()
+
+    def start_pge(self, pge):
+        """Start the PGE, ending the current one."""
+        with self._lock:
+            if pge == self.current:
+                return
+            now = self._clock()
+            if self.current is not None:
+                self._end_current(now)
+            self.current = pge
+            self.started = now
+        LOG.debug("%s: %s started", self.name, pge)
+
+    def end_pge(self, pge):
+        """End the PGE if it is the current one."""
+        with self._lock:
+            if pge == self.current:
+                self._end_current(self._clock())
+
+    def _end_current(self, now, finished=True):
+        seconds = now - self.started
+        self.pge_seconds[self.current] = self.pge_seconds.get(self.current, 0) + seconds
+        if finished:
+            observe_pge(self.current, seconds)
+        self.current = None
+        self.started = None
+
+    def feed(self, text):
+        """Follow the PGEs in the complete lines of output *text* (bytes or str)."""
+        if isinstance(text, bytes):
+            text = text.decode(errors='replace')
+        for match in PGE_REGEX.finditer(text):
+            pge, rest = match.groups()
+            if END_REGEX.search(rest):
+                self.end_pge(pge)
+            else:
+                self.start_pge(pge)
+
+    def get_status(self):
+        """Get the current PGE, the time spent in it so far and in the previous PGEs."""
+        with self._lock:
+            return {'job': self.name,
+                    'current_pge': self.current,
+                    'current_pge_seconds': None if self.current is None else self._clock() - self.started,
+                    'pge_seconds': dict(self.pge_seconds)}
+
+    def start(self):
+        """Make the progress visible with the metrics."""
+        register_job(self)
+        return self
+
+    def finish(self):
+        """End the job: a PGE still running when the process ends is counted but not timed as finished."""
+        with self._lock:
+            if self.current is not None:
+                self._end_current(self._clock(), finished=False)
+        unregister_job(self)
+        if self.pge_seconds:
+            LOG.info("%s: seconds per PGE: %s", self.name,
+                     ", ".join("%s %.1f" % item for item in self.pge_seconds.items()))
+
+
+def create_job_progress(scene, cmd):
+    """Create and start the progress of the command run on the scene."""
+    return JobProgress(get_job_name(scene, cmd)).start()
+
+
+def get_running_jobs():
+    """Get the current PGE and the PGE durations of the running PPS processes."""
+    return [job.get_status() for job in list(REGISTRY.jobs)]
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The PPS jobs of the runner.
+
+A job checks if the products are already there, runs ppsRunAll (and
+ppsCmaskProb) on the scene, publishes the statistics files and keeps the
+job journal, the dedup index and the job failures up to date. The steps
+around the PPS processes are the functions of this module, which the
+thread based runner calls from its worker threads, and the asyncio engine
+from the event loop's executor: only the running of, and waiting for, the
+PPS processes differ between the two engines.
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from nwcsafpps_runner import job_journal
+from nwcsafpps_runner.cpu_slots import format_slot, split_slot
+from nwcsafpps_runner.granule_coalescing import (get_multi_granule_mode,
+                                                 iter_granules)
+from nwcsafpps_runner.job_failures import (check_exit_status,
+                                           get_job_exit_status)
+from nwcsafpps_runner.job_journal import record_scene
+from nwcsafpps_runner.metrics import count_event, observe_phase, time_phase
+from nwcsafpps_runner.output_watcher import start_output_watcher
+from nwcsafpps_runner.process_supervisor import ProcessResult, run_supervised
+from nwcsafpps_runner.runtime_model import get_timeout_seconds
+from nwcsafpps_runner.utils import (CMASK_PROB_POLL_SECONDS,
+                                    cmask_prob_dependencies_ready,
+                                    create_pps_call_command,
+                                    create_pps_run_all_command,
+                                    create_xml_timestat_from_lvl1c,
+                                    find_existing_job_products,
+                                    find_product_statistics_from_lvl1c,
+                                    get_cmask_prob_mode, publish_pps_files,
+                                    publish_skip_message, scene_is_too_old)
+
+LOG = logging.getLogger(__name__)
+
+
+def get_pps_output_dir(options):
+    """Get the directory PPS writes its products to."""
+    return os.environ.get('SM_PRODUCT_DIR', options.get('pps_outdir', './'))
+
+
+def get_pps_statistics_dir(options):
+    """Get the directory PPS writes its statistics files to."""
+    return os.environ.get('SM_STATISTICS_DIR', options.get('pps_statistics_dir', './'))
+
+
+def get_cmask_prob_command(options, scene):
+    """Get the ppsCmaskProb command of the scene."""
+    return create_pps_call_command(options.get('python'), options.get('run_cmaprob_script'), scene)
+
+
+def make_product_publisher(publish_q, options):
+    """Make the function publishing a product of a granule as soon as it is written."""
+    def publish_product(granule, granule_msg, product_file):
+        publish_pps_files(granule_msg, publish_q, granule, [product_file],
+                          servername=options['servername'],
+                          station=options['station'])
+    return publish_product
+
+
+def log_job_start(scene, options, cpu_slot=None):
+    """Log the start of the job."""
+    LOG.info("Starting pps runner for scene %s on %s", str(scene), format_slot(cpu_slot))
+    LOG.debug("Level-1c file: %s", scene['file4pps'])
+    LOG.debug("Platform name: %s", scene['platform_name'])
+    LOG.debug("Orbit number: %s", str(scene['orbit_number']))
+    LOG.debug("Maximum allowed  PPS processing time in minutes: %d",
+              options['maximum_pps_processing_time_in_minutes'])
+    for envkey, value in os.environ.items():
+        LOG.debug("ENV: " + str(envkey) + " " + str(value))
+
+
+def republish_existing_products(scene, publish_q, input_msg, options, pps_output_dir):
+    """Publish the products of the scene if they are already there, and tell if they were."""
+    existing = find_existing_job_products(iter_granules(scene, input_msg), pps_output_dir, options)
+    if existing is None:
+        return False
+    LOG.info("The products of %s are already there, republishing them instead of running PPS",
+             str(scene['file4pps']))
+    count_event('reruns_skipped')
+    for granule, granule_msg, products in existing:
+        publish_pps_files(granule_msg, publish_q, granule, products,
+                          servername=options['servername'],
+                          station=options['station'])
+    return True
+
+
+def publish_job_statistics(scene, publish_q, input_msg, options):
+    """Publish the XML statistics files of each granule of the job."""
+    pps_control_path = get_pps_statistics_dir(options)
+    for granule, granule_msg in iter_granules(scene, input_msg):
+        with time_phase('xml_statistics'):
+            xml_files = create_xml_timestat_from_lvl1c(granule, pps_control_path)
+            xml_files += find_product_statistics_from_lvl1c(granule, pps_control_path)
+        LOG.info("PPS summary statistics files: %s", str(xml_files))
+
+        # The PPS post-hooks takes care of publishing the PPS cloud products
+        # For the XML files we keep the publishing from here:
+        with time_phase('publish'):
+            publish_pps_files(granule_msg, publish_q, granule, xml_files,
+                              servername=options['servername'],
+                              station=options['station'])
+
+
+def log_job_end(scene, job_start_time, runtime_model=None):
+    """Log and time the finished job, and feed its runtime to the runtime model."""
+    dt_ = datetime.now(tz=timezone.utc) - job_start_time
+    LOG.info("PPS on scene " + str(scene) + " finished. It took: " + str(dt_))
+    observe_phase('job', dt_.total_seconds())
+    if runtime_model is not None:
+        runtime_model.record(scene, dt_.total_seconds())
+
+
+def record_job_started(scene, journal=None):
+    """Record the job as running."""
+    record_scene(journal, scene, job_journal.RUNNING)
+
+
+def record_job_failed(scene, input_msg, err, journal=None, dedup=None, failures=None):
+    """Count the failed job, requeue it if worth it, or else release it from the dedup index."""
+    count_event('job_failures')
+    exit_status = get_job_exit_status(err)
+    if failures is not None and failures.job_failed(scene, input_msg, err):
+        # The requeued job keeps its scene, and the duplicates merged into it, until it is given up
+        record_scene(journal, scene, job_journal.ACCEPTED, exit_status=exit_status)
+        return
+    record_scene(journal, scene, job_journal.FAILED, exit_status=exit_status)
+    if dedup is not None:
+        dedup.job_failed(scene)
+
+
+def record_job_finished(scene, journal=None, dedup=None, failures=None):
+    """Record the job as finished, and reset the failures of its platform."""
+    record_scene(journal, scene, job_journal.FINISHED, exit_status='0')
+    if failures is not None:
+        failures.job_succeeded(scene)
+    if dedup is not None:
+        dedup.job_finished(scene)
+
+
+def report_late_scene(scene, publish_q, input_msg, options, deferred, journal=None):
+    """Record a skipped late scene, and publish that the scene was skipped or deferred."""
+    status = 'deferred' if deferred else 'skipped'
+    if not deferred:
+        LOG.info("Skip the late scene: %s", str(scene['file4pps']))
+        record_scene(journal, scene, job_journal.SKIPPED, input_msg)
+
+    for granule, granule_msg in iter_granules(scene, input_msg):
+        publish_skip_message(granule_msg, publish_q, granule, 'scene too old',
+                             status=status,
+                             station=options['station'],
+                             topic=options.get('skip_topic'))
+
+
+def run_cmask_prob(scene, options, deadline, run_all_done=None, pps_output_dir='./', cpu_slot=None, abort=None):
+    """Run ppsCmaskProb before the *deadline* (a time.monotonic() value).
+
+    If *run_all_done* is given, wait until it is set (ppsRunAll has
+    finished) or the products listed in `cmask_prob_depends_on` are found
+    in *pps_output_dir* before starting. If the *abort* event is set
+    (ppsRunAll has failed), ppsCmaskProb is not started and None is
+    returned.
+    """
+    if run_all_done is not None:
+        depends_on = options.get('cmask_prob_depends_on') or []
+        while not (run_all_done.is_set() or
+                   cmask_prob_dependencies_ready(scene, pps_output_dir, depends_on)):
+            if time.monotonic() >= deadline:
+                break
+            run_all_done.wait(CMASK_PROB_POLL_SECONDS)
+
+    if abort is not None and abort.is_set():
+        LOG.info("ppsRunAll failed, ppsCmaskProb not run on scene: %s", str(scene))
+        return None
+    remaining_seconds = deadline - time.monotonic()
+    if remaining_seconds <= 0:
+        LOG.warning("No time left to run ppsCmaskProb on scene: %s", str(scene))
+        return ProcessResult(None, True, None)
+    cmdl = get_cmask_prob_command(options, scene)
+    with time_phase('cmask_prob'):
+        result = run_supervised(cmdl, scene, remaining_seconds, options, cpu_slot=cpu_slot)
+    LOG.info("Ready with ppsCmaskProb on scene: %s", str(scene))
+    return result
+
+
+def _run_cmask_prob_thread(outcome, *args, **kwargs):
+    """Run ppsCmaskProb in a thread, keeping its result or exception in the *outcome* dict."""
+    try:
+        outcome['result'] = run_cmask_prob(*args, **kwargs)
+    except Exception as err:
+        LOG.exception("Failed running ppsCmaskProb")
+        outcome['error'] = err
+
+
+def record_time_out(scene, result, timeout_seconds, runtime_model=None):
+    """Record ppsRunAll killed at its time out in the runtime model."""
+    if result.timed_out and runtime_model is not None:
+        runtime_model.record_timeout(scene, timeout_seconds)
+
+
+def run_pps_scripts(scene, options, pps_output_dir, cpu_slot=None, runtime_model=None):
+    """Run ppsRunAll, and ppsCmaskProb if configured, on the scene."""
+    timeout_seconds = get_timeout_seconds(scene, options, runtime_model)
+    cmd_str = create_pps_run_all_command(options, scene)
+
+    cmask_prob_mode = get_cmask_prob_mode(options)
+    if options['run_cmask_prob'] and cmask_prob_mode != 'sequential':
+        # Both scripts share the time out, and the cpus of the slot
+        deadline = time.monotonic() + timeout_seconds
+        run_all_slot, cmask_prob_slot = split_slot(cpu_slot)
+        run_all_done = threading.Event() if cmask_prob_mode == 'after_pges' else None
+        abort = threading.Event()
+        outcome = {}
+        cmask_prob_thread = threading.Thread(target=_run_cmask_prob_thread, args=(outcome, scene, options, deadline),
+                                             kwargs={'run_all_done': run_all_done,
+                                                     'pps_output_dir': pps_output_dir,
+                                                     'cpu_slot': cmask_prob_slot,
+                                                     'abort': abort})
+        cmask_prob_thread.start()
+        run_all_ok = False
+        try:
+            with time_phase('run_all'):
+                result = run_supervised(cmd_str, scene, timeout_seconds, options, cpu_slot=run_all_slot)
+            record_time_out(scene, result, timeout_seconds, runtime_model)
+            check_exit_status(cmd_str, result.returncode, result.timed_out)
+            run_all_ok = True
+            LOG.info("Ready with PPS level-2 processing on scene: " + str(scene))
+        finally:
+            if not run_all_ok:
+                abort.set()
+            if run_all_done is not None:
+                run_all_done.set()
+            cmask_prob_thread.join()
+        if 'error' in outcome:
+            raise outcome['error']
+        check_exit_status(get_cmask_prob_command(options, scene), outcome['result'].returncode,
+                          outcome['result'].timed_out)
+    else:
+        with time_phase('run_all'):
+            result = run_supervised(cmd_str, scene, timeout_seconds, options, cpu_slot=cpu_slot)
+        record_time_out(scene, result, timeout_seconds, runtime_model)
+        check_exit_status(cmd_str, result.returncode, result.timed_out)
+        LOG.info("Ready with PPS level-2 processing on scene: " + str(scene))
+
+        if options['run_cmask_prob']:
+            cmdl = get_cmask_prob_command(options, scene)
+            with time_phase('cmask_prob'):
+                result = run_supervised(cmdl, scene, timeout_seconds, options, cpu_slot=cpu_slot)
+            check_exit_status(cmdl, result.returncode, result.timed_out)
+
+
+def pps_worker(scene, publish_q, input_msg, options, cpu_slot=None, runtime_model=None):
+    """Start PPS on a scene, pinned to the cpus of *cpu_slot* if given.
+
+    scene = {'platform_name': platform_name,
+             'orbit_number': orbit_number,
+             'satday': satday, 'sathour': sathour,
+             'starttime': starttime, 'endtime': endtime}
+
+    A multi-granule scene also has the scenes and messages of its granules,
+    and the statistics are published per granule.
+    """
+
+    try:
+        log_job_start(scene, options, cpu_slot)
+        job_start_time = datetime.now(tz=timezone.utc)
+
+        pps_output_dir = get_pps_output_dir(options)
+        LOG.debug("PPS_OUTPUT_DIR = " + str(pps_output_dir))
+        LOG.debug("...from config file = " + str(options.get('pps_outdir')))
+
+        if republish_existing_products(scene, publish_q, input_msg, options, pps_output_dir):
+            return
+
+        watcher = start_output_watcher(options, pps_output_dir, iter_granules(scene, input_msg),
+                                       make_product_publisher(publish_q, options))
+        try:
+            if 'granules' in scene and get_multi_granule_mode(options) == 'sequential':
+                for granule in scene['granules']:
+                    run_pps_scripts(granule, options, pps_output_dir, cpu_slot, runtime_model)
+            else:
+                run_pps_scripts(scene, options, pps_output_dir, cpu_slot, runtime_model)
+        finally:
+            if watcher is not None:
+                watcher.stop()
+
+        publish_job_statistics(scene, publish_q, input_msg, options)
+        log_job_end(scene, job_start_time, runtime_model)
+
+    except Exception:
+        LOG.exception('Failed in pps_worker...')
+        raise
+
+
+def run_pps(scene, publish_q, input_msg, options, journal=None, cpu_slots=None, dedup=None, runtime_model=None,
+            failures=None):
+    """Run pps. No parallel running here.
+
+    A failed job is requeued for a retry if *failures* is given and the
+    failure is worth retrying. A job whose platform has been paused while
+    it was waiting in the queue is held until the pause is over.
+    """
+    if failures is not None and failures.hold(scene, input_msg):
+        return
+    cpu_slot = cpu_slots.acquire(scene['file4pps']) if cpu_slots is not None else None
+    try:
+        record_job_started(scene, journal)
+        try:
+            pps_worker(scene, publish_q, input_msg, options, cpu_slot, runtime_model)
+        except Exception as err:
+            record_job_failed(scene, input_msg, err, journal, dedup, failures)
+            raise
+        record_job_finished(scene, journal, dedup, failures)
+    finally:
+        if cpu_slots is not None:
+            cpu_slots.release(cpu_slot)
+
+
+def handle_late_scene(scene, publish_q, input_msg, options, late_pool=None, journal=None, cpu_slots=None,
+                      dedup=None, runtime_model=None):
+    """Skip a scene that is too old, or defer it to the reprocess-later lane."""
+    deferred = False
+    if late_pool is not None:
+        LOG.info("Put the late scene in the reprocess-later lane: %s", str(scene['file4pps']))
+        record_scene(journal, scene, job_journal.ACCEPTED, input_msg)
+        deferred = late_pool.submit(scene['file4pps'], target=run_pps,
+                                    args=(scene, publish_q, input_msg, options),
+                                    kwargs={'journal': journal, 'cpu_slots': cpu_slots, 'dedup': dedup,
+                                            'runtime_model': runtime_model},
+                                    scene=scene)
+    report_late_scene(scene, publish_q, input_msg, options, deferred, journal)
+
+
+def run_pps_if_fresh(scene, publish_q, input_msg, options, late_pool=None, journal=None, cpu_slots=None,
+                     dedup=None, runtime_model=None, failures=None, late_cpu_slots=None):
+    """Run pps, unless the scene has become too old while waiting in the queue.
+
+    The job runs on the *cpu_slots* of its pool, or on the *late_cpu_slots*
+    of the reprocess-later lane if it is deferred.
+    """
+    if scene_is_too_old(scene, options.get('max_scene_age_minutes')):
+        handle_late_scene(scene, publish_q, input_msg, options, late_pool, journal, late_cpu_slots, dedup,
+                          runtime_model)
+        return
+    run_pps(scene, publish_q, input_msg, options, journal, cpu_slots, dedup, runtime_model, failures)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Supervision of the PPS subprocesses.
+
+Each PPS command is run in its own session (and thus process group), so
+that a time out kills the whole process tree and not only the direct
+child. Resource limits, nice and ionice can be applied to the processes,
+and the resource usage of each process is reported when it finishes. The
+limits are set before the command starts, by the `taskset`, `prlimit`,
+`nice` and `ionice` tools exec'ing it in turn.
+
+The limits are given in the runner config::
+
+    pps_process_limits:
+      address_space_mb: 16000
+      cpu_seconds: 3600
+      nice: 10
+      ionice_class: 2
+      ionice_level: 7
+    kill_grace_seconds: 30
+"""
+
+import logging
+import os
+import shutil
+import signal
+import threading
+import time
+from collections import namedtuple
+from subprocess import PIPE, STDOUT, Popen, run
+
+from nwcsafpps_runner.cpu_slots import format_slot, get_slot_env
+from nwcsafpps_runner.job_logs import create_job_log
+from nwcsafpps_runner.metrics import count_event
+from nwcsafpps_runner.pge_progress import create_job_progress
+from nwcsafpps_runner.utils import logreader
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_KILL_GRACE_SECONDS = 30
+
+ProcessResult = namedtuple('ProcessResult', ['returncode', 'timed_out', 'rusage'])
+
+
+def get_process_limits(options):
+    """Get the process limits from the runner config."""
+    return options.get('pps_process_limits') or {}
+
+
+def _find_tool(name, purpose):
+    """Find the command line tool, warning that it can not be used for its *purpose* if not found."""
+    path = shutil.which(name)
+    if path is None:
+        LOG.warning("Can not %s, %s not found", purpose, name)
+    return path
+
+
+def get_ionice_prefix(limits):
+    """Get the command prefix setting the io scheduling class, if any."""
+    ionice_class = limits.get('ionice_class')
+    if ionice_class is None:
+        return []
+    ionice = _find_tool('ionice', "set the io scheduling class")
+    if ionice is None:
+        return []
+    prefix = [ionice, '-c', str(ionice_class)]
+    if limits.get('ionice_level') is not None:
+        prefix += ['-n', str(limits['ionice_level'])]
+    return prefix
+
+
+def get_process_limits_prefix(limits, cpus=None):
+    """Get the command prefix setting the cpu affinity, resource limits, nice level and io scheduling class.
+
+    Each tool of the prefix sets its part and execs the next one, so the
+    command starts with all of them set. A preexec_fn would run python code
+    between fork and exec, which is not safe in the threaded runner.
+    """
+    prefix = []
+    if cpus:
+        taskset = _find_tool('taskset', "pin the process to its cpus")
+        if taskset is not None:
+            prefix += [taskset, '-c', ','.join(str(cpu) for cpu in cpus)]
+    rlimits = []
+    if limits.get('address_space_mb') is not None:
+        rlimits.append('--as=%d' % (int(limits['address_space_mb']) * 1024 * 1024))
+    if limits.get('cpu_seconds') is not None:
+        rlimits.append('--cpu=%d' % int(limits['cpu_seconds']))
+    if rlimits:
+        prlimit = _find_tool('prlimit', "set the resource limits")
+        if prlimit is not None:
+            prefix += [prlimit] + rlimits
+    if limits.get('nice') is not None:
+        nice = _find_tool('nice', "set the nice level")
+        if nice is not None:
+            # Relative to the runner
+            prefix += [nice, '-n', str(int(limits['nice']))]
+    return prefix + get_ionice_prefix(limits)
+
+
+def set_process_limits(limits, cpus=None):
+    """Set the cpu affinity, resource limits, nice level and io scheduling class of this process.
+
+    This is for a single threaded process, like one forked from the warm
+    launcher fork server, before it runs the PPS script.
+    """
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    if resource is not None:
+        if limits.get('address_space_mb') is not None:
+            nbytes = int(limits['address_space_mb']) * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (nbytes, nbytes))
+        if limits.get('cpu_seconds') is not None:
+            resource.setrlimit(resource.RLIMIT_CPU, (int(limits['cpu_seconds']), int(limits['cpu_seconds'])))
+    if limits.get('nice') is not None:
+        os.nice(int(limits['nice']))
+    ionice = get_ionice_prefix(limits)
+    if ionice:
+        run(ionice + ['-p', str(os.getpid())], check=False)
+
+
+def format_rusage(rusage):
+    """Get the interesting parts of a resource usage struct as a dict."""
+    if rusage is None:
+        return None
+    return {'cpu_user_seconds': rusage.ru_utime,
+            'cpu_system_seconds': rusage.ru_stime,
+            'max_rss_mb': rusage.ru_maxrss / 1024.0,
+            'block_input_ops': rusage.ru_inblock,
+            'block_output_ops': rusage.ru_oublock}
+
+
+def get_own_rusage():
+    """Get the resource usage of this process and its waited for children, as `format_rusage` does.
+
+    This is what the parent of the process gets from wait4.
+    """
+    if resource is None:
+        return None
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {'cpu_user_seconds': own.ru_utime + children.ru_utime,
+            'cpu_system_seconds': own.ru_stime + children.ru_stime,
+            'max_rss_mb': max(own.ru_maxrss, children.ru_maxrss) / 1024.0,
+            'block_input_ops': own.ru_inblock + children.ru_inblock,
+            'block_output_ops': own.ru_oublock + children.ru_oublock}
+
+
+def wait_for_process(pid):
+    """Wait for the child process *pid* to end, and get its exit code and formatted resource usage."""
+    _, status, rusage = os.wait4(pid, 0)
+    return os.waitstatus_to_exitcode(status), format_rusage(rusage)
+
+
+def signal_process_group(pgid, sig):
+    """Send a signal to the process group, return False if there is no such group anymore."""
+    try:
+        os.killpg(pgid, sig)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        LOG.warning("Not allowed to signal process group %d", pgid)
+        return False
+    return True
+
+
+def process_group_alive(pgid):
+    """Check if any process is left in the process group."""
+    return signal_process_group(pgid, 0)
+
+
+def terminate_process_group(pgid, grace_seconds=DEFAULT_KILL_GRACE_SECONDS):
+    """Terminate all processes of the group, with SIGTERM first and SIGKILL after *grace_seconds*."""
+    if not signal_process_group(pgid, signal.SIGTERM):
+        return
+    deadline = time.monotonic() + grace_seconds
+    while time.monotonic() < deadline:
+        if not process_group_alive(pgid):
+            return
+        time.sleep(0.1)
+    LOG.warning("Process group %d still alive %.0f s after SIGTERM, sending SIGKILL", pgid, grace_seconds)
+    signal_process_group(pgid, signal.SIGKILL)
+
+
+class SupervisedProcess(object):
+    """A PPS command running in its own process group, with limits and a time out."""
+
+    def __init__(self, cmd, scene, timeout_seconds, limits=None, kill_grace_seconds=DEFAULT_KILL_GRACE_SECONDS,
+                 log_func=None, cpu_slot=None, launcher=None, job_log=None, progress=None):
+        """Init the supervised process, *cmd* is a space separated command string or a list.
+
+        If a *cpu_slot* is given, the process is pinned to its cpus. If a
+        warm *launcher* is given, the python command is forked from it
+        instead of started with Popen. If a *job_log* is given, the output
+        of the process is written to it instead of logged line by line. If
+        a PGE *progress* is given, it follows the output of the process.
+        """
+        if isinstance(cmd, str):
+            cmd = cmd.split(" ")
+        self.limits = limits or {}
+        self.launcher = launcher
+        if launcher is None:
+            cpus = cpu_slot.cpus if cpu_slot is not None else None
+            self.cmd = get_process_limits_prefix(self.limits, cpus) + list(cmd)
+        else:
+            self.cmd = list(cmd)
+        self.scene = scene
+        self.timeout_seconds = timeout_seconds
+        self.kill_grace_seconds = kill_grace_seconds
+        self.log_func = log_func or LOG.info
+        self.cpu_slot = cpu_slot
+        self.job_log = job_log
+        self.progress = progress
+        self.popen_obj = None
+        self.timed_out = False
+        self._timer = None
+        self._readers = []
+
+    def start(self):
+        """Start the process, its output readers and the time out timer."""
+        LOG.debug("Run command: " + str(self.cmd))
+        # The job log gets stdout and stderr together, read by one thread
+        merge_stderr = self.job_log is not None
+        if self.launcher is not None:
+            cpus = self.cpu_slot.cpus if self.cpu_slot is not None else None
+            self.popen_obj = self.launcher.launch(self.cmd, env=get_slot_env(self.cpu_slot),
+                                                  limits=self.limits, cpus=cpus, merge_stderr=merge_stderr)
+        else:
+            self.popen_obj = Popen(self.cmd, shell=False, stderr=STDOUT if merge_stderr else PIPE, stdout=PIPE,
+                                   env=get_slot_env(self.cpu_slot),
+                                   start_new_session=True)
+        self._timer = threading.Timer(self.timeout_seconds, self.terminate, kwargs={'timed_out': True})
+        self._timer.daemon = True
+        self._timer.start()
+        if merge_stderr:
+            self._readers = [threading.Thread(target=self.job_log.drain, args=(self.popen_obj.stdout, ))]
+        else:
+            self._readers = [threading.Thread(target=logreader, args=(self.popen_obj.stdout, self._log_line)),
+                             threading.Thread(target=logreader, args=(self.popen_obj.stderr, self._log_line))]
+        for reader in self._readers:
+            reader.start()
+        return self
+
+    def _log_line(self, line):
+        if self.progress is not None:
+            self.progress.feed(line)
+        self.log_func(line)
+
+    @property
+    def pgid(self):
+        """Get the process group id, which is the pid of the session leader."""
+        return self.popen_obj.pid
+
+    def terminate(self, timed_out=False):
+        """Terminate the whole process group."""
+        if timed_out:
+            self.timed_out = True
+            LOG.info("Process timed out and pre-maturely terminated. Scene: " + str(self.scene))
+            count_event('process_timeouts')
+        terminate_process_group(self.pgid, self.kill_grace_seconds)
+
+    def wait(self):
+        """Wait for the process to finish, and return its exit code, time out status and resource usage."""
+        if self.launcher is not None:
+            # Not a child of the runner but of the fork server, the process sends its own resource usage
+            self.popen_obj.wait()
+            rusage = self.popen_obj.rusage
+        else:
+            self.popen_obj.returncode, rusage = wait_for_process(self.popen_obj.pid)
+        self._timer.cancel()
+        if process_group_alive(self.pgid):
+            LOG.info("Processes left in the group after the main process ended, terminating them")
+            terminate_process_group(self.pgid, self.kill_grace_seconds)
+        for reader in self._readers:
+            reader.join()
+        if self.job_log is not None:
+            self.job_log.close()
+        if self.progress is not None:
+            self.progress.finish()
+
+        if not self.timed_out:
+            LOG.info("Process finished before time out - workerScene: " + str(self.scene))
+        result = ProcessResult(self.popen_obj.returncode, self.timed_out, rusage)
+        LOG.info("Process exit code: %s, %s, resource usage: %s", str(result.returncode),
+                 format_slot(self.cpu_slot), str(result.rusage))
+        return result
+
+
+def run_supervised(cmd, scene, timeout_seconds, options, log_func=None, cpu_slot=None):
+    """Run the command supervised with the limits from the config and wait for it to finish.
+
+    The command is forked from the warm launcher if one is configured, and
+    its output is written to a job log if `job_logs` are configured. The
+    PGEs run by the command are followed from its output.
+    """
+    # The warm launcher uses the process limits of this module
+    from nwcsafpps_runner.warm_launcher import get_warm_launcher
+    progress = create_job_progress(scene, cmd)
+    proc = SupervisedProcess(cmd, scene, timeout_seconds,
+                             limits=get_process_limits(options),
+                             kill_grace_seconds=options.get('kill_grace_seconds', DEFAULT_KILL_GRACE_SECONDS),
+                             log_func=log_func, cpu_slot=cpu_slot,
+                             launcher=get_warm_launcher(options),
+                             job_log=create_job_log(options, scene, cmd, progress), progress=progress)
+    proc.start()
+    return proc.wait()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Resource classes of PPS jobs, each with its own worker pool.
+
+Scenes are put in a resource class by platform name or sensor, and each
+class has its own pool of workers and job queue, so that for example a
+long AVHRR pass never delays the next SEVIRI scan::
+
+    resource_classes:
+      geo:
+        sensors: [seviri]
+        number_of_threads: 2
+        maximum_pps_processing_time_in_minutes: 10
+        nice: 0
+        max_pending_jobs: 4
+      avhrr:
+        sensors: [avhrr/3]
+        platforms: [Metop-B, Metop-C]
+        number_of_threads: 3
+        maximum_pps_processing_time_in_minutes: 40
+        nice: 10
+
+A class listing the platform of the scene is taken before a class listing
+its sensor. Scenes of no class go to the default pool. The class settings
+override the runner config for the jobs of the class, `nice` sets the
+nice level of the `pps_process_limits`. Each class has its own cpu slots
+if `cpu_slots` are configured, a `cpu_slots` list of its own or a share of
+the ones of the runner config (see `nwcsafpps_runner.cpu_slots`), on cpus
+no other pool runs on. The job queue of a class drops
+the oldest job when full (`drop_oldest`) unless another
+`job_queue_overflow_policy` is given: blocking would stop the dispatching
+of the scenes of all the other classes. The number of parallel jobs of a
+class is fixed, the adaptive concurrency only controls the default pool.
+"""
+
+import logging
+from collections import namedtuple
+
+from nwcsafpps_runner.utils import get_scene_sensor
+
+LOG = logging.getLogger(__name__)
+
+#: The runner config keys a resource class can override
+CLASS_OPTION_KEYS = ['number_of_threads',
+                     'maximum_pps_processing_time_in_minutes',
+                     'max_pending_jobs',
+                     'job_queue_overflow_policy',
+                     'scheduler',
+                     'kill_grace_seconds',
+                     'cpu_slots']
+
+ResourceClass = namedtuple('ResourceClass', ['name', 'platforms', 'sensors', 'options'])
+
+
+def get_class_options(options, name, settings):
+    """Get the runner config for the jobs of the class."""
+    class_options = dict(options)
+    class_options.pop('resource_classes', None)
+    class_options.pop('adaptive_concurrency', None)
+    # The class gets a share of the cpu slots of the runner config, unless it has its own
+    class_options.pop('cpu_slots', None)
+    class_options['job_queue_overflow_policy'] = 'drop_oldest'
+    for key in CLASS_OPTION_KEYS:
+        if key in settings:
+            class_options[key] = settings[key]
+    if 'nice' in settings or 'pps_process_limits' in settings:
+        limits = dict(options.get('pps_process_limits') or {})
+        limits.update(settings.get('pps_process_limits') or {})
+        if 'nice' in settings:
+            limits['nice'] = settings['nice']
+        class_options['pps_process_limits'] = limits
+    class_options['resource_class'] = name
+    return class_options
+
+
+def create_resource_classes(options):
+    """Create the resource classes from the runner config."""
+    resource_classes = []
+    for name, settings in (options.get('resource_classes') or {}).items():
+        platforms = list(settings.get('platforms') or [])
+        sensors = list(settings.get('sensors') or [])
+        if not platforms and not sensors:
+            raise ValueError("Resource class %s should have platforms or sensors" % name)
+        resource_class = ResourceClass(name, platforms, sensors, get_class_options(options, name, settings))
+        LOG.info("Resource class %s: platforms %s, sensors %s, %d parallel jobs", name, str(platforms),
+                 str(sensors), resource_class.options['number_of_threads'])
+        resource_classes.append(resource_class)
+    return resource_classes
+
+
+def find_resource_class(resource_classes, scene):
+    """Find the class of the scene, by platform name first and sensor second. None if there is none."""
+    for resource_class in resource_classes:
+        if scene.get('platform_name') in resource_class.platforms:
+            return resource_class
+    sensor = get_scene_sensor(scene)
+    for resource_class in resource_classes:
+        if sensor in resource_class.sensors:
+            return resource_class
+    return None
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Learn how long the PPS jobs take from the completed jobs.
+
+The runtimes of the last jobs are kept per platform name, sensor and
+scene duration (in whole minutes), optionally in a SQLite file to survive
+restarts::
+
+    runtime_model:
+      filename: /var/lib/pps_runner/pps_runtimes.db
+      max_samples: 50
+      min_samples: 5
+      timeout_percentile: 95
+      timeout_factor: 1.5
+      min_timeout_minutes: 5
+
+When there are fewer than `min_samples` runtimes for the scene duration,
+the runtimes of the other durations of the platform and sensor are used,
+scaled to the duration of the scene. The expected runtime (the median) is
+used by the `shortest_expected_job` and `least_slack` schedulers, and the
+time out of a job is the `timeout_percentile` of the runtimes times
+`timeout_factor` (but at least `min_timeout_minutes`, and at most
+`maximum_pps_processing_time_in_minutes`). Without enough runtimes the time
+out is `maximum_pps_processing_time_in_minutes`. A job killed at its time
+out is recorded with the time out as runtime (a censored sample, the job
+would have taken longer), so that the time outs grow back when the jobs
+get slower instead of only learning from the jobs fast enough to finish.
+"""
+
+import logging
+import math
+import sqlite3
+import statistics
+import threading
+import time
+from collections import deque
+
+from nwcsafpps_runner.utils import get_scene_sensor
+
+LOG = logging.getLogger(__name__)
+
+
+def get_scene_duration_minutes(scene):
+    """Get the duration of the scene in whole minutes, None if unknown."""
+    try:
+        seconds = (scene['endtime'] - scene['starttime']).total_seconds()
+    except (KeyError, TypeError, AttributeError):
+        return None
+    return max(0, int(round(seconds / 60.0)))
+
+
+def make_runtime_key(scene):
+    """Make the (platform name, sensor, duration in minutes) key of the scene."""
+    return (str(scene.get('platform_name')), str(get_scene_sensor(scene)), get_scene_duration_minutes(scene))
+
+
+def percentile(values, percent):
+    """Get the nearest-rank percentile of the values."""
+    values = sorted(values)
+    rank = math.ceil(percent / 100.0 * len(values)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class RuntimeModel(object):
+    """The runtimes of the last jobs per platform name, sensor and scene duration."""
+
+    def __init__(self, filename=None, max_samples=50, min_samples=5):
+        """Init the model, loading the runtimes from the SQLite *filename* if given."""
+        self.filename = filename
+        self.max_samples = max(1, int(max_samples))
+        self.min_samples = max(1, int(min_samples))
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._conn = None
+        if filename:
+            self._conn = sqlite3.connect(filename, check_same_thread=False)
+            with self._conn:
+                self._conn.execute("CREATE TABLE IF NOT EXISTS runtimes ("
+                                   "platform_name TEXT NOT NULL, "
+                                   "sensor TEXT NOT NULL, "
+                                   "duration_minutes INTEGER, "
+                                   "runtime_seconds REAL NOT NULL, "
+                                   "finished REAL NOT NULL)")
+            rows = self._conn.execute("SELECT platform_name, sensor, duration_minutes, runtime_seconds "
+                                      "FROM runtimes ORDER BY finished").fetchall()
+            for platform_name, sensor, duration, runtime in rows:
+                self._add((platform_name, sensor, duration), runtime)
+            LOG.info("Runtime model %s: %d runtimes of %d kinds of scenes",
+                     filename, len(rows), len(self._samples))
+
+    def _add(self, key, runtime_seconds):
+        self._samples.setdefault(key, deque(maxlen=self.max_samples)).append(runtime_seconds)
+
+    def record(self, scene, runtime_seconds, now=None):
+        """Record the runtime of a completed job on the scene."""
+        now = time.time() if now is None else now
+        key = make_runtime_key(scene)
+        with self._lock:
+            self._add(key, float(runtime_seconds))
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute("INSERT INTO runtimes (platform_name, sensor, duration_minutes, "
+                                       "runtime_seconds, finished) VALUES (?, ?, ?, ?, ?)",
+                                       key + (float(runtime_seconds), now))
+                    self._conn.execute("DELETE FROM runtimes WHERE platform_name = ? AND sensor = ? AND "
+                                       "duration_minutes IS ? AND rowid NOT IN (SELECT rowid FROM runtimes "
+                                       "WHERE platform_name = ? AND sensor = ? AND duration_minutes IS ? "
+                                       "ORDER BY finished DESC LIMIT ?)",
+                                       key + key + (self.max_samples, ))
+        LOG.debug("Runtime of %s: %.0f s", str(key), runtime_seconds)
+
+    def record_timeout(self, scene, timeout_seconds, now=None):
+        """Record a job on the scene killed at its time out, with the time out as runtime."""
+        LOG.info("Job timed out after %.0f s, recording the time out as its runtime", timeout_seconds)
+        self.record(scene, timeout_seconds, now)
+
+    def get_samples(self, scene):
+        """Get the runtimes to base the estimates for the scene on, empty if too few."""
+        key = make_runtime_key(scene)
+        with self._lock:
+            samples = list(self._samples.get(key, []))
+            if len(samples) >= self.min_samples:
+                return samples
+            if key[2] is None:
+                return []
+            # Scale the runtimes of the other scene durations of the platform and sensor
+            scaled = []
+            for (platform_name, sensor, duration), runtimes in self._samples.items():
+                if (platform_name, sensor) == key[:2] and duration:
+                    scaled.extend(runtime * max(key[2], 1) / duration for runtime in runtimes)
+        return scaled if len(scaled) >= self.min_samples else []
+
+    def expected_runtime(self, scene, default=None):
+        """Get the expected runtime of a job on the scene in seconds, *default* if unknown."""
+        samples = self.get_samples(scene)
+        return statistics.median(samples) if samples else default
+
+    def runtime_percentile(self, scene, percent, default=None):
+        """Get the percentile of the runtimes of jobs on the scene in seconds, *default* if unknown."""
+        samples = self.get_samples(scene)
+        return percentile(samples, percent) if samples else default
+
+    def get_metrics(self):
+        """Get the number of kinds of scenes and of runtimes in the model."""
+        with self._lock:
+            return {'runtime_keys': len(self._samples),
+                    'runtime_samples': sum(len(runtimes) for runtimes in self._samples.values())}
+
+    def close(self):
+        """Close the on-disk model."""
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+
+
+def get_default_timeout_seconds(scene, options):
+    """Get the flat time out of a job on the scene, per granule for multi-granule scenes."""
+    ngranules = len(scene.get('files4pps') or [scene['file4pps']])
+    return options['maximum_pps_processing_time_in_minutes'] * 60.0 * ngranules
+
+
+def get_timeout_seconds(scene, options, runtime_model=None):
+    """Get the time out of a job on the scene, from the observed runtimes if there are enough.
+
+    The time out is never longer than the flat one.
+    """
+    default = get_default_timeout_seconds(scene, options)
+    if runtime_model is None:
+        return default
+    settings = options.get('runtime_model') or {}
+    observed = runtime_model.runtime_percentile(scene, settings.get('timeout_percentile', 95))
+    if observed is None:
+        return default
+    timeout_seconds = max(observed * settings.get('timeout_factor', 1.5),
+                          settings.get('min_timeout_minutes', 5) * 60.0)
+    timeout_seconds = min(timeout_seconds, default)
+    LOG.debug("Time out from the observed runtimes: %.0f s", timeout_seconds)
+    return timeout_seconds
+
+
+def create_runtime_model(options):
+    """Create the runtime model from the runner config, None if not configured."""
+    settings = options.get('runtime_model')
+    if not settings:
+        return None
+    return RuntimeModel(filename=settings.get('filename'),
+                        max_samples=settings.get('max_samples', 50),
+                        min_samples=settings.get('min_samples', 5))
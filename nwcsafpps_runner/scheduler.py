@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Schedulers deciding in which order pending PPS jobs are processed.
+
+A scheduler holds the jobs waiting for a free worker. Each job carries the
+scene dict built by the runner, and the schedulers use the scene
+'starttime', 'platform_name' and 'sensor' to order the jobs.
+"""
+
+import heapq
+import logging
+from datetime import timedelta
+
+from nwcsafpps_runner.utils import get_value_for_scene, scene_timestamp
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_DEADLINE_MINUTES = 60
+
+
+class FifoScheduler(object):
+    """Process the jobs in the order they arrive."""
+
+    def __init__(self):
+        self._jobs = []
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __iter__(self):
+        return iter([entry[-1] for entry in self._jobs])
+
+    def priority(self, job):
+        """Return the sort key of the job, lowest first."""
+        return ()
+
+    def put(self, job):
+        """Add a job."""
+        heapq.heappush(self._jobs, (self.priority(job), self._seq, job))
+        self._seq += 1
+
+    def get(self):
+        """Remove and return the job to process next."""
+        return heapq.heappop(self._jobs)[-1]
+
+    def get_oldest(self):
+        """Remove and return the job that has been waiting the longest."""
+        idx = min(range(len(self._jobs)), key=lambda i: self._jobs[i][1])
+        entry = self._jobs.pop(idx)
+        heapq.heapify(self._jobs)
+        return entry[-1]
+
+    def clear(self):
+        """Remove all jobs and return them."""
+        jobs = list(self)
+        self._jobs = []
+        return jobs
+
+
+class NewestFirstScheduler(FifoScheduler):
+    """Process the scene with the latest start time first."""
+
+    def priority(self, job):
+        """Return the sort key of the job, lowest first."""
+        return (-scene_timestamp(job.scene), )
+
+
+class PlatformWeightScheduler(FifoScheduler):
+    """Process scenes from the platform (or sensor) with the highest weight first.
+
+    Scenes with the same weight are processed newest first.
+    """
+
+    def __init__(self, weights=None):
+        super().__init__()
+        self.weights = weights or {}
+
+    def priority(self, job):
+        """Return the sort key of the job, lowest first."""
+        weight = float(get_value_for_scene(self.weights, job.scene, 1))
+        return (-weight, -scene_timestamp(job.scene))
+
+
+class ShortestExpectedJobScheduler(FifoScheduler):
+    """Process the scene with the shortest expected runtime first.
+
+    The expected runtimes come from the runtime model, scenes without an
+    expected runtime get *default_seconds*. Scenes with the same expected
+    runtime are processed newest first.
+    """
+
+    def __init__(self, runtime_model, default_seconds):
+        super().__init__()
+        self.runtime_model = runtime_model
+        self.default_seconds = default_seconds
+
+    def priority(self, job):
+        """Return the sort key of the job, lowest first."""
+        return (self.runtime_model.expected_runtime(job.scene, self.default_seconds), -scene_timestamp(job.scene))
+
+
+class DeadlineScheduler(FifoScheduler):
+    """Process the scene with the earliest deadline first.
+
+    The deadline is the scene start time plus the allowed delay, given in
+    minutes per platform name or per sensor.
+    """
+
+    def __init__(self, deadlines_minutes=None):
+        super().__init__()
+        self.deadlines_minutes = deadlines_minutes or {}
+
+    def get_deadline(self, scene):
+        """Return the deadline of the scene in seconds since epoch."""
+        minutes = get_value_for_scene(self.deadlines_minutes, scene, DEFAULT_DEADLINE_MINUTES)
+        return scene_timestamp(scene) + timedelta(minutes=float(minutes)).total_seconds()
+
+    def priority(self, job):
+        """Return the sort key of the job, lowest first."""
+        return (self.get_deadline(job.scene), )
+
+
+class LeastSlackScheduler(DeadlineScheduler):
+    """Process the scene with the least slack first.
+
+    The slack is the time left until the deadline of the scene minus its
+    expected runtime, from the runtime model. Scenes without an expected
+    runtime get *default_seconds*.
+    """
+
+    def __init__(self, runtime_model, default_seconds, deadlines_minutes=None):
+        super().__init__(deadlines_minutes)
+        self.runtime_model = runtime_model
+        self.default_seconds = default_seconds
+
+    def priority(self, job):
+        """Return the sort key of the job, lowest first."""
+        expected = self.runtime_model.expected_runtime(job.scene, self.default_seconds)
+        return (self.get_deadline(job.scene) - expected, )
+
+
+SCHEDULERS = {'fifo': FifoScheduler,
+              'newest_first': NewestFirstScheduler,
+              'platform_weight': PlatformWeightScheduler,
+              'deadline': DeadlineScheduler,
+              'shortest_expected_job': ShortestExpectedJobScheduler,
+              'least_slack': LeastSlackScheduler}
+
+#: The schedulers using the runtime model
+RUNTIME_SCHEDULERS = ['shortest_expected_job', 'least_slack']
+
+
+def create_scheduler(options, runtime_model=None):
+    """Create the scheduler given in the runner config."""
+    name = options.get('scheduler', 'fifo')
+    if name not in SCHEDULERS:
+        raise ValueError("Scheduler %s not supported! Use one of %s" % (name, str(list(SCHEDULERS))))
+    if name in RUNTIME_SCHEDULERS and runtime_model is None:
+        raise ValueError("Scheduler %s needs the runtime_model to be configured" % name)
+    LOG.info("Using the %s scheduler for pending PPS jobs", name)
+    if name in RUNTIME_SCHEDULERS:
+        default_seconds = options['maximum_pps_processing_time_in_minutes'] * 60.0
+        if name == 'least_slack':
+            return LeastSlackScheduler(runtime_model, default_seconds, options.get('scene_deadlines_minutes'))
+        return ShortestExpectedJobScheduler(runtime_model, default_seconds)
+    if name == 'platform_weight':
+        return PlatformWeightScheduler(options.get('platform_weights'))
+    if name == 'deadline':
+        return DeadlineScheduler(options.get('scene_deadlines_minutes'))
+    return SCHEDULERS[name]()
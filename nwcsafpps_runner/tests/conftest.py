@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Fixtures shared by the tests of the runners."""
+
+import asyncio
+import sys
+import threading
+
+import pytest
+
+
+class FakeClock(object):
+    """A clock moved by hand, and by *step* seconds per call."""
+
+    def __init__(self, step=0.0):
+        self.now = 0.0
+        self.step = step
+
+    def __call__(self):
+        """Get the time."""
+        self.now += self.step
+        return self.now
+
+
+@pytest.fixture
+def fake_clock():
+    """Get a clock moved by hand."""
+    return FakeClock()
+
+
+@pytest.fixture
+def ticking_clock():
+    """Get a clock moving one second per call."""
+    return FakeClock(step=1.0)
+
+
+def _wait_for(predicate, timeout=5):
+    """Wait for predicate to become true, and get its last value."""
+    event = threading.Event()
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return True
+        event.wait(0.01)
+    return predicate()
+
+
+async def _async_wait_for(predicate, timeout=5):
+    """Wait in the event loop for predicate to become true, and get its last value."""
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return True
+        await asyncio.sleep(0.01)
+    return predicate()
+
+
+@pytest.fixture
+def wait_for():
+    """Get a function waiting for a predicate to become true, for at most *timeout* seconds."""
+    return _wait_for
+
+
+@pytest.fixture
+def async_wait_for():
+    """Get a coroutine function waiting for a predicate to become true, for at most *timeout* seconds."""
+    return _async_wait_for
+
+
+def _is_running(pid):
+    """Check if the process is running, zombies waiting to be reaped by init are not."""
+    try:
+        with open("/proc/%d/stat" % pid) as fd:
+            return fd.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+@pytest.fixture
+def is_running():
+    """Get a function checking if the process of a pid is running."""
+    return _is_running
+
+
+FAKE_PPS_SCRIPT = """
+import sys
+print("Running PPS on", sys.argv[sys.argv.index("-af") + 1])
+print("Some PPS warning", file=sys.stderr)
+"""
+
+
+@pytest.fixture
+def make_pps_options(tmp_path):
+    """Get a function making the runner options, with a fake PPS script."""
+    def make_options(run_cmask_prob=False):
+        script = tmp_path / 'ppsRunAll.py'
+        script.write_text(FAKE_PPS_SCRIPT)
+        return {'python': sys.executable,
+                'run_all_script': {'name': str(script), 'flags': ['--no_cmaskprob']},
+                'run_cmaprob_script': str(script),
+                'run_cmask_prob': run_cmask_prob,
+                'maximum_pps_processing_time_in_minutes': 1,
+                'number_of_threads': 2,
+                'pps_statistics_dir': str(tmp_path),
+                'servername': 'localhost',
+                'station': 'norrkoping'}
+    return make_options
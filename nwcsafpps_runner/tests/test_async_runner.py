@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the asyncio execution engine of the PPS runner."""
+
+import asyncio
+import threading
+import time
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from nwcsafpps_runner.async_runner import (AsyncLane, AsyncPpsRunner,
+                                           pps_worker_async, run_subprocess)
+from nwcsafpps_runner.job_failures import PpsProcessFailed
+from nwcsafpps_runner.runtime_model import RuntimeModel
+from nwcsafpps_runner.scheduler import NewestFirstScheduler
+
+SCENE = {'platform_name': 'NOAA-20', 'orbit_number': 12345,
+         'starttime': datetime(2024, 4, 9, 8, 0),
+         'file4pps': '/path/to/S_NWC_viirs_noaa20_12345_20240409T0800000Z_20240409T0801000Z.nc'}
+
+
+class TestRunSubprocess:
+    """Test running subprocesses in the event loop."""
+
+    def test_output_is_logged(self, make_pps_options, caplog):
+        """Test that stdout and stderr of the process are logged."""
+        options = make_pps_options()
+        cmd = "%s %s -af myfile.nc" % (options['python'], options['run_all_script']['name'])
+        with caplog.at_level('INFO'):
+            result = asyncio.run(run_subprocess(cmd, SCENE, 10))
+        assert result.returncode == 0
+        assert not result.timed_out
+        assert "Running PPS on myfile.nc" in caplog.text
+        assert "Some PPS warning" in caplog.text
+
+    def test_timeout(self, caplog):
+        """Test that a process running too long is killed."""
+        start = time.time()
+        with caplog.at_level('INFO'):
+            result = asyncio.run(run_subprocess("sleep 10", SCENE, 0.2))
+        assert result.timed_out
+        assert result.returncode < 0
+        assert time.time() - start < 5
+        assert "Process timed out" in caplog.text
+
+
+class TestAsyncLane:
+    """Test the asyncio job lane."""
+
+    def test_jobs_run_in_scheduler_order(self, async_wait_for):
+        """Test that the jobs are run in scheduler order, and duplicates refused."""
+        done = []
+
+        async def job(name):
+            await asyncio.sleep(0.01)
+            done.append(name)
+
+        async def run():
+            lane = AsyncLane(1, scheduler=NewestFirstScheduler())
+            lane.start()
+            accepted = []
+            for hour in [7, 10, 9, 9]:
+                accepted.append(await lane.submit(hour, job, args=(hour, ),
+                                                  scene={'starttime': datetime(2024, 4, 9, hour)}))
+            assert await async_wait_for(lambda: not lane.jobs)
+            await lane.shutdown()
+            return accepted, lane.get_metrics()
+
+        accepted, metrics = asyncio.run(run())
+        assert accepted == [True, True, True, False]
+        assert done == [10, 9, 7]
+        assert metrics['completed'] == 3
+
+    def test_reject_when_full(self):
+        """Test the reject overflow policy."""
+        async def job():
+            await asyncio.sleep(0.5)
+
+        async def run():
+            lane = AsyncLane(1, max_pending=1, overflow_policy='reject')
+            lane.start()
+            accepted = [await lane.submit(0, job)]
+            await asyncio.sleep(0.05)
+            accepted += [await lane.submit(idx, job) for idx in [1, 2]]
+            await lane.shutdown()
+            return accepted
+
+        assert asyncio.run(run()) == [True, True, False]
+
+    def test_set_concurrency(self, async_wait_for):
+        """Test lowering and raising the number of jobs running at the same time."""
+        release = None
+
+        async def job():
+            await release.wait()
+
+        async def run():
+            nonlocal release
+            release = asyncio.Event()
+            lane = AsyncLane(3)
+            lane.start()
+            assert lane.set_concurrency(1) == 1
+            for idx in range(4):
+                await lane.submit(idx, job)
+            await asyncio.sleep(0.05)
+            active = [lane.get_metrics()['active_jobs']]
+            lane.set_concurrency(5)
+            await asyncio.sleep(0.05)
+            active.append(lane.get_metrics()['active_jobs'])
+            release.set()
+            assert await async_wait_for(lambda: not lane.jobs)
+            await lane.shutdown()
+            return active, lane.get_recent_durations()
+
+        active, durations = asyncio.run(run())
+        assert active == [1, 3]
+        assert len(durations) == 4
+
+
+class TestAsyncPpsRunner:
+    """Test the asyncio pps runner."""
+
+    def test_pps_worker_async(self, make_pps_options, caplog):
+        """Test running RunAll and CMaskProb, and publishing the statistics files."""
+        options = make_pps_options(run_cmask_prob=True)
+        publish_q = MagicMock()
+        with caplog.at_level('INFO'):
+            with patch('nwcsafpps_runner.pps_jobs.find_product_statistics_from_lvl1c') as find_stats:
+                find_stats.return_value = [
+                    '/out/S_NWC_CMA_noaa20_12345_20240409T0800000Z_20240409T0801000Z_statistics.xml']
+                asyncio.run(pps_worker_async(SCENE, publish_q, MagicMock(data={}), options))
+        assert caplog.text.count("Running PPS on " + SCENE['file4pps']) == 2
+        publish_q.put.assert_called_once()
+
+    def test_runtime_is_recorded(self, make_pps_options):
+        """Test the runtime of the job is recorded in the runtime model."""
+        options = make_pps_options()
+        model = RuntimeModel(min_samples=1)
+        with patch('nwcsafpps_runner.pps_jobs.find_product_statistics_from_lvl1c', return_value=[]):
+            asyncio.run(pps_worker_async(SCENE, MagicMock(), MagicMock(data={}), options, runtime_model=model))
+        assert model.expected_runtime(SCENE) > 0
+
+    def test_multi_granule_job(self, make_pps_options, caplog):
+        """Test PPS is called once with all the granules, and the statistics are published per granule."""
+        options = make_pps_options()
+        files = [SCENE['file4pps'], SCENE['file4pps'].replace('0800000Z_20240409T0801000Z',
+                                                              '0801000Z_20240409T0802000Z')]
+        granules = [dict(SCENE, file4pps=filename) for filename in files]
+        scene = dict(SCENE, files4pps=files, granules=granules,
+                     granule_msgs=[MagicMock(data={'granule': idx}) for idx in range(2)])
+        publish_q = MagicMock()
+        stats = '/out/S_NWC_CMA_noaa20_12345_20240409T0800000Z_20240409T0801000Z_statistics.xml'
+        with caplog.at_level('INFO'):
+            with patch('nwcsafpps_runner.pps_jobs.find_product_statistics_from_lvl1c', return_value=[stats]):
+                asyncio.run(pps_worker_async(scene, publish_q, scene['granule_msgs'][0], options))
+        assert caplog.text.count("Running PPS on " + files[0]) == 1
+        assert publish_q.put.call_count == 2
+        assert '"granule": 1' in publish_q.put.call_args.args[0]
+
+    def test_cmask_prob_in_parallel(self, make_pps_options, tmp_path):
+        """Test ppsCmaskProb runs at the same time as ppsRunAll."""
+        options = make_pps_options(run_cmask_prob=True)
+        options['cmask_prob_mode'] = 'parallel'
+        script = tmp_path / 'ppsSlow.py'
+        script.write_text("import time\ntime.sleep(1)\n")
+        options['run_all_script']['name'] = str(script)
+        options['run_cmaprob_script'] = str(script)
+        tic = time.monotonic()
+        with patch('nwcsafpps_runner.pps_jobs.find_product_statistics_from_lvl1c', return_value=[]):
+            asyncio.run(pps_worker_async(SCENE, MagicMock(), MagicMock(data={}), options))
+        assert time.monotonic() - tic < 1.9
+
+    def test_pps_worker_async_fails_on_exit_code(self, make_pps_options, tmp_path):
+        """Test a PPS process exiting with a non-zero code fails the job, with its exit status."""
+        options = make_pps_options()
+        script = tmp_path / 'ppsBroken.py'
+        script.write_text("import sys\nsys.exit(3)\n")
+        options['run_all_script']['name'] = str(script)
+        with pytest.raises(PpsProcessFailed) as err:
+            asyncio.run(pps_worker_async(SCENE, MagicMock(), MagicMock(data={}), options))
+        assert err.value.exit_status == '3'
+
+    @pytest.mark.parametrize('cmask_prob_mode', ['parallel', 'after_pges'])
+    def test_cmask_prob_failure_fails_the_job(self, make_pps_options, tmp_path, cmask_prob_mode):
+        """Test ppsCmaskProb failing next to ppsRunAll fails the job, with its exit status."""
+        options = make_pps_options(run_cmask_prob=True)
+        options['cmask_prob_mode'] = cmask_prob_mode
+        script = tmp_path / 'ppsCmaskProb.py'
+        script.write_text("import sys\nsys.exit(4)\n")
+        options['run_cmaprob_script'] = str(script)
+        with patch('nwcsafpps_runner.pps_jobs.find_product_statistics_from_lvl1c', return_value=[]):
+            with pytest.raises(PpsProcessFailed) as err:
+                asyncio.run(pps_worker_async(SCENE, MagicMock(), MagicMock(data={}), options))
+        assert err.value.exit_status == '4'
+
+    def test_killed_process_fails_with_its_signal(self, make_pps_options, tmp_path):
+        """Test a PPS process killed by a signal, not by the time out, fails the job with the signal."""
+        options = make_pps_options()
+        script = tmp_path / 'ppsKilled.py'
+        script.write_text("import os, signal\nos.kill(os.getpid(), signal.SIGKILL)\n")
+        options['run_all_script']['name'] = str(script)
+        with pytest.raises(PpsProcessFailed) as err:
+            asyncio.run(pps_worker_async(SCENE, MagicMock(), MagicMock(data={}), options))
+        assert err.value.exit_status == 'signal 9'
+        assert not err.value.timed_out
+
+    def test_job_of_a_paused_platform_is_held(self, make_pps_options):
+        """Test a job whose platform was paused while it was in the lane is held instead of run."""
+        runner = AsyncPpsRunner(make_pps_options(), MagicMock())
+        runner.failures = MagicMock()
+        runner.failures.hold.return_value = True
+        with patch('nwcsafpps_runner.async_runner.pps_worker_async') as worker:
+            asyncio.run(runner.run_pps(SCENE, 'msg'))
+        runner.failures.hold.assert_called_once_with(SCENE, 'msg')
+        worker.assert_not_called()
+
+    def test_cmask_prob_is_not_run_when_run_all_fails(self, make_pps_options, tmp_path):
+        """Test ppsCmaskProb waiting for ppsRunAll is not started when ppsRunAll fails."""
+        options = make_pps_options(run_cmask_prob=True)
+        options.update({'cmask_prob_mode': 'after_pges', 'cmask_prob_depends_on': ['CMA']})
+        run_all = tmp_path / 'ppsRunAll.py'
+        run_all.write_text("import sys\nsys.exit(3)\n")
+        cmask_prob = tmp_path / 'ppsCmaskProb.py'
+        cmask_prob.write_text("open(%r, 'w').close()\n" % str(tmp_path / 'cmask_prob_run'))
+        options['run_all_script']['name'] = str(run_all)
+        options['run_cmaprob_script'] = str(cmask_prob)
+        with pytest.raises(PpsProcessFailed) as err:
+            asyncio.run(pps_worker_async(SCENE, MagicMock(), MagicMock(data={}), options))
+        assert err.value.exit_status == '3'
+        assert not (tmp_path / 'cmask_prob_run').exists()
+
+    def test_cmask_prob_after_pges(self, make_pps_options, tmp_path):
+        """Test ppsCmaskProb is started when the products it depends on are there, before ppsRunAll ends."""
+        options = make_pps_options(run_cmask_prob=True)
+        options.update({'cmask_prob_mode': 'after_pges', 'cmask_prob_depends_on': ['CMA'],
+                        'pps_outdir': str(tmp_path)})
+        cma = tmp_path / 'S_NWC_CMA_noaa20_12345_20240409T0800000Z_20240409T0801000Z.nc'
+        run_all = tmp_path / 'ppsRunAll.py'
+        run_all.write_text("import time\ntime.sleep(0.5)\nopen(%r, 'w').close()\ntime.sleep(2)\n"
+                           "open(%r, 'w').close()\n" % (str(cma), str(tmp_path / 'run_all_done')))
+        cmask_prob = tmp_path / 'ppsCmaskProb.py'
+        cmask_prob.write_text("import os\nassert os.path.exists(%r)\nopen(%r, 'w').write(str(os.path.exists(%r)))\n"
+                              % (str(cma), str(tmp_path / 'cmask_prob_done'), str(tmp_path / 'run_all_done')))
+        options['run_all_script']['name'] = str(run_all)
+        options['run_cmaprob_script'] = str(cmask_prob)
+        with patch('nwcsafpps_runner.async_runner.CMASK_PROB_POLL_SECONDS', 0.1):
+            with patch('nwcsafpps_runner.pps_jobs.find_product_statistics_from_lvl1c', return_value=[]):
+                asyncio.run(pps_worker_async(SCENE, MagicMock(), MagicMock(data={}), options))
+        assert (tmp_path / 'cmask_prob_done').read_text() == 'False'
+
+    @patch('nwcsafpps_runner.async_runner.ready2run')
+    @patch('nwcsafpps_runner.async_runner.create_scene_from_msg')
+    def test_dispatch_messages(self, create_scene, ready2run, make_pps_options, async_wait_for):
+        """Test that the messages from the listener queue are run until None comes."""
+        options = make_pps_options()
+        checked_in = set()
+        ready2run.side_effect = lambda msg, scene: checked_in.add(threading.current_thread()) or True
+        create_scene.side_effect = lambda msg: dict(SCENE, file4pps=msg)
+        ran = []
+
+        async def fake_run_pps(scene, input_msg, cpu_slots=None):
+            ran.append(scene['file4pps'])
+
+        async def run():
+            runner = AsyncPpsRunner(options, MagicMock())
+            runner.run_pps = fake_run_pps
+            listener_q = asyncio.Queue()
+            task = asyncio.create_task(runner.run(listener_q, resumed=['file1']))
+            for msg in ['file2', 'file3']:
+                await listener_q.put(msg)
+            assert await async_wait_for(lambda: len(ran) == 3)
+            await listener_q.put(None)
+            await task
+
+        asyncio.run(run())
+        assert sorted(ran) == ['file1', 'file2', 'file3']
+        # The checks read the file system, they are kept out of the event loop
+        assert threading.main_thread() not in checked_in
+
+    @patch('nwcsafpps_runner.concurrency.sample_system')
+    def test_controller_raises_the_limit_of_the_lane(self, sample_system, make_pps_options, async_wait_for):
+        """Test the controller run from the event loop wakes up the waiting workers."""
+        sample_system.return_value = {'load_per_cpu': 0.1, 'available_memory_mb': 8000, 'cpu_pressure': 0.0,
+                                      'memory_pressure': 0.0, 'io_pressure': 0.0}
+        options = dict(make_pps_options(), number_of_threads=1,
+                       adaptive_concurrency={'min_jobs': 1, 'max_jobs': 3, 'interval_seconds': 0.01})
+        release = None
+
+        async def job():
+            await release.wait()
+
+        async def run():
+            nonlocal release
+            release = asyncio.Event()
+            runner = AsyncPpsRunner(options, MagicMock())
+            runner.lane.start()
+            for idx in range(3):
+                await runner.lane.submit(idx, job)
+            task = asyncio.create_task(runner.control_concurrency())
+            assert await async_wait_for(lambda: runner.lane.get_metrics()['active_jobs'] == 3)
+            task.cancel()
+            release.set()
+            await runner.lane.shutdown()
+            return runner
+
+        runner = asyncio.run(run())
+        assert runner.lane.concurrency_limit == 3
+        assert runner.controller.get_metrics()['increases'] == 2
+
+    @patch('nwcsafpps_runner.async_runner.ready2run')
+    @patch('nwcsafpps_runner.async_runner.create_scene_from_msg')
+    def test_duplicates_are_not_run(self, create_scene, ready2run, make_pps_options, async_wait_for):
+        """Test the same scene from another station is rejected before any job starts."""
+        options = make_pps_options()
+        options['dedup_ttl_minutes'] = 60
+        ready2run.return_value = True
+        create_scene.side_effect = lambda msg: dict(SCENE, file4pps=msg)
+        ran = []
+
+        async def fake_run_pps(scene, input_msg, cpu_slots=None):
+            ran.append(scene['file4pps'])
+
+        async def run():
+            runner = AsyncPpsRunner(options, MagicMock())
+            runner.run_pps = fake_run_pps
+            listener_q = asyncio.Queue()
+            with patch('nwcsafpps_runner.dedup.publish_skip_message') as publish_skip:
+                task = asyncio.create_task(runner.run(listener_q))
+                for msg in ['/station1/file.nc', '/station2/file.nc']:
+                    await listener_q.put(msg)
+                assert await async_wait_for(lambda: ran and publish_skip.called)
+                await listener_q.put(None)
+                await task
+            return runner.dedup.get_metrics(), publish_skip
+
+        metrics, publish_skip = asyncio.run(run())
+        assert ran == ['/station1/file.nc']
+        assert metrics['duplicates'] == 1
+        assert publish_skip.call_args.kwargs['status'] == 'duplicate'
+
+    @patch('nwcsafpps_runner.async_runner.ready2run')
+    @patch('nwcsafpps_runner.async_runner.create_scene_from_msg')
+    def test_resource_classes_have_their_own_lanes(self, create_scene, ready2run, make_pps_options, async_wait_for):
+        """Test a SEVIRI scene runs while the default lane is busy with a long pass."""
+        options = make_pps_options()
+        options['number_of_threads'] = 1
+        options['resource_classes'] = {'geo': {'sensors': ['seviri'], 'number_of_threads': 1,
+                                               'maximum_pps_processing_time_in_minutes': 10}}
+        ready2run.return_value = True
+        create_scene.side_effect = lambda msg: dict(SCENE, file4pps=msg['file'], sensor=msg['sensor'])
+        ran = []
+        release = asyncio.Event()
+
+        async def run():
+            runner = AsyncPpsRunner(options, MagicMock())
+
+            async def fake_run_pps(scene, input_msg, cpu_slots=None):
+                ran.append((scene['file4pps'], runner.get_job_options(scene)['maximum_pps_processing_time_in_minutes']))
+                if scene['sensor'] == ['avhrr/3']:
+                    await release.wait()
+
+            runner.run_pps = fake_run_pps
+            listener_q = asyncio.Queue()
+            task = asyncio.create_task(runner.run(listener_q))
+            for msg in [{'file': 'avhrr1', 'sensor': ['avhrr/3']}, {'file': 'avhrr2', 'sensor': ['avhrr/3']},
+                        {'file': 'seviri', 'sensor': ['seviri']}]:
+                await listener_q.put(msg)
+            assert await async_wait_for(lambda: len(ran) == 2)
+            blocked = list(ran)
+            release.set()
+            await listener_q.put(None)
+            await task
+            return blocked
+
+        blocked = asyncio.run(run())
+        assert blocked == [('avhrr1', 1), ('seviri', 10)]
+
+    def test_jobs_are_recorded_before_they_are_submitted(self, make_pps_options, async_wait_for):
+        """Test a job is recorded accepted before it is queued, and dropped when the queue refuses it."""
+        options = make_pps_options()
+        options['number_of_threads'] = 1
+        options['max_pending_jobs'] = 1
+        options['job_queue_overflow_policy'] = 'reject'
+        journal = MagicMock()
+        states = []
+        journal.record.side_effect = lambda file4pps, state, *args: states.append((file4pps, state))
+
+        async def run():
+            runner = AsyncPpsRunner(options, MagicMock(), journal=journal)
+            runner.dedup = MagicMock()
+            release = asyncio.Event()
+
+            async def fake_run_pps_if_fresh(scene, input_msg):
+                await release.wait()
+
+            runner.run_pps_if_fresh = fake_run_pps_if_fresh
+            submit = runner.lane.submit
+
+            async def check_recorded_and_submit(job_id, *args, **kwargs):
+                assert states[-1] == (job_id, 'accepted')
+                return await submit(job_id, *args, **kwargs)
+
+            runner.lane.submit = check_recorded_and_submit
+            runner.lane.start()
+            await runner.submit_job(dict(SCENE, file4pps='file1'), MagicMock())
+            assert await async_wait_for(lambda: runner.lane.get_metrics()['active_jobs'] == 1)
+            for filename in ['file2', 'file3', 'file1']:
+                await runner.submit_job(dict(SCENE, file4pps=filename), MagicMock())
+            release.set()
+            await runner.lane.shutdown()
+            return runner.dedup
+
+        dedup = asyncio.run(run())
+        # The running file1 is not recorded again when it comes back
+        assert states == [('file1', 'accepted'), ('file2', 'accepted'), ('file3', 'accepted'), ('file3', 'dropped')]
+        # The dropped scene may be run from another station
+        dedup.job_failed.assert_called_once_with(dict(SCENE, file4pps='file3'))
+
+    @patch('nwcsafpps_runner.cpu_slots.get_available_cpus', return_value=[0, 1])
+    @patch('nwcsafpps_runner.async_runner.ready2run')
+    @patch('nwcsafpps_runner.async_runner.create_scene_from_msg')
+    def test_resource_classes_have_their_own_cpu_slots(self, create_scene, ready2run, available, make_pps_options,
+                                                       async_wait_for):
+        """Test a SEVIRI scene gets a cpu slot of its own while the slots of the default lane are all taken."""
+        options = make_pps_options()
+        options.update({'number_of_threads': 1, 'cpu_slots': 'auto'})
+        options['resource_classes'] = {'geo': {'sensors': ['seviri'], 'number_of_threads': 1}}
+        ready2run.return_value = True
+        create_scene.side_effect = lambda msg: dict(SCENE, file4pps=msg['file'], sensor=msg['sensor'])
+        ran = []
+        release = asyncio.Event()
+
+        async def fake_pps_worker(scene, publish_q, input_msg, options, cpu_slot=None, *args):
+            ran.append((scene['file4pps'], cpu_slot.cpus))
+            if scene['sensor'] == ['avhrr/3']:
+                await release.wait()
+
+        async def run():
+            runner = AsyncPpsRunner(options, MagicMock())
+            listener_q = asyncio.Queue()
+            task = asyncio.create_task(runner.run(listener_q))
+            for msg in [{'file': 'avhrr', 'sensor': ['avhrr/3']}, {'file': 'seviri', 'sensor': ['seviri']}]:
+                await listener_q.put(msg)
+            assert await async_wait_for(lambda: len(ran) == 2)
+            metrics = runner.cpu_slots.get_metrics()
+            release.set()
+            await listener_q.put(None)
+            await task
+            return metrics
+
+        with patch('nwcsafpps_runner.async_runner.pps_worker_async', fake_pps_worker):
+            metrics = asyncio.run(run())
+        assert sorted(ran) == [('avhrr', [0]), ('seviri', [1])]
+        assert metrics['cpu_slots'] == 1
+        assert metrics['cpu_slot_jobs'] == {0: 'avhrr'}
+
+    @patch('nwcsafpps_runner.async_runner.ready2run')
+    @patch('nwcsafpps_runner.async_runner.create_scene_from_msg')
+    def test_scenes_wait_for_the_nwp_data(self, create_scene, ready2run, tmp_path, make_pps_options, async_wait_for):
+        """Test a scene is parked until the NWP files it needs are in the NWP directory."""
+        options = make_pps_options()
+        nwp_dir = tmp_path / 'nwp'
+        nwp_dir.mkdir()
+        options['nwp_dependency'] = {'file_pattern': 'LL02_NHSPSF_{analysis_time:%Y%m%d%H%M}+{forecast_step:d}H00M',
+                                     'directory': str(nwp_dir), 'scan_interval_seconds': 0}
+        ready2run.return_value = True
+        create_scene.side_effect = lambda msg: dict(SCENE, file4pps=msg)
+        ran = []
+
+        async def fake_run_pps(scene, input_msg, cpu_slots=None):
+            ran.append(scene['file4pps'])
+
+        async def run():
+            runner = AsyncPpsRunner(options, MagicMock())
+            runner.run_pps = fake_run_pps
+            listener_q = asyncio.Queue()
+            task = asyncio.create_task(runner.run(listener_q))
+            await listener_q.put('file1')
+            assert await async_wait_for(lambda: len(runner.nwp_gate))
+            parked = list(ran)
+            for step in [6, 9]:
+                (nwp_dir / ('LL02_NHSPSF_202404090000+%03dH00M' % step)).write_text('')
+            assert await async_wait_for(lambda: ran)
+            await listener_q.put(None)
+            await task
+            return parked
+
+        assert asyncio.run(run()) == []
+        assert ran == ['file1']
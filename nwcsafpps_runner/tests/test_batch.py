@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the batch reprocessing."""
+
+import threading
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+
+from nwcsafpps_runner.batch import (BatchReport, create_msg_from_lvl1c,
+                                    find_lvl1c_files, run_batch)
+
+L1C_NAME = 'S_NWC_viirs_noaa20_12345_20240409T0800000Z_20240409T0801000Z.nc'
+
+
+def test_find_lvl1c_files(tmp_path):
+    """Test finding the level-1c files from directories, globs, files and file lists."""
+    day1 = tmp_path / '20240409'
+    day2 = tmp_path / '20240410'
+    day1.mkdir()
+    day2.mkdir()
+    (day1 / L1C_NAME).write_text('')
+    (day1 / 'README').write_text('')
+    (day2 / 'S_NWC_viirs_noaa20_12346_20240410T0800000Z_20240410T0801000Z.nc').write_text('')
+    listed = tmp_path / 'S_NWC_avhrr_noaa19_23456_20240411T0800000Z_20240411T0801000Z.nc'
+    listed.write_text('')
+    file_list = tmp_path / 'files.txt'
+    file_list.write_text(str(listed) + '\n\n')
+
+    files = find_lvl1c_files([str(day1), str(day2 / '*.nc'), str(day1 / L1C_NAME), '@' + str(file_list)])
+
+    assert files == sorted([str(day1 / L1C_NAME),
+                            str(day2 / 'S_NWC_viirs_noaa20_12346_20240410T0800000Z_20240410T0801000Z.nc'),
+                            str(listed)])
+
+
+def test_create_msg_from_lvl1c():
+    """Test making the level-1c message from the file name."""
+    msg = create_msg_from_lvl1c('/archive/' + L1C_NAME)
+
+    assert msg.type == 'file'
+    assert msg.data['uri'] == '/archive/' + L1C_NAME
+    assert msg.data['uid'] == L1C_NAME
+    assert msg.data['platform_name'] == 'NOAA-20'
+    assert msg.data['orbit_number'] == 12345
+    assert msg.data['sensor'] == 'viirs'
+    assert msg.data['start_time'] == datetime(2024, 4, 9, 8, 0)
+    assert msg.data['end_time'] == datetime(2024, 4, 9, 8, 1)
+
+
+def test_create_msg_from_lvl1c_unknown_platform():
+    """Test a level-1c file of an unknown platform is refused."""
+    with pytest.raises(ValueError):
+        create_msg_from_lvl1c('/archive/S_NWC_viirs_foo1_12345_20240409T0800000Z_20240409T0801000Z.nc')
+
+
+def test_batch_report(fake_clock):
+    """Test the throughput and job times of the batch report."""
+    report = BatchReport(fake_clock)
+    for seconds in range(1, 11):
+        report.record('/archive/%d.nc' % seconds, seconds * 60.0, ok=(seconds != 3))
+    report.skipped = 2
+    fake_clock.now = 1800.0
+    report.finish()
+    fake_clock.now = 3600.0
+
+    summary = report.get_summary()
+
+    assert summary['jobs'] == 10
+    assert summary['failed'] == 1
+    assert summary['skipped'] == 2
+    assert summary['wall_seconds'] == 1800.0
+    assert summary['scenes_per_hour'] == 20.0
+    assert summary['job_seconds_median'] == 330.0
+    assert summary['job_seconds_max'] == 600.0
+    assert report.log() == summary
+
+
+def test_batch_report_wait():
+    """Test waiting for the jobs of the batch."""
+    report = BatchReport()
+    threads = [threading.Thread(target=report.record, args=('/archive/%d.nc' % idx, 1.0)) for idx in range(3)]
+    for thread in threads:
+        thread.start()
+
+    report.wait(3)
+
+    assert report.get_summary()['jobs'] == 3
+    for thread in threads:
+        thread.join()
+
+
+def fake_run_pps(scene, publisher_q, msg, options, *args, **kwargs):
+    """Publish the level-1c file of the scene as a product, and fail the NOAA-19 scenes."""
+    publisher_q.put(scene['file4pps'])
+    if scene['platform_name'] == 'NOAA-19':
+        raise RuntimeError('ppsRunAll failed')
+
+
+@pytest.mark.parametrize('publish', [False, True])
+@patch('nwcsafpps_runner.batch.FilePublisher')
+@patch('nwcsafpps_runner.batch.run_pps', side_effect=fake_run_pps)
+def test_run_batch(run_pps, file_publisher, tmp_path, make_pps_options, publish):
+    """Test running a batch with a stubbed job, and publishing the products only if asked to."""
+    (tmp_path / L1C_NAME).write_text('')
+    (tmp_path / 'S_NWC_avhrr_noaa19_23456_20240409T0900000Z_20240409T0901000Z.nc').write_text('')
+    (tmp_path / 'S_NWC_viirs_foo1_12345_20240409T1000000Z_20240409T1001000Z.nc').write_text('')
+    options = dict(make_pps_options(), publish_topic='/pps/batch')
+
+    report = run_batch(options, [str(tmp_path)], nworkers=2, publish=publish)
+
+    summary = report.get_summary()
+    assert summary['jobs'] == 2
+    assert summary['failed'] == 1
+    assert summary['skipped'] == 1
+    assert report.failed == [str(tmp_path / 'S_NWC_avhrr_noaa19_23456_20240409T0900000Z_20240409T0901000Z.nc')]
+    assert run_pps.call_count == 2
+    if publish:
+        publisher_q = file_publisher.call_args[0][0]
+        assert sorted(publisher_q.queue) == sorted(call[0][0]['file4pps'] for call in run_pps.call_args_list)
+        file_publisher.return_value.start.assert_called_once()
+        file_publisher.return_value.stop.assert_called_once()
+    else:
+        file_publisher.assert_not_called()
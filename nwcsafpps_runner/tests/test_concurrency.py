@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the adaptive concurrency controller."""
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from nwcsafpps_runner.concurrency import (ConcurrencyController,
+                                          create_concurrency_controller,
+                                          get_concurrency_bounds,
+                                          get_duration_growth, sample_system)
+
+PRESSURE = """some avg10={some:.2f} avg60=0.00 avg300=0.00 total=0
+full avg10=0.00 avg60=0.00 avg300=0.00 total=0
+"""
+
+
+def make_proc_dir(tmp_path, loadavg=1.0, available_kb=8 * 1024 * 1024, cpu=0.0, memory=0.0, io=0.0):
+    """Make a fake /proc with the load information."""
+    (tmp_path / 'loadavg').write_text("%.2f 0.50 0.50 1/100 12345\n" % loadavg)
+    (tmp_path / 'meminfo').write_text("MemTotal:       16000000 kB\nMemFree:         1000000 kB\n"
+                                      "MemAvailable:   %8d kB\n" % available_kb)
+    (tmp_path / 'pressure').mkdir(exist_ok=True)
+    for resource, some in [('cpu', cpu), ('memory', memory), ('io', io)]:
+        (tmp_path / 'pressure' / resource).write_text(PRESSURE.format(some=some))
+    return str(tmp_path)
+
+
+@pytest.fixture
+def one_cpu():
+    """Pretend the runner has one cpu."""
+    with patch('nwcsafpps_runner.concurrency.os.sched_getaffinity', return_value={0}):
+        yield
+
+
+def make_pool(limit=4, queue_depth=0, active_jobs=4, durations=()):
+    """Make a fake pool."""
+    pool = MagicMock()
+    pool.get_metrics.return_value = {'concurrency_limit': limit, 'queue_depth': queue_depth,
+                                     'active_jobs': active_jobs}
+    pool.get_recent_durations.return_value = list(durations)
+    pool.set_concurrency.side_effect = lambda limit: limit
+    return pool
+
+
+def test_sample_system(tmp_path, one_cpu):
+    """Test reading the load of the node."""
+    sample = sample_system(make_proc_dir(tmp_path, loadavg=2.0, available_kb=2048, memory=12.5))
+    assert sample == {'load_per_cpu': 2.0, 'available_memory_mb': 2.0, 'cpu_pressure': 0.0,
+                      'memory_pressure': 12.5, 'io_pressure': 0.0}
+
+
+def test_sample_system_without_pressure(tmp_path, one_cpu):
+    """Test the pressure is None on kernels without PSI."""
+    proc_dir = make_proc_dir(tmp_path)
+    for resource in ['cpu', 'memory', 'io']:
+        (tmp_path / 'pressure' / resource).unlink()
+    assert sample_system(proc_dir)['cpu_pressure'] is None
+
+
+def test_duration_growth():
+    """Test comparing the last job durations to the older ones."""
+    assert get_duration_growth([10] * 5) is None
+    assert get_duration_growth([10] * 10 + [20] * 5) == 2.0
+
+
+def test_decrease_when_overloaded(tmp_path, one_cpu):
+    """Test the limit is lowered when the node is overloaded."""
+    pool = make_pool(limit=4)
+    controller = ConcurrencyController(pool, 2, 8, proc_dir=make_proc_dir(tmp_path, cpu=80.0))
+    assert controller.step() == 3
+    pool.set_concurrency.assert_called_once_with(3)
+    assert controller.get_metrics()['decreases'] == 1
+    assert 'cpu pressure' in controller.last_decision
+
+
+def test_halve_when_short_of_memory(tmp_path, one_cpu):
+    """Test the limit is halved, but not below the minimum, when memory runs out."""
+    pool = make_pool(limit=8)
+    controller = ConcurrencyController(pool, 3, 8, proc_dir=make_proc_dir(tmp_path, available_kb=100 * 1024),
+                                       min_available_memory_mb=1000)
+    assert controller.step() == 4
+    pool.get_metrics.return_value['concurrency_limit'] = 4
+    assert controller.step() == 3
+
+
+def test_decrease_when_jobs_get_slower(tmp_path, one_cpu):
+    """Test the limit is lowered when the jobs take much longer than before."""
+    pool = make_pool(limit=4, durations=[100] * 10 + [200] * 5)
+    controller = ConcurrencyController(pool, 1, 8, proc_dir=make_proc_dir(tmp_path, loadavg=0.1))
+    assert controller.step() == 3
+
+
+def test_increase_when_jobs_wait(tmp_path, one_cpu):
+    """Test the limit is raised when jobs are waiting and the node is idle."""
+    proc_dir = make_proc_dir(tmp_path, loadavg=0.2)
+    pool = make_pool(limit=4, queue_depth=3, active_jobs=4)
+    controller = ConcurrencyController(pool, 1, 5, proc_dir=proc_dir)
+    assert controller.step() == 5
+    pool.get_metrics.return_value['concurrency_limit'] = 5
+    assert controller.step() == 5
+    assert controller.stats == {'increases': 1, 'decreases': 0}
+
+
+def test_steady_without_waiting_jobs(tmp_path, one_cpu):
+    """Test the limit is kept when there is nothing waiting."""
+    pool = make_pool(limit=4, queue_depth=0, active_jobs=2)
+    controller = ConcurrencyController(pool, 1, 8, proc_dir=make_proc_dir(tmp_path, loadavg=0.2))
+    assert controller.step() == 4
+    pool.set_concurrency.assert_not_called()
+
+
+def test_concurrency_bounds_from_config():
+    """Test the number of workers and the initial limit."""
+    assert get_concurrency_bounds({'number_of_threads': 5}) == (5, 5)
+    options = {'number_of_threads': 5, 'adaptive_concurrency': {'min_jobs': 2, 'max_jobs': 12}}
+    assert get_concurrency_bounds(options) == (12, 5)
+    pool = make_pool()
+    controller = create_concurrency_controller(options, pool)
+    pool.set_concurrency.assert_called_once_with(5)
+    assert (controller.min_jobs, controller.max_jobs) == (2, 12)
+    assert create_concurrency_controller({'number_of_threads': 5}, pool) is None
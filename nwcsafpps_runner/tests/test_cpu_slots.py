@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the cpu slots of the PPS jobs."""
+
+from unittest.mock import patch
+
+import pytest
+
+from nwcsafpps_runner.cpu_slots import (CpuSlot, CpuSlotAllocator,
+                                        create_cpu_slot_allocator,
+                                        create_pool_cpu_slots, get_slot_env,
+                                        make_auto_slots, parse_cpu_list,
+                                        share_slots, split_cpus, split_slot)
+from nwcsafpps_runner.resource_classes import create_resource_classes
+
+
+def test_parse_cpu_list():
+    """Test parsing the cpu lists."""
+    assert parse_cpu_list("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+    assert parse_cpu_list([3, 1]) == [1, 3]
+    assert parse_cpu_list(5) == [5]
+
+
+def test_split_cpus():
+    """Test splitting the cpus in slots."""
+    assert split_cpus(list(range(10)), 3) == [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert split_cpus([0, 1], 4) == [[0], [1]]
+
+
+def make_node_dir(tmp_path, nodes):
+    """Make a fake sysfs NUMA node directory."""
+    for node, cpulist in nodes.items():
+        node_dir = tmp_path / ('node%d' % node)
+        node_dir.mkdir()
+        (node_dir / 'cpulist').write_text(cpulist + '\n')
+    return str(tmp_path)
+
+
+@patch('nwcsafpps_runner.cpu_slots.get_available_cpus', return_value=list(range(8)))
+def test_auto_slots_within_numa_nodes(available, tmp_path):
+    """Test the automatic slots are within the NUMA nodes, and spread over them."""
+    node_dir = make_node_dir(tmp_path, {0: "0-3", 1: "4-7"})
+    slots = make_auto_slots(4, numa=True, node_dir=node_dir)
+    assert slots == [CpuSlot(0, [0, 1], 0), CpuSlot(1, [4, 5], 1),
+                     CpuSlot(2, [2, 3], 0), CpuSlot(3, [6, 7], 1)]
+
+
+@patch('nwcsafpps_runner.cpu_slots.get_available_cpus', return_value=list(range(8)))
+def test_auto_slots_without_numa(available, tmp_path):
+    """Test the automatic slots without NUMA information."""
+    slots = make_auto_slots(3, numa=True, node_dir=str(tmp_path))
+    assert slots == [CpuSlot(0, [0, 1, 2], None), CpuSlot(1, [3, 4, 5], None), CpuSlot(2, [6, 7], None)]
+
+
+def test_split_slot():
+    """Test splitting a slot for two processes, each with its own cpus."""
+    assert split_slot(CpuSlot(1, [4, 5, 6], 0)) == (CpuSlot(1, [4, 5], 0), CpuSlot(1, [6], 0))
+    assert split_slot(CpuSlot(1, [4], 0)) == (CpuSlot(1, [4], 0), CpuSlot(1, [4], 0))
+    assert split_slot(None) == (None, None)
+
+
+def test_slot_env():
+    """Test the thread count variables are set to the slot size."""
+    env = get_slot_env(CpuSlot(0, [2, 3], None), env={'OMP_NUM_THREADS': '16', 'PATH': '/bin'})
+    assert env == {'OMP_NUM_THREADS': '2', 'MKL_NUM_THREADS': '2', 'OPENBLAS_NUM_THREADS': '2', 'PATH': '/bin'}
+    assert get_slot_env(None, env={'PATH': '/bin'}) == {'PATH': '/bin'}
+
+
+def test_allocator():
+    """Test handing out and giving back the slots."""
+    allocator = CpuSlotAllocator([CpuSlot(0, [0], None), CpuSlot(1, [1], None)])
+    first = allocator.acquire('job1')
+    second = allocator.acquire('job2')
+    assert (first.index, second.index) == (0, 1)
+    assert allocator.acquire('job3', timeout=0.01) is None
+    assert allocator.get_metrics() == {'cpu_slots': 2, 'cpu_slots_in_use': 2,
+                                       'cpu_slot_jobs': {0: 'job1', 1: 'job2'}}
+    allocator.release(first)
+    assert allocator.acquire('job3', timeout=0.01) == first
+
+
+def test_create_cpu_slot_allocator():
+    """Test creating the slots from the config."""
+    assert create_cpu_slot_allocator({'number_of_threads': 2}) is None
+    allocator = create_cpu_slot_allocator({'number_of_threads': 2, 'cpu_slots': ["0-1", [2, 3]]})
+    assert allocator.slots == [CpuSlot(0, [0, 1], None), CpuSlot(1, [2, 3], None)]
+    with pytest.raises(ValueError):
+        create_cpu_slot_allocator({'number_of_threads': 2, 'cpu_slots': 'everywhere'})
+
+
+def test_share_slots():
+    """Test each pool gets a slot per job, at least one, and the first pool the rest."""
+    slots = list(range(6))
+    assert share_slots(slots, [1, 2, 1]) == [[0, 1, 2], [3, 4], [5]]
+    assert share_slots(slots, [2, 4, 3]) == [[0], [1, 2, 3, 4], [5]]
+    with pytest.raises(ValueError):
+        share_slots(slots[:2], [1, 1, 1])
+
+
+def get_pool_cpus(allocator):
+    """Get the cpus of the slots of the allocator."""
+    return [slot.cpus for slot in allocator.slots]
+
+
+@patch('nwcsafpps_runner.cpu_slots.get_available_cpus', return_value=list(range(8)))
+def test_pool_cpu_slots_are_disjoint(available):
+    """Test the default pool, the resource classes and the late lane run on cpus of their own."""
+    options = {'number_of_threads': 2, 'cpu_slots': 'auto',
+               'resource_classes': {'geo': {'sensors': ['seviri'], 'number_of_threads': 1},
+                                    'avhrr': {'sensors': ['avhrr/3'], 'number_of_threads': 1,
+                                              'cpu_slots': ["6-7"]}}}
+    cpu_slots, class_cpu_slots, late_cpu_slots = create_pool_cpu_slots(options, create_resource_classes(options), 1)
+    assert get_pool_cpus(cpu_slots) == [[0, 1], [2, 3]]
+    assert get_pool_cpus(class_cpu_slots['geo']) == [[4]]
+    assert get_pool_cpus(class_cpu_slots['avhrr']) == [[6, 7]]
+    assert get_pool_cpus(late_cpu_slots) == [[5]]
+
+
+def test_pool_cpu_slots_from_cpu_lists():
+    """Test the default pool gets the cpu slots the other pools do not take."""
+    options = {'number_of_threads': 1, 'cpu_slots': ["0-1", "2-3", "4-5", "6-7"],
+               'resource_classes': {'geo': {'sensors': ['seviri'], 'number_of_threads': 1}}}
+    cpu_slots, class_cpu_slots, late_cpu_slots = create_pool_cpu_slots(options, create_resource_classes(options))
+    assert get_pool_cpus(cpu_slots) == [[0, 1], [2, 3], [4, 5]]
+    assert get_pool_cpus(class_cpu_slots['geo']) == [[6, 7]]
+    assert late_cpu_slots is None
+
+    options['resource_classes']['geo']['cpu_slots'] = ["6"]
+    with pytest.raises(ValueError):
+        create_pool_cpu_slots(options, create_resource_classes(options))
+
+
+def test_pool_cpu_slots_not_configured():
+    """Test no pool has cpu slots if none are configured."""
+    options = {'number_of_threads': 1, 'resource_classes': {'geo': {'sensors': ['seviri'], 'number_of_threads': 1}}}
+    assert create_pool_cpu_slots(options, create_resource_classes(options), 1) == (None, {'geo': None}, None)
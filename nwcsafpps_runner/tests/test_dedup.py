@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the detection of duplicate scenes."""
+
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import pytest
+
+from nwcsafpps_runner.dedup import (DedupIndex, create_dedup_index,
+                                    make_dedup_key)
+
+
+def make_scene(file4pps='/station1/S_NWC_viirs_npp_12345.nc', **kwargs):
+    """Make a scene."""
+    scene = {'platform_name': 'Suomi-NPP', 'orbit_number': 12345, 'sensor': ['viirs'],
+             'starttime': datetime(2024, 4, 9, 8, 0), 'file4pps': file4pps}
+    scene.update(kwargs)
+    return scene
+
+
+def test_dedup_key():
+    """Test the scenes are identified by platform, orbit, start time and sensor."""
+    assert make_dedup_key(make_scene()) == 'Suomi-NPP|12345|2024-04-09T08:00:00|viirs'
+    assert make_dedup_key(make_scene()) == make_dedup_key(make_scene(file4pps='/station2/other_name.nc'))
+    assert make_dedup_key(make_scene()) != make_dedup_key(make_scene(orbit_number=12346))
+
+
+def test_reject_within_ttl():
+    """Test a scene seen less than the time to live ago is a duplicate."""
+    index = DedupIndex(600)
+    assert index.check(make_scene(), now=1000) is None
+    assert index.check(make_scene('/station2/file.nc'), now=1500) == '/station1/S_NWC_viirs_npp_12345.nc'
+    assert index.check(make_scene('/station2/file.nc'), now=1600) is None
+    assert index.get_metrics()['duplicates'] == 1
+
+
+def test_ttl_restarts_when_the_job_is_done():
+    """Test the time to live counts from the end of the job."""
+    index = DedupIndex(600)
+    index.check(make_scene(), now=1000)
+    index.job_finished(make_scene(), now=2000)
+    assert index.check(make_scene(), now=2500) is not None
+
+
+def test_failed_job_can_be_rerun():
+    """Test a scene whose job failed is not a duplicate anymore."""
+    index = DedupIndex(600)
+    index.check(make_scene())
+    index.job_failed(make_scene())
+    assert index.check(make_scene()) is None
+
+
+def test_merge_dispatches_fallback_on_failure():
+    """Test a merged duplicate is dispatched when the job on the original fails."""
+    on_fallback = MagicMock()
+    index = DedupIndex(600, policy='merge', on_fallback=on_fallback)
+    index.check(make_scene())
+    assert index.check(make_scene('/station2/file.nc'), msg='station2 msg') is not None
+    index.job_failed(make_scene())
+    on_fallback.assert_called_once_with('station2 msg')
+
+    index.check(make_scene())
+    index.check(make_scene('/station2/file.nc'), msg='station2 msg')
+    index.job_finished(make_scene())
+    index.job_failed(make_scene())
+    on_fallback.assert_called_once()
+
+
+def test_multi_granule_job():
+    """Test the granules of a multi-granule job are all updated."""
+    index = DedupIndex(600)
+    granules = [make_scene(starttime=datetime(2024, 4, 9, 8, minute)) for minute in range(2)]
+    for granule in granules:
+        index.check(granule)
+    index.job_failed(dict(granules[0], granules=granules, granule_msgs=[None, None]))
+    assert index.check(granules[1]) is None
+
+
+def test_on_disk_index(tmp_path):
+    """Test the index survives a restart."""
+    filename = str(tmp_path / 'dedup.db')
+    index = DedupIndex(600, filename=filename)
+    index.check(make_scene())
+    index.close()
+    index = DedupIndex(600, filename=filename)
+    assert index.check(make_scene('/station2/file.nc')) is not None
+    index.close()
+
+
+def test_create_from_config():
+    """Test creating the index from the config."""
+    assert create_dedup_index({}) is None
+    index = create_dedup_index({'dedup_ttl_minutes': 10, 'dedup_policy': 'merge'})
+    assert (index.ttl_seconds, index.policy) == (600, 'merge')
+    with pytest.raises(ValueError):
+        create_dedup_index({'dedup_ttl_minutes': 10, 'dedup_policy': 'shred'})
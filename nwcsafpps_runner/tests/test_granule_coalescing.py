@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the coalescing of granules into multi-granule jobs."""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from nwcsafpps_runner.granule_coalescing import (GranuleCoalescer,
+                                                 create_granule_coalescer,
+                                                 get_multi_granule_mode,
+                                                 iter_granules)
+from nwcsafpps_runner.utils import create_pps_call_command
+
+GRANULE_SECONDS = 86
+
+
+def make_granule(idx, orbit_number=12345, platform_name='NOAA-20', sensor='viirs'):
+    """Make the scene and (fake) message of the idx:th granule of a pass."""
+    starttime = datetime(2024, 4, 9, 8, 0) + timedelta(seconds=idx * GRANULE_SECONDS)
+    endtime = starttime + timedelta(seconds=GRANULE_SECONDS)
+    scene = {'platform_name': platform_name, 'orbit_number': orbit_number, 'sensor': [sensor],
+             'starttime': starttime, 'endtime': endtime,
+             'file4pps': 'S_NWC_viirs_noaa20_%05d_%sZ_%sZ.nc' % (orbit_number,
+                                                                 starttime.strftime('%Y%m%dT%H%M%S0'),
+                                                                 endtime.strftime('%Y%m%dT%H%M%S0'))}
+    return scene, 'msg%d' % idx
+
+
+class TestGranuleCoalescer:
+    """Test grouping the granules."""
+
+    def test_window(self):
+        """Test consecutive granules are held until the window has passed."""
+        coalescer = GranuleCoalescer(window_seconds=100)
+        for idx in range(3):
+            assert coalescer.add(*make_granule(idx), now=idx * 10) == []
+        assert len(coalescer) == 3
+        assert coalescer.flush_expired(now=99) == []
+        [(scene, msg)] = coalescer.flush_expired(now=100)
+        assert msg == 'msg0'
+        assert len(scene['files4pps']) == 3
+        assert scene['file4pps'] == scene['files4pps'][0]
+        assert scene['endtime'] == make_granule(2)[0]['endtime']
+        assert [granule_msg for _, granule_msg in iter_granules(scene, msg)] == ['msg0', 'msg1', 'msg2']
+        assert len(coalescer) == 0
+
+    def test_max_granules(self):
+        """Test a full group is dispatched at once."""
+        coalescer = GranuleCoalescer(max_granules=2)
+        assert coalescer.add(*make_granule(0)) == []
+        [(scene, _)] = coalescer.add(*make_granule(1))
+        assert len(scene['granules']) == 2
+
+    def test_gap_starts_a_new_group(self):
+        """Test a granule not following the group dispatches the group."""
+        coalescer = GranuleCoalescer()
+        coalescer.add(*make_granule(0))
+        coalescer.add(*make_granule(1))
+        [(scene, _)] = coalescer.add(*make_granule(5))
+        assert len(scene['granules']) == 2
+        [(single, msg)] = coalescer.flush_all()
+        assert 'granules' not in single
+        assert msg == 'msg5'
+
+    def test_platforms_and_orbits_are_separate(self):
+        """Test the granules of other orbits are grouped separately."""
+        coalescer = GranuleCoalescer()
+        coalescer.add(*make_granule(0))
+        coalescer.add(*make_granule(1, orbit_number=12346))
+        assert len(coalescer.flush_all()) == 2
+
+    def test_other_sensors_pass_through(self):
+        """Test the scenes of other sensors are not held."""
+        coalescer = GranuleCoalescer(sensors=['viirs'])
+        granule = make_granule(0, platform_name='NOAA-19', sensor='avhrr/3')
+        assert coalescer.add(*granule) == [granule]
+
+
+def test_multi_granule_command():
+    """Test all the files are given to PPS."""
+    coalescer = GranuleCoalescer()
+    coalescer.add(*make_granule(0))
+    coalescer.add(*make_granule(1))
+    [(scene, _)] = coalescer.flush_all()
+    cmd = create_pps_call_command('python', 'ppsRunAll.py', scene)
+    assert cmd == 'python ppsRunAll.py -af ' + ' '.join(scene['files4pps'])
+
+
+def test_create_from_config():
+    """Test creating the coalescer from the config."""
+    assert create_granule_coalescer({}) is None
+    coalescer = create_granule_coalescer({'granule_coalescing': {'window_seconds': 60, 'max_granules': 5}})
+    assert (coalescer.window_seconds, coalescer.max_granules, coalescer.sensors) == (60, 5, ['viirs'])
+    assert get_multi_granule_mode({}) == 'single_call'
+    with pytest.raises(ValueError):
+        create_granule_coalescer({'granule_coalescing': {'multi_granule_mode': 'all_at_once'}})
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the retries of the failed jobs and the pauses of the failing platforms."""
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from nwcsafpps_runner.job_failures import (CircuitBreaker, JobFailures,
+                                           PpsProcessFailed, check_exit_status,
+                                           create_job_failures,
+                                           get_job_exit_status)
+
+
+def make_scene(orbit_number, platform_name='NOAA-20'):
+    """Make a scene."""
+    return {'platform_name': platform_name, 'orbit_number': orbit_number,
+            'file4pps': '/data/S_NWC_viirs_noaa20_%05d.nc' % orbit_number}
+
+
+def test_check_exit_status():
+    """Test the failed processes raise, with their exit status."""
+    check_exit_status('ppsRunAll.py', 0)
+    with pytest.raises(PpsProcessFailed) as err:
+        check_exit_status('ppsRunAll.py', 3)
+    assert get_job_exit_status(err.value) == '3'
+    assert not err.value.killed
+    with pytest.raises(PpsProcessFailed) as err:
+        check_exit_status('ppsRunAll.py', -9, timed_out=True)
+    assert get_job_exit_status(err.value) == 'timeout'
+    with pytest.raises(PpsProcessFailed) as err:
+        check_exit_status('ppsRunAll.py', -11)
+    assert get_job_exit_status(err.value) == 'signal 11'
+    assert err.value.killed
+    assert get_job_exit_status(KeyError('file4pps')) == 'KeyError'
+
+
+def test_circuit_breaker():
+    """Test a platform is paused after consecutive failures, and resumed after a success."""
+    breaker = CircuitBreaker(max_consecutive_failures=2, pause_minutes=10)
+    assert not breaker.record_failure('NOAA-20', 0)
+    breaker.record_success('NOAA-20')
+    assert not breaker.record_failure('NOAA-20', 0)
+    assert breaker.record_failure('NOAA-20', 10)
+    assert breaker.is_open('NOAA-20', 20)
+    assert not breaker.is_open('NOAA-21', 20)
+    # No new pause while paused, a new pause right after
+    assert not breaker.record_failure('NOAA-20', 30)
+    assert not breaker.is_open('NOAA-20', 610)
+    assert breaker.record_failure('NOAA-20', 620)
+    breaker.record_success('NOAA-20')
+    assert not breaker.is_open('NOAA-20', 630)
+
+
+def test_retry_with_backoff():
+    """Test the transient failures are retried after an exponential backoff, until the last attempt."""
+    failures = JobFailures(CircuitBreaker(max_consecutive_failures=10), max_attempts=3, backoff_seconds=60,
+                           backoff_factor=2)
+    scene = make_scene(12345)
+    err = PpsProcessFailed('ppsRunAll.py', -9, timed_out=True)
+
+    assert failures.job_failed(scene, 'msg', err, now=0)
+    assert failures.flush(now=59) == []
+    assert failures.flush(now=60) == [(scene, 'msg')]
+    assert failures.job_failed(scene, 'msg', err, now=100)
+    assert failures.flush(now=219) == []
+    assert failures.flush(now=220) == [(scene, 'msg')]
+    assert not failures.job_failed(scene, 'msg', err, now=300)
+    assert failures.get_metrics()['retried'] == 2
+    assert failures.get_metrics()['given_up'] == 1
+
+
+def test_only_transient_failures_are_retried():
+    """Test the exit codes not configured as transient and the runner errors are not retried."""
+    failures = JobFailures(CircuitBreaker(), retry_timeouts=False, retry_exit_codes=[75])
+    assert not failures.job_failed(make_scene(1), 'msg', PpsProcessFailed('ppsRunAll.py', None), now=0)
+    assert not failures.job_failed(make_scene(2), 'msg', PpsProcessFailed('ppsRunAll.py', 1), now=0)
+    assert not failures.job_failed(make_scene(3), 'msg', KeyError('file4pps'), now=0)
+    assert failures.job_failed(make_scene(4), 'msg', PpsProcessFailed('ppsRunAll.py', 75), now=0)
+
+
+def test_paused_platform_is_held_and_alerted():
+    """Test the scenes of a paused platform are held until the pause is over, and an alert is sent."""
+    on_alert = MagicMock()
+    failures = JobFailures(CircuitBreaker(max_consecutive_failures=2, pause_minutes=10), max_attempts=1,
+                           on_alert=on_alert)
+    err = PpsProcessFailed('ppsRunAll.py', 1)
+    failures.job_failed(make_scene(1), 'msg1', err, now=0)
+    on_alert.assert_not_called()
+    failures.job_failed(make_scene(2), 'msg2', err, now=0)
+    on_alert.assert_called_once()
+    assert "2 consecutive failures" in on_alert.call_args[0][2]
+
+    assert failures.hold(make_scene(3), 'msg3', now=10)
+    assert not failures.hold(make_scene(4, 'NOAA-21'), 'msg4', now=10)
+    assert failures.get_metrics(now=10)['paused_platforms'] == ['NOAA-20']
+    assert failures.flush(now=599) == []
+    assert failures.flush(now=600) == [(make_scene(3), 'msg3')]
+
+
+def test_create_job_failures_publishes_the_alert():
+    """Test the alert message of a paused platform is published."""
+    assert create_job_failures({}, None) is None
+    publish_q = MagicMock()
+    failures = create_job_failures({'station': 'norrkoping',
+                                    'job_failures': {'max_consecutive_failures': 1, 'max_attempts': 1}},
+                                   publish_q)
+    failures.job_failed(make_scene(1), MagicMock(data={'sensor': 'viirs'}), PpsProcessFailed('ppsRunAll.py', 1))
+    pubmsg = publish_q.put.call_args[0][0]
+    assert '/PPS/alert/norrkoping/polar/direct_readout/' in pubmsg
+    assert '"status": "paused"' in pubmsg
+    assert '"platform_name": "NOAA-20"' in pubmsg
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the persistent job journal."""
+
+from datetime import datetime
+
+import pytest
+from posttroll.message import Message
+
+from nwcsafpps_runner import job_journal
+from nwcsafpps_runner.job_journal import JobJournal, record_scene
+
+
+def make_msg(filename):
+    """Make a level-1c message."""
+    return Message('/segment/SDR/1C', 'file',
+                   data={'uri': filename, 'platform_name': 'NOAA-20', 'orbit_number': 12345,
+                         'sensor': 'viirs', 'start_time': datetime(2024, 4, 9, 8, 3)})
+
+
+@pytest.fixture
+def journal_file(tmp_path):
+    """Get the journal filename."""
+    return str(tmp_path / 'pps_jobs.db')
+
+
+class TestJobJournal:
+    """Test the job journal."""
+
+    def test_record_states(self, journal_file):
+        """Test recording and getting the job states."""
+        journal = JobJournal(journal_file)
+        assert journal.get_state('/data/file1.nc') is None
+        journal.record('/data/file1.nc', job_journal.ACCEPTED, make_msg('/data/file1.nc'))
+        assert journal.get_state('/data/file1.nc') == 'accepted'
+        journal.record('/data/file1.nc', job_journal.RUNNING)
+        assert journal.get_attempts('/data/file1.nc') == 1
+        journal.record('/data/file1.nc', job_journal.FINISHED)
+        assert journal.is_finished('/data/file1.nc')
+        journal.close()
+
+    def test_record_exit_status(self, journal_file):
+        """Test the exit status of the last run is kept, also in a journal made before it was recorded."""
+        import sqlite3
+        conn = sqlite3.connect(journal_file)
+        conn.execute("CREATE TABLE jobs (file4pps TEXT PRIMARY KEY, state TEXT NOT NULL, message TEXT, "
+                     "attempts INTEGER NOT NULL DEFAULT 0, updated REAL NOT NULL)")
+        conn.close()
+        journal = JobJournal(journal_file)
+        journal.record('/data/file1.nc', job_journal.RUNNING)
+        assert journal.get_exit_status('/data/file1.nc') is None
+        journal.record('/data/file1.nc', job_journal.FAILED, exit_status='timeout')
+        journal.record('/data/file1.nc', job_journal.RUNNING)
+        assert journal.get_exit_status('/data/file1.nc') == 'timeout'
+        journal.record('/data/file1.nc', job_journal.FINISHED, exit_status='0')
+        assert journal.get_exit_status('/data/file1.nc') == '0'
+        journal.close()
+
+    def test_record_multi_granule_scene(self, journal_file):
+        """Test the state of each granule of a multi-granule job is recorded, with its own message."""
+        journal = JobJournal(journal_file)
+        files = ['/data/file1.nc', '/data/file2.nc']
+        scene = {'file4pps': files[0], 'files4pps': files,
+                 'granules': [{'file4pps': filename} for filename in files],
+                 'granule_msgs': [make_msg(filename) for filename in files]}
+        record_scene(journal, scene, job_journal.ACCEPTED, scene['granule_msgs'][0])
+        assert [msg.data['uri'] for msg in journal.get_unfinished_messages()] == files
+        record_scene(journal, scene, job_journal.FINISHED)
+        assert journal.is_finished(files[1])
+        record_scene(None, scene, job_journal.FINISHED)
+        journal.close()
+
+    def test_resume_after_restart(self, journal_file):
+        """Test that unfinished jobs are resumed after a restart, and finished ones not."""
+        journal = JobJournal(journal_file)
+        for idx, state in enumerate([job_journal.ACCEPTED, job_journal.RUNNING,
+                                     job_journal.FINISHED, job_journal.FAILED]):
+            filename = '/data/file%d.nc' % idx
+            journal.record(filename, job_journal.ACCEPTED, make_msg(filename))
+            journal.record(filename, state)
+        journal.close()
+
+        journal = JobJournal(journal_file)
+        messages = journal.get_unfinished_messages()
+        assert [msg.data['uri'] for msg in messages] == ['/data/file0.nc', '/data/file1.nc']
+        assert messages[0].data['start_time'] == datetime(2024, 4, 9, 8, 3)
+        journal.close()
+
+    def test_max_attempts(self, journal_file):
+        """Test that a job already started too many times is not resumed."""
+        journal = JobJournal(journal_file)
+        journal.record('/data/file1.nc', job_journal.ACCEPTED, make_msg('/data/file1.nc'))
+        journal.record('/data/file1.nc', job_journal.RUNNING)
+        journal.record('/data/file1.nc', job_journal.RUNNING)
+        assert journal.get_unfinished_messages(max_attempts=2) == []
+        assert journal.get_state('/data/file1.nc') == 'failed'
+        journal.close()
+
+    def test_prune(self, journal_file):
+        """Test removing old jobs."""
+        journal = JobJournal(journal_file)
+        journal.record('/data/file1.nc', job_journal.FINISHED)
+        assert journal.prune(1) == 0
+        assert journal.prune(-1) == 1
+        assert journal.get_state('/data/file1.nc') is None
+        journal.close()
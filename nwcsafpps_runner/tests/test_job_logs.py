@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the per-job log files of the PPS processes."""
+
+import asyncio
+import gzip
+import io
+import logging
+import os
+
+from nwcsafpps_runner.async_runner import run_subprocess
+from nwcsafpps_runner.job_logs import (JobLog, create_job_log,
+                                       get_command_name)
+from nwcsafpps_runner.process_supervisor import run_supervised
+
+SCENE = {'file4pps': '/data/S_NWC_viirs_noaa20_12345_20240409T0800000Z_20240409T0801000Z.nc'}
+
+SCRIPT = "import sys; print('line 1'); print('ERROR: no nwp', file=sys.stderr); print('line 3')"
+
+
+def test_command_name():
+    """Test the job log is named after the python script, or the program."""
+    assert get_command_name(['python', '/usr/bin/ppsRunAll.py', '-af', 'file.nc']) == 'ppsRunAll'
+    assert get_command_name(['/usr/bin/ionice', '-c', '3']) == 'ionice'
+
+
+def test_error_lines_split_between_chunks_are_logged(tmp_path, caplog):
+    """Test the error lines go to the runner log, also when read in two chunks."""
+    job_log = JobLog(str(tmp_path / 'job.log'), max_error_lines=2)
+    with caplog.at_level(logging.INFO):
+        job_log.write(b'line 1\nERR')
+        job_log.write(b'OR: first\nline 3\nCRITICAL: second\nERROR: third')
+        job_log.close()
+    errors = [record.getMessage() for record in caplog.records if record.levelno == logging.ERROR]
+    assert errors == ['job.log: ERROR: first', 'job.log: CRITICAL: second']
+    assert job_log.error_lines == 3
+    assert "3 error lines" in caplog.text
+    assert (tmp_path / 'job.log').read_bytes() == b'line 1\nERROR: first\nline 3\nCRITICAL: second\nERROR: third'
+
+
+def test_output_beyond_the_size_cap_is_dropped(tmp_path):
+    """Test only the first max_bytes of the output are kept."""
+    job_log = JobLog(str(tmp_path / 'job.log'), max_bytes=10)
+    job_log.write(b'12345678')
+    job_log.write(b'90abc')
+    job_log.write(b'def')
+    job_log.close()
+    assert job_log.dropped == 6
+    assert (tmp_path / 'job.log').read_bytes() == b'1234567890\n[output truncated after 10 bytes]\n'
+
+
+def test_logs_of_previous_runs_are_rotated(tmp_path):
+    """Test the logs of the previous runs on the scene are kept up to backup_count."""
+    path = str(tmp_path / 'job.log')
+    for run in range(4):
+        job_log = JobLog(path, backup_count=2)
+        job_log.write(b'run %d' % run)
+        job_log.close()
+    assert sorted(os.listdir(str(tmp_path))) == ['job.log', 'job.log.1', 'job.log.2']
+    assert (tmp_path / 'job.log.2').read_bytes() == b'run 1'
+
+
+def test_compressed_log_is_drained_in_chunks(tmp_path):
+    """Test the output is read in chunks and gzipped."""
+    job_log = JobLog(str(tmp_path / 'job.log'), compress=True, buffer_bytes=4)
+    job_log.drain(io.BytesIO(b'a' * 10 + b'\n'))
+    job_log.close()
+    with gzip.open(job_log.path) as fd:
+        assert fd.read() == b'a' * 10 + b'\n'
+
+
+def test_no_job_log_by_default():
+    """Test the output is logged line by line unless job logs are configured."""
+    assert create_job_log({}, SCENE, ['python', 'ppsRunAll.py']) is None
+
+
+def test_run_supervised_writes_the_job_log(tmp_path, caplog):
+    """Test stdout and stderr of the supervised process are written to the job log."""
+    options = {'job_logs': {'directory': str(tmp_path / 'jobs')}}
+    with caplog.at_level(logging.INFO):
+        run_supervised(['python', '-u', '-c', SCRIPT], SCENE, 10, options)
+    path = tmp_path / 'jobs' / 'S_NWC_viirs_noaa20_12345_20240409T0800000Z_20240409T0801000Z_python.log'
+    assert path.read_text().splitlines() == ['line 1', 'ERROR: no nwp', 'line 3']
+    assert 'line 1' not in caplog.text
+    assert 'ERROR: no nwp' in caplog.text
+
+
+def test_run_subprocess_writes_the_job_log(tmp_path):
+    """Test the output of the asyncio subprocess is written to the job log."""
+    options = {'job_logs': {'directory': str(tmp_path), 'compress': True}}
+    cmd = "python -c print('hello')"
+    assert asyncio.run(run_subprocess(cmd, SCENE, 10, options)).returncode == 0
+    path = tmp_path / 'S_NWC_viirs_noaa20_12345_20240409T0800000Z_20240409T0801000Z_python.log.gz'
+    with gzip.open(str(path)) as fd:
+        assert fd.read() == b'hello\n'
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the long-lived level-1c worker processes."""
+
+import os
+import threading
+import time
+
+import pytest
+
+from nwcsafpps_runner.l1c_workers import L1cWorkerPool
+
+
+def fake_l1c_process(level1_files, result_home, sleep_seconds=0, fail=False):
+    """Make the level-1c file name, with the pid of the worker."""
+    time.sleep(sleep_seconds)
+    if fail:
+        raise ValueError("Bad level-1 data")
+    return os.path.join(result_home, 'S_NWC_%d_%s.nc' % (os.getpid(), level1_files[0]))
+
+
+def get_pid(l1cfile):
+    """Get the pid of the worker from the level-1c file name."""
+    return int(os.path.basename(l1cfile).split('_')[2])
+
+
+@pytest.fixture
+def pool():
+    """Get a worker pool, closed after the test."""
+    pool = L1cWorkerPool(nworkers=2, time_limit_seconds=5, max_jobs_per_worker=3)
+    yield pool
+    pool.close()
+
+
+def test_workers_are_kept_between_jobs(pool):
+    """Test the jobs are run in the same worker process, until recycled after the max number of jobs."""
+    pids = [get_pid(pool.run(fake_l1c_process, ['granule%d' % idx], '/tmp')) for idx in range(4)]
+    assert pids[0] != os.getpid()
+    assert pids[0] == pids[1] == pids[2]
+    assert pids[3] != pids[0]
+    metrics = pool.get_metrics()
+    assert metrics['jobs'] == 4
+    assert metrics['recycled'] == 1
+    assert metrics['workers'] == 1
+
+
+def test_worker_recycled_on_memory(pool):
+    """Test a worker is recycled when its peak memory passes the limit."""
+    pool.max_rss_mb = 1
+    first = get_pid(pool.run(fake_l1c_process, ['granule1'], '/tmp'))
+    assert get_pid(pool.run(fake_l1c_process, ['granule2'], '/tmp')) != first
+    assert pool.get_metrics()['recycled'] == 2
+
+
+def test_failed_job(pool):
+    """Test a failing job gives no level-1c file and keeps the worker."""
+    assert pool.run(fake_l1c_process, ['granule1'], '/tmp', {'fail': True}) is None
+    assert pool.run(fake_l1c_process, ['granule2'], '/tmp') is not None
+    assert pool.get_metrics()['workers'] == 1
+
+
+def test_hard_time_limit(pool):
+    """Test a job going over the time limit is killed with its worker."""
+    pool.time_limit_seconds = 0.5
+    tic = time.monotonic()
+    assert pool.run(fake_l1c_process, ['granule1'], '/tmp', {'sleep_seconds': 30}) is None
+    assert time.monotonic() - tic < 3
+    assert pool.get_metrics()['timeouts'] == 1
+    assert pool.get_metrics()['workers'] == 0
+    assert pool.run(fake_l1c_process, ['granule2'], '/tmp') is not None
+
+
+def get_parent_pid(level1_files, result_home):
+    """Get the pid of the parent of the worker."""
+    return os.getppid()
+
+
+def test_workers_are_started_from_the_fork_server(pool):
+    """Test the workers are started up front, and forked from the fork server rather than from the runner."""
+    pool.start()
+    assert pool.get_metrics()['workers'] == 2
+    assert pool.run(get_parent_pid, [], '/tmp') != os.getpid()
+    assert pool.get_metrics()['workers'] == 2
+
+
+def test_jobs_run_in_parallel(pool):
+    """Test the workers run jobs at the same time."""
+    results = []
+
+    def run_job(idx):
+        results.append(pool.run(fake_l1c_process, ['granule%d' % idx], '/tmp', {'sleep_seconds': 1}))
+
+    threads = [threading.Thread(target=run_job, args=(idx, )) for idx in range(2)]
+    tic = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - tic < 1.9
+    assert len(set(get_pid(result) for result in results)) == 2
@@ -22,6 +22,9 @@
 
 """Testing the level-1c runner code."""
 
+import os
+import subprocess
+import sys
 import tempfile
 import time
 import unittest
@@ -37,7 +40,8 @@ from nwcsafpps_runner.l1c_processing import (L1cProcessor,
                                              MessageTypeNotSupported,
                                              ServiceNameNotSupported,
                                              check_message_okay,
-                                             check_service_is_supported)
+                                             check_service_is_supported,
+                                             get_l1c_processor)
 from nwcsafpps_runner.message_utils import prepare_l1c_message, publish_l1c
 
 TEST_YAML_CONTENT_OK = """
@@ -131,6 +135,11 @@ def my_fake_l1proc_function(dummy1, dummy2, dummy3):
     time.sleep(65)
 
 
+def my_fast_l1proc_function(level1_files, result_home, **kwargs):
+    """Create fake function making the level-1c file name from the first level-1 file."""
+    return os.path.join(result_home, 'S_NWC_' + os.path.basename(level1_files[0]) + '.nc')
+
+
 def create_config_from_yaml(yaml_content_str):
     """Create aapp-runner config dict from a yaml file."""
     return yaml.load(yaml_content_str, Loader=yaml.FullLoader)
@@ -217,6 +226,22 @@ class TestL1cProcessing(unittest.TestCase):
         exception_raised = exec_info.value
         self.assertEqual('Service name avhrr is not yet supported', str(exception_raised))
 
+    def test_get_l1c_processor(self):
+        """Test the level1c4pps processor is imported only when asked for."""
+        code = ("import sys; import nwcsafpps_runner.l1c_processing as lp; "
+                "assert 'level1c4pps.viirs2pps_lib' not in sys.modules; "
+                "lp.get_l1c_processor('avhrr-l1c'); "
+                "assert 'level1c4pps.avhrr2pps_lib' in sys.modules; "
+                "assert 'level1c4pps.viirs2pps_lib' not in sys.modules")
+        subprocess.run([sys.executable, '-c', code], check=True)
+
+        from level1c4pps.avhrr2pps_lib import process_one_scene
+        self.assertIs(get_l1c_processor('avhrr-l1c'), process_one_scene)
+        with patch.dict('nwcsafpps_runner.l1c_processing.LVL1C_PROCESSOR_MAPPING',
+                        {'viirs-l1c': my_fast_l1proc_function}):
+            self.assertIs(get_l1c_processor('viirs-l1c'), my_fast_l1proc_function)
+        self.assertRaises(AttributeError, get_l1c_processor, 'seviri')
+
     def test_check_message_okay_message_ok(self):
         """Test for check if message is okay."""
         input_msg = Message.decode(rawstr=TEST_INPUT_MSG)
@@ -341,6 +366,32 @@ class TestL1cProcessing(unittest.TestCase):
             l1c_proc.run(input_msg)
         self.assertTrue(time.time() - start_time < 5)
 
+    @patch('nwcsafpps_runner.config.load_config_from_file')
+    @patch.dict('nwcsafpps_runner.l1c_processing.LVL1C_PROCESSOR_MAPPING', {'viirs-l1c': my_fast_l1proc_function})
+    def test_jobs_have_their_own_state(self, config):
+        """Test each message gets its own job, processed without changing the processor state."""
+        config.return_value = self.config_viirs_orbit_number_from_msg_ok
+        input_msg = Message.decode(rawstr=TEST_INPUT_MESSAGE_VIIRS_MSG)
+        input_msg_no_orbit = Message.decode(rawstr=TEST_INPUT_MESSAGE_VIIRS_NO_ORBIT_MSG)
+        with tempfile.NamedTemporaryFile() as myconfig_file:
+            l1c_proc = L1cProcessor(myconfig_file.name + ".yaml", 'viirs-l1c')
+        self.assertEqual(l1c_proc.num_of_cpus, 2)
+        self.assertEqual(l1c_proc.workers.nworkers, 2)
+        try:
+            job1 = l1c_proc.create_job(input_msg)
+            job2 = l1c_proc.create_job(input_msg_no_orbit)
+            l1c_proc.process(job1)
+        finally:
+            l1c_proc.close()
+
+        self.assertEqual(job1.orbit_number, 49711)
+        self.assertEqual(job2.orbit_number, 99999)
+        self.assertEqual(job1.l1cfile, '/san1/polar_in/lvl1c/S_NWC_H-000-MSG4__-MSG4________-_________-' +
+                                       'PRO______-202105181415-__.nc')
+        self.assertIsNone(job2.l1cfile)
+        self.assertEqual(l1c_proc.platform_name, 'unknown')
+        self.assertIsNone(l1c_proc.l1cfile)
+
     @patch('nwcsafpps_runner.config.load_config_from_file')
     @patch('nwcsafpps_runner.l1c_processing.cpu_count')
     def test_orbit_number_missing_in_msg_viirs(self, cpu_count, config):
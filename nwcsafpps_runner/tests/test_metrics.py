@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the job phase timing and the metrics endpoint."""
+
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from nwcsafpps_runner.metrics import (REGISTRY, Histogram, MetricsRegistry,
+                                      MetricsServer, start_metrics_server,
+                                      time_phase)
+from nwcsafpps_runner.worker_pool import WorkerPool
+
+
+def test_histogram_buckets_are_cumulative():
+    """Test the histogram lines."""
+    histogram = Histogram([1, 10])
+    for value in [0.5, 5, 7, 20]:
+        histogram.observe(value)
+    assert histogram.render('duration', 'phase="run_all"') == [
+        'duration_bucket{phase="run_all",le="1"} 1',
+        'duration_bucket{phase="run_all",le="10"} 3',
+        'duration_bucket{phase="run_all",le="+Inf"} 4',
+        'duration_sum{phase="run_all"} 32.5',
+        'duration_count{phase="run_all"} 4']
+
+
+def test_render_phases_counters_and_pools():
+    """Test the phases, counters and pool gauges are in the text format."""
+    registry = MetricsRegistry(buckets=[60])
+    registry.observe_phase('run_all', 30)
+    registry.inc('process_timeouts')
+    pool = WorkerPool(2, name='pps-geo-worker')
+    try:
+        registry.register_pool(pool)
+        text = registry.render()
+    finally:
+        pool.shutdown()
+    assert '# TYPE pps_runner_phase_duration_seconds histogram' in text
+    assert 'pps_runner_phase_duration_seconds_bucket{phase="run_all",le="60"} 1' in text
+    assert 'pps_runner_phase_duration_seconds_count{phase="cmask_prob"} 0' in text
+    assert 'pps_runner_process_timeouts_total 1' in text
+    assert 'pps_runner_job_failures_total 0' in text
+    assert 'pps_runner_reruns_skipped_total 0' in text
+    assert 'pps_runner_queue_depth{pool="pps-geo-worker"} 0' in text
+    assert 'pps_runner_concurrency_limit{pool="pps-geo-worker"} 2' in text
+    assert 'pps_runner_pool_jobs_total{pool="pps-geo-worker",event="completed"} 0' in text
+
+
+def test_queue_wait_and_phases_are_timed():
+    """Test the time spent in the queue and in the with blocks is recorded in the registry."""
+    queue_wait_count = REGISTRY.phases['queue_wait'].count
+    publish_count = REGISTRY.phases['publish'].count
+    done = threading.Event()
+    pool = WorkerPool(1)
+    pool.submit('job', target=done.set)
+    assert done.wait(5)
+    pool.shutdown()
+    with time_phase('publish'):
+        pass
+    assert REGISTRY.phases['queue_wait'].count == queue_wait_count + 1
+    assert REGISTRY.phases['publish'].count == publish_count + 1
+
+
+def test_metrics_endpoint():
+    """Test the metrics are served on /metrics."""
+    registry = MetricsRegistry()
+    registry.inc('job_failures', 3)
+    server = MetricsServer(0, registry=registry).start()
+    try:
+        url = 'http://127.0.0.1:%d' % server.port
+        with urllib.request.urlopen(url + '/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert 'pps_runner_job_failures_total 3' in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + '/other')
+    finally:
+        server.stop()
+
+
+def test_no_server_by_default():
+    """Test the metrics are only served if a port is configured."""
+    assert start_metrics_server({}) is None
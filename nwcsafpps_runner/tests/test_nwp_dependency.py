@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test holding back the scenes until their NWP data is there."""
+
+from datetime import datetime, timedelta, timezone
+
+from nwcsafpps_runner.nwp_dependency import (NwpGate, NwpRegistry,
+                                             create_nwp_gate)
+
+PATTERN = 'LL02_NHSPSF_{analysis_time:%Y%m%d%H%M}+{forecast_step:d}H00M'
+
+SCENE = {'file4pps': 'S_NWC_viirs_noaa20_12345_20240409T0800000Z_20240409T0801000Z.nc',
+         'starttime': datetime(2024, 4, 9, 8, 0)}
+
+
+def test_valid_time_from_the_file_name():
+    """Test the valid time is the analysis time plus the forecast step."""
+    registry = NwpRegistry(PATTERN)
+    assert registry.get_valid_time('/data/LL02_NHSPSF_202404090000+006H00M') == datetime(2024, 4, 9, 6, 0)
+    assert registry.get_valid_time('/data/LL02_NHSPSF_202404090000+006H00M_tmp_result') is None
+    assert registry.get_valid_time('/data/other_file') is None
+
+
+def test_forecasts_before_and_after_are_needed():
+    """Test a time is covered when forecasts close enough on both sides are registered."""
+    registry = NwpRegistry(PATTERN)
+    registry.add_file('LL02_NHSPSF_202404090000+006H00M')
+    assert not registry.covers(datetime(2024, 4, 9, 8, 0), timedelta(hours=6))
+    registry.add_file('LL02_NHSPSF_202404090000+012H00M')
+    registry.add_file('LL02_NHSPSF_202404090000+012H00M')
+    assert len(registry) == 2
+    assert registry.covers(datetime(2024, 4, 9, 8, 0, tzinfo=timezone.utc), timedelta(hours=6))
+    assert registry.covers(datetime(2024, 4, 9, 6, 0), timedelta(hours=1))
+    assert not registry.covers(datetime(2024, 4, 9, 8, 0), timedelta(hours=3))
+
+
+def test_old_forecasts_are_forgotten():
+    """Test the forecasts valid before the lookback window of the latest one are dropped."""
+    registry = NwpRegistry(PATTERN, lookback_hours=12)
+    registry.add_file('LL02_NHSPSF_202404090000+000H00M')
+    registry.add_file('LL02_NHSPSF_202404090000+006H00M')
+    registry.add_file('LL02_NHSPSF_202404090000+018H00M')
+    assert len(registry) == 2
+    assert not registry.covers(datetime(2024, 4, 9, 3, 0), timedelta(hours=6))
+    registry.add_file('LL02_NHSPSF_202404090000+003H00M')
+    assert len(registry) == 2
+    registry.add_file('LL02_NHSPSF_202404100000+012H00M')
+    assert len(registry) == 1
+
+
+def test_directory_is_scanned(tmp_path):
+    """Test the NWP files are found in the directory, not more often than the scan interval."""
+    (tmp_path / 'LL02_NHSPSF_202404090000+006H00M').write_text('')
+    registry = NwpRegistry(PATTERN, directory=str(tmp_path), scan_interval_seconds=60)
+    registry.scan(now=0)
+    assert len(registry) == 1
+    (tmp_path / 'LL02_NHSPSF_202404090000+009H00M').write_text('')
+    registry.scan(now=30)
+    assert len(registry) == 1
+    registry.scan(now=60)
+    assert len(registry) == 2
+
+
+def test_scene_is_parked_until_the_nwp_comes():
+    """Test a scene without NWP data is parked, and released when the forecasts are registered."""
+    gate = NwpGate(NwpRegistry(PATTERN), max_forecast_interval_hours=3, max_wait_minutes=30)
+    assert gate.add(SCENE, 'msg', now=0) == []
+    assert gate.flush(now=10) == []
+    gate.registry.add_file('LL02_NHSPSF_202404090000+006H00M')
+    gate.registry.add_file('LL02_NHSPSF_202404090000+009H00M')
+    assert gate.flush(now=20) == [(SCENE, 'msg')]
+    assert gate.add(SCENE, 'msg2') == [(SCENE, 'msg2')]
+    assert gate.get_metrics() == {'parked': 1, 'released': 1, 'expired': 0, 'waiting': 0, 'nwp_forecasts': 2}
+
+
+def test_scene_runs_after_the_maximum_wait():
+    """Test a parked scene is run anyway when it has waited too long."""
+    gate = NwpGate(NwpRegistry(PATTERN), max_wait_minutes=1)
+    gate.add(SCENE, 'msg', now=0)
+    assert gate.flush(now=59) == []
+    assert gate.flush(now=60) == [(SCENE, 'msg')]
+    assert len(gate) == 0
+    assert gate.stats['expired'] == 1
+
+
+def test_no_gate_by_default(tmp_path):
+    """Test the scenes only wait for the NWP data if configured."""
+    assert create_nwp_gate({}) is None
+    (tmp_path / 'LL02_NHSPSF_202404090000+006H00M').write_text('')
+    gate = create_nwp_gate({'nwp_dependency': {'file_pattern': PATTERN, 'directory': str(tmp_path)}})
+    assert len(gate.registry) == 1
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test publishing the PPS products as soon as they are written."""
+
+import os
+import threading
+from datetime import datetime
+
+import pytest
+
+from nwcsafpps_runner.output_watcher import (OutputWatcher,
+                                             parse_product_name,
+                                             start_output_watcher)
+
+TIMES = '20240409T0800000Z_20240409T0801000Z'
+SCENE = {'file4pps': '/data/S_NWC_viirs_noaa20_12345_%s.nc' % TIMES}
+
+
+def product_name(product, orbit=12345):
+    """Get the name of a product of the scene."""
+    return 'S_NWC_%s_noaa20_%05d_%s.nc' % (product, orbit, TIMES)
+
+
+class Products(object):
+    """Collect the published products."""
+
+    def __init__(self):
+        self.paths = []
+        self.published = threading.Event()
+
+    def __call__(self, scene, msg, path):
+        assert (scene, msg) == (SCENE, 'msg')
+        self.paths.append(os.path.basename(path))
+        self.published.set()
+
+
+def test_parse_product_name():
+    """Test the products are identified by platform, orbit and start time."""
+    assert parse_product_name('/out/' + product_name('CMA')) == ('noaa20', 12345, datetime(2024, 4, 9, 8, 0))
+    assert parse_product_name(product_name('CMA_PRE'))[1] == 12345
+    assert parse_product_name('S_NWC_timectrl.txt') is None
+
+
+@pytest.mark.parametrize('use_inotify', [True, False])
+def test_products_are_published_while_the_job_runs(tmp_path, use_inotify):
+    """Test a product of the scene is published before the job ends, other files are not."""
+    (tmp_path / product_name('CTTH')).write_text('from an earlier run')
+    products = Products()
+    watcher = OutputWatcher(str(tmp_path), [(SCENE, 'msg')], products, poll_seconds=0.05,
+                            use_inotify=use_inotify)
+    watcher.start()
+    (tmp_path / product_name('CMA', orbit=12346)).write_text('other orbit')
+    (tmp_path / 'S_NWC_viirs_noaa20_12345_{}.nc'.format(TIMES)).write_text('level-1c')
+    (tmp_path / product_name('CMA')).write_text('cloud mask')
+    assert products.published.wait(5)
+    assert products.paths == [product_name('CMA')]
+    watcher.stop()
+    assert products.paths == [product_name('CMA')]
+
+
+def test_renamed_products_are_published(tmp_path):
+    """Test a product moved into the directory is published."""
+    products = Products()
+    tmp_file = tmp_path / 'tmp.nc'
+    tmp_file.write_text('cloud type')
+    watcher = OutputWatcher(str(tmp_path), [(SCENE, 'msg')], products)
+    watcher.start()
+    os.rename(str(tmp_file), str(tmp_path / product_name('CT')))
+    assert products.published.wait(5)
+    watcher.stop()
+    assert products.paths == [product_name('CT')]
+
+
+def test_products_left_are_published_on_stop(tmp_path):
+    """Test the products written at the end of the job are published when the watcher stops."""
+    products = Products()
+    watcher = OutputWatcher(str(tmp_path), [(SCENE, 'msg')], products, poll_seconds=60, use_inotify=False)
+    watcher.start()
+    (tmp_path / product_name('CMIC')).write_text('microphysics')
+    watcher.stop()
+    assert products.paths == [product_name('CMIC')]
+
+
+def test_no_watcher_by_default(tmp_path):
+    """Test the output directory is only watched if configured."""
+    assert start_output_watcher({}, str(tmp_path), [(SCENE, 'msg')], Products()) is None
+    watcher = start_output_watcher({'watch_output': True}, str(tmp_path), [(SCENE, 'msg')], Products())
+    watcher.stop()
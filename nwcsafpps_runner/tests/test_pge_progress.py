@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test following the PGEs of the PPS processes from their output."""
+
+import logging
+
+from nwcsafpps_runner.job_logs import JobLog
+from nwcsafpps_runner.metrics import REGISTRY, MetricsRegistry
+from nwcsafpps_runner.pge_progress import (JobProgress, create_job_progress,
+                                           get_running_jobs)
+from nwcsafpps_runner.process_supervisor import run_supervised
+
+PPS_OUTPUT = b"""Running ppsRunAll.py
+2024-04-09 08:05:00 INFO ppsMakeNwp: Extract the NWP fields
+2024-04-09 08:05:10 INFO ppsMakeNwp: SUCCEED
+2024-04-09 08:05:11 INFO ppsCmaskPrepare.py: Start
+2024-04-09 08:05:20 INFO ppsCmask.py: Read the CMA-PRE file
+2024-04-09 08:05:50 INFO ppsCtth: Start
+"""
+
+
+def test_pges_are_followed_from_the_output(ticking_clock):
+    """Test the PGEs named in the output are started and ended, and the longest name is recognised."""
+    progress = JobProgress('job', clock=ticking_clock)
+    progress.feed(PPS_OUTPUT)
+    assert progress.get_status() == {'job': 'job', 'current_pge': 'ppsCtth', 'current_pge_seconds': 1,
+                                     'pge_seconds': {'ppsMakeNwp': 1, 'ppsCmaskPrepare': 1, 'ppsCmask': 1}}
+    progress.end_pge('ppsCmask')
+    assert progress.current == 'ppsCtth'
+
+
+def test_pge_durations_are_observed(caplog, ticking_clock):
+    """Test the finished PGEs are timed in the metrics, and the summary logged."""
+    count = REGISTRY.pges['ppsMakeNwp'].count if 'ppsMakeNwp' in REGISTRY.pges else 0
+    progress = JobProgress('job', clock=ticking_clock).start()
+    progress.feed("ppsMakeNwp started\n")
+    assert get_running_jobs()[-1]['current_pge'] == 'ppsMakeNwp'
+    progress.feed("ppsCtth started\n")
+    with caplog.at_level(logging.INFO):
+        progress.finish()
+    assert REGISTRY.pges['ppsMakeNwp'].count == count + 1
+    assert progress not in REGISTRY.jobs
+    assert "job: seconds per PGE: ppsMakeNwp 2.0, ppsCtth 1.0" in caplog.text
+
+
+def test_current_pge_is_rendered(ticking_clock):
+    """Test the current PGE of the running jobs is in the metrics."""
+    registry = MetricsRegistry(buckets=[60])
+    progress = JobProgress('S_NWC_viirs_noaa20_ppsRunAll', clock=ticking_clock)
+    progress.feed("ppsCmask started\n")
+    registry.register_job(progress)
+    registry.observe_pge('ppsMakeNwp', 30)
+    text = registry.render()
+    assert 'pps_runner_job_current_pge_seconds{job="S_NWC_viirs_noaa20_ppsRunAll",pge="ppsCmask"} 1' in text
+    assert 'pps_runner_pge_duration_seconds_bucket{pge="ppsMakeNwp",le="60"} 1' in text
+    registry.unregister_job(progress)
+    assert 'ppsCmask' not in registry.render()
+
+
+def test_job_log_feeds_complete_lines(ticking_clock):
+    """Test the job log feeds the progress with the lines cut between chunks put together."""
+    progress = JobProgress('job', clock=ticking_clock)
+    job_log = JobLog('/dev/null', progress=progress)
+    job_log.write(b'ppsMake')
+    assert progress.current is None
+    job_log.write(b'Nwp start\n')
+    assert progress.current == 'ppsMakeNwp'
+    job_log.write(b'ppsCtth')
+    job_log.close()
+    assert progress.current == 'ppsCtth'
+
+
+def test_run_supervised_follows_the_pges(caplog):
+    """Test the PGEs of a supervised process are followed and summarised."""
+    with caplog.at_level(logging.INFO):
+        run_supervised(["echo", "ppsCmask running"], {'file4pps': '/data/S_NWC_viirs_noaa20.nc'}, 10, {})
+    assert "S_NWC_viirs_noaa20_echo: seconds per PGE: ppsCmask" in caplog.text
+    assert not [job for job in get_running_jobs() if job['job'] == 'S_NWC_viirs_noaa20_echo']
+
+
+def test_create_job_progress_registers_the_job():
+    """Test the progress of a new job is exported until it finishes."""
+    progress = create_job_progress('scene', ['python', 'ppsRunAll.py'])
+    assert progress.name == 'scene_ppsRunAll'
+    assert progress in REGISTRY.jobs
+    progress.finish()
+    assert progress not in REGISTRY.jobs
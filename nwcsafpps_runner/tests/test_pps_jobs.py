@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the PPS jobs of the thread based runner."""
+
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from nwcsafpps_runner.cpu_slots import CpuSlot
+from nwcsafpps_runner.dedup import DedupIndex
+from nwcsafpps_runner.job_failures import PpsProcessFailed, create_job_failures
+from nwcsafpps_runner.job_journal import JobJournal
+from nwcsafpps_runner.pps_jobs import (pps_worker, record_job_failed, run_pps,
+                                       run_pps_scripts)
+from nwcsafpps_runner.process_supervisor import ProcessResult
+
+SCENE = {'platform_name': 'NOAA-20', 'orbit_number': 12345,
+         'starttime': datetime(2024, 4, 9, 8, 0),
+         'file4pps': '/path/to/S_NWC_viirs_noaa20_12345_20240409T0800000Z_20240409T0801000Z.nc'}
+
+
+def test_pps_worker(make_pps_options, caplog):
+    """Test running RunAll and CMaskProb, and publishing the statistics files."""
+    options = make_pps_options(run_cmask_prob=True)
+    publish_q = MagicMock()
+    stats = '/out/S_NWC_CMA_noaa20_12345_20240409T0800000Z_20240409T0801000Z_statistics.xml'
+    with caplog.at_level('INFO'):
+        with patch('nwcsafpps_runner.pps_jobs.find_product_statistics_from_lvl1c', return_value=[stats]):
+            pps_worker(SCENE, publish_q, MagicMock(data={}), options)
+    assert caplog.text.count("Running PPS on " + SCENE['file4pps']) == 2
+    publish_q.put.assert_called_once()
+
+
+@pytest.mark.parametrize('cmask_prob_mode', ['parallel', 'after_pges'])
+def test_cmask_prob_failure_fails_the_job(make_pps_options, tmp_path, cmask_prob_mode):
+    """Test ppsCmaskProb failing next to ppsRunAll fails the job, with its exit status."""
+    options = make_pps_options(run_cmask_prob=True)
+    options['cmask_prob_mode'] = cmask_prob_mode
+    script = tmp_path / 'ppsCmaskProb.py'
+    script.write_text("import sys\nsys.exit(4)\n")
+    options['run_cmaprob_script'] = str(script)
+    with patch('nwcsafpps_runner.pps_jobs.find_product_statistics_from_lvl1c', return_value=[]):
+        with pytest.raises(PpsProcessFailed) as err:
+            pps_worker(SCENE, MagicMock(), MagicMock(data={}), options)
+    assert err.value.exit_status == '4'
+
+
+@pytest.mark.parametrize('cmask_prob_mode', ['parallel', 'after_pges'])
+def test_cmask_prob_gets_its_own_cpus(make_pps_options, cmask_prob_mode):
+    """Test ppsCmaskProb running next to ppsRunAll does not share the cpus of ppsRunAll."""
+    options = dict(make_pps_options(run_cmask_prob=True), cmask_prob_mode=cmask_prob_mode)
+    cpus = []
+
+    def fake_run_supervised(cmd, scene, timeout_seconds, options, log_func=None, cpu_slot=None):
+        cpus.append(cpu_slot.cpus)
+        return ProcessResult(0, False, None)
+
+    with patch('nwcsafpps_runner.pps_jobs.run_supervised', fake_run_supervised):
+        run_pps_scripts(SCENE, options, './', CpuSlot(0, [0, 1, 2, 3], None))
+    assert sorted(cpus) == [[0, 1], [2, 3]]
+
+
+def test_cmask_prob_is_not_run_when_run_all_fails(make_pps_options, tmp_path):
+    """Test ppsCmaskProb waiting for ppsRunAll is not started when ppsRunAll fails."""
+    options = make_pps_options(run_cmask_prob=True)
+    options.update({'cmask_prob_mode': 'after_pges', 'cmask_prob_depends_on': ['CMA']})
+    run_all = tmp_path / 'ppsRunAll.py'
+    run_all.write_text("import sys\nsys.exit(3)\n")
+    cmask_prob = tmp_path / 'ppsCmaskProb.py'
+    cmask_prob.write_text("open(%r, 'w').close()\n" % str(tmp_path / 'cmask_prob_run'))
+    options['run_all_script']['name'] = str(run_all)
+    options['run_cmaprob_script'] = str(cmask_prob)
+    with pytest.raises(PpsProcessFailed) as err:
+        pps_worker(SCENE, MagicMock(), MagicMock(data={}), options)
+    assert err.value.exit_status == '3'
+    assert not (tmp_path / 'cmask_prob_run').exists()
+
+
+def test_time_out_is_recorded_in_the_runtime_model(make_pps_options, tmp_path):
+    """Test ppsRunAll killed at its time out is recorded with the time out as runtime."""
+    options = make_pps_options()
+    options['kill_grace_seconds'] = 1
+    run_all = tmp_path / 'ppsRunAll.py'
+    run_all.write_text("import time\ntime.sleep(60)\n")
+    options['run_all_script']['name'] = str(run_all)
+    runtime_model = MagicMock()
+    with patch('nwcsafpps_runner.pps_jobs.get_timeout_seconds', return_value=0.5):
+        with pytest.raises(PpsProcessFailed) as err:
+            pps_worker(SCENE, MagicMock(), MagicMock(data={}), options, runtime_model=runtime_model)
+    assert err.value.timed_out
+    runtime_model.record_timeout.assert_called_once_with(SCENE, 0.5)
+    runtime_model.record.assert_not_called()
+
+
+def test_run_pps_records_the_job(make_pps_options, tmp_path):
+    """Test a finished job and a failed job, with its exit status, are recorded in the journal."""
+    options = make_pps_options()
+    journal = JobJournal(str(tmp_path / 'pps_jobs.db'))
+    dedup = MagicMock()
+    with patch('nwcsafpps_runner.pps_jobs.find_product_statistics_from_lvl1c', return_value=[]):
+        run_pps(SCENE, MagicMock(), MagicMock(data={}), options, journal, dedup=dedup)
+        assert journal.is_finished(SCENE['file4pps'])
+        dedup.job_finished.assert_called_once()
+
+        script = tmp_path / 'ppsBroken.py'
+        script.write_text("import sys\nsys.exit(3)\n")
+        options['run_all_script']['name'] = str(script)
+        with pytest.raises(PpsProcessFailed):
+            run_pps(SCENE, MagicMock(), MagicMock(data={}), options, journal, dedup=dedup)
+    assert journal.get_state(SCENE['file4pps']) == 'failed'
+    assert journal.get_exit_status(SCENE['file4pps']) == '3'
+    dedup.job_failed.assert_called_once()
+    journal.close()
+
+
+def test_job_of_a_paused_platform_is_held(make_pps_options):
+    """Test a job whose platform was paused while it was in the queue is held instead of run."""
+    options = make_pps_options()
+    failures = MagicMock()
+    failures.hold.return_value = True
+    cpu_slots = MagicMock()
+    with patch('nwcsafpps_runner.pps_jobs.pps_worker') as worker:
+        run_pps(SCENE, MagicMock(), 'msg', options, cpu_slots=cpu_slots, failures=failures)
+    failures.hold.assert_called_once_with(SCENE, 'msg')
+    worker.assert_not_called()
+    cpu_slots.acquire.assert_not_called()
+
+
+def test_existing_products_are_republished(make_pps_options, tmp_path):
+    """Test PPS is not run when the expected products are already there."""
+    options = make_pps_options()
+    lvl1c = tmp_path / 'S_NWC_viirs_noaa20_12345_20240409T0800000Z_20240409T0801000Z.nc'
+    lvl1c.write_text('')
+    product = tmp_path / 'S_NWC_CMA_noaa20_12345_20240409T0800000Z_20240409T0801000Z.nc'
+    product.write_text('')
+    options.update({'expected_products': ['CMA'], 'pps_outdir': str(tmp_path)})
+    options['run_all_script']['name'] = str(tmp_path / 'not_there.py')
+    publish_q = MagicMock()
+    with patch('os.path.getmtime', side_effect=lambda path: 2 if path == str(product) else 1):
+        pps_worker(dict(SCENE, file4pps=str(lvl1c)), publish_q, MagicMock(data={}), options)
+    assert str(product) in publish_q.put.call_args.args[0]
+
+
+def test_requeued_job_keeps_its_duplicates():
+    """Test the duplicates merged into a requeued job are only dispatched when the job is given up."""
+    fallbacks = []
+    dedup = DedupIndex(3600, policy='merge', on_fallback=fallbacks.append)
+    failures = create_job_failures({'job_failures': {'max_attempts': 2, 'backoff_seconds': 0}}, MagicMock())
+    assert dedup.check(SCENE, 'msg') is None
+    duplicate = dict(SCENE, file4pps='/other/station/' + SCENE['file4pps'].split('/')[-1])
+    assert dedup.check(duplicate, 'duplicate msg') == SCENE['file4pps']
+    err = PpsProcessFailed('ppsRunAll.py', 1)
+
+    record_job_failed(SCENE, 'msg', err, dedup=dedup, failures=failures)
+    assert failures.flush() == [(SCENE, 'msg')]
+    assert fallbacks == []
+    assert dedup.check(SCENE) == SCENE['file4pps']
+
+    record_job_failed(SCENE, 'msg', err, dedup=dedup, failures=failures)
+    assert failures.flush() == []
+    assert fallbacks == ['duplicate msg']
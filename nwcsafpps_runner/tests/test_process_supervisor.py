@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the supervision of the PPS subprocesses."""
+
+import asyncio
+import os
+import sys
+import time
+
+from nwcsafpps_runner.async_runner import run_subprocess
+from nwcsafpps_runner.cpu_slots import CpuSlot
+from nwcsafpps_runner.process_supervisor import (SupervisedProcess,
+                                                 get_ionice_prefix,
+                                                 get_process_limits_prefix,
+                                                 run_supervised)
+
+
+def test_run_supervised_exit_code_and_rusage():
+    """Test the exit code and resource usage are reported."""
+    result = run_supervised(["sh", "-c", "exit 3"], 'scene', 10, {})
+    assert result.returncode == 3
+    assert not result.timed_out
+    assert result.rusage['max_rss_mb'] > 0
+    assert 'cpu_user_seconds' in result.rusage
+
+
+def test_run_supervised_logs_output():
+    """Test the output of the process is passed to the log function."""
+    lines = []
+    run_supervised(["echo", "hello"], 'scene', 10, {}, log_func=lines.append)
+    assert lines == [b"hello"]
+
+
+def test_time_out_kills_the_whole_process_group(tmp_path, is_running):
+    """Test the children of the process are killed on time out."""
+    pidfile = tmp_path / "child.pid"
+    proc = SupervisedProcess(["sh", "-c", "sleep 100 & echo $! > %s; wait" % pidfile], 'scene', 0.5,
+                             kill_grace_seconds=1)
+    tic = time.monotonic()
+    proc.start()
+    result = proc.wait()
+    assert time.monotonic() - tic < 5
+    assert result.timed_out
+    assert result.returncode < 0
+    assert not is_running(int(pidfile.read_text()))
+
+
+def test_leftover_children_are_killed(tmp_path, is_running):
+    """Test processes left in the group after the main process ended are killed."""
+    pidfile = tmp_path / "child.pid"
+    proc = SupervisedProcess(["sh", "-c", "sleep 100 > /dev/null 2>&1 & echo $! > %s" % pidfile], 'scene', 10,
+                             kill_grace_seconds=1)
+    tic = time.monotonic()
+    proc.start()
+    result = proc.wait()
+    assert time.monotonic() - tic < 5
+    assert not result.timed_out
+    assert not is_running(int(pidfile.read_text()))
+
+
+def test_nice_and_limits_are_applied():
+    """Test the nice value and resource limits are set in the child."""
+    lines = []
+    limits = {'nice': 5, 'cpu_seconds': 100, 'address_space_mb': 4000}
+    proc = SupervisedProcess(["sh", "-c", "ulimit -t; ulimit -v; nice"], 'scene', 10, limits=limits,
+                             log_func=lines.append)
+    proc.start()
+    proc.wait()
+    expected_nice = os.nice(0) + 5
+    assert lines == [b"100", b"%d" % (4000 * 1024), b"%d" % expected_nice]
+
+
+def test_cpu_slot_is_applied():
+    """Test the process is pinned to the cpus of the slot, with the thread counts set."""
+    lines = []
+    cpu = min(os.sched_getaffinity(0))
+    script = "import os; print(sorted(os.sched_getaffinity(0)), os.environ['OMP_NUM_THREADS'])"
+    proc = SupervisedProcess([sys.executable, "-c", script], 'scene', 10,
+                             log_func=lines.append, cpu_slot=CpuSlot(0, [cpu], None))
+    proc.start()
+    proc.wait()
+    assert lines == [b"[%d] 1" % cpu]
+
+
+def test_limits_prefix():
+    """Test the command prefix setting the limits before the command starts."""
+    assert get_process_limits_prefix({}) == []
+    prefix = get_process_limits_prefix({'nice': 5, 'cpu_seconds': 100, 'address_space_mb': 4000}, [0, 2])
+    assert [os.path.basename(arg) for arg in prefix] == ['taskset', '-c', '0,2',
+                                                         'prlimit', '--as=%d' % (4000 * 1024 * 1024), '--cpu=100',
+                                                         'nice', '-n', '5']
+
+
+def test_ionice_prefix():
+    """Test the ionice command prefix."""
+    assert get_ionice_prefix({}) == []
+    prefix = get_ionice_prefix({'ionice_class': 2, 'ionice_level': 7})
+    if prefix:
+        assert prefix[1:] == ['-c', '2', '-n', '7']
+
+
+def test_async_time_out_kills_the_whole_process_group(tmp_path):
+    """Test the asyncio engine kills the whole process group on time out."""
+    script = tmp_path / "pps.sh"
+    script.write_text("sleep 100 &\nwait\n")
+    tic = time.monotonic()
+    result = asyncio.run(run_subprocess("sh %s" % script, 'scene', 0.5, {'kill_grace_seconds': 1}))
+    assert result.timed_out
+    assert result.rusage is not None
+    assert time.monotonic() - tic < 5
+
+
+def test_async_limits_exit_code_and_rusage(tmp_path, caplog):
+    """Test the asyncio engine sets the limits, and reports the exit code and resource usage of the process."""
+    script = tmp_path / "pps.sh"
+    script.write_text("ulimit -t\nexit 3\n")
+    options = {'pps_process_limits': {'cpu_seconds': 100}}
+    with caplog.at_level('INFO'):
+        result = asyncio.run(run_subprocess("sh %s" % script, 'scene', 10, options))
+    assert caplog.messages[0] == "100"
+    assert result.returncode == 3
+    assert result.rusage['max_rss_mb'] > 0
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the resource classes of the PPS jobs."""
+
+import pytest
+
+from nwcsafpps_runner.resource_classes import (create_resource_classes,
+                                               find_resource_class)
+
+OPTIONS = {'number_of_threads': 4,
+           'maximum_pps_processing_time_in_minutes': 20,
+           'job_queue_overflow_policy': 'block',
+           'pps_process_limits': {'nice': 5, 'memory_mb': 8000},
+           'adaptive_concurrency': {'max_jobs': 8},
+           'resource_classes': {'geo': {'sensors': ['seviri'],
+                                        'number_of_threads': 2,
+                                        'maximum_pps_processing_time_in_minutes': 10,
+                                        'nice': 0},
+                                'metop': {'platforms': ['Metop-B', 'Metop-C'],
+                                          'number_of_threads': 1,
+                                          'job_queue_overflow_policy': 'reject'},
+                                'avhrr': {'sensors': ['avhrr/3'],
+                                          'nice': 10}}}
+
+
+def test_class_options():
+    """Test the class settings override the runner config."""
+    geo, metop, avhrr = create_resource_classes(OPTIONS)
+    assert geo.name == 'geo'
+    assert geo.options['number_of_threads'] == 2
+    assert geo.options['maximum_pps_processing_time_in_minutes'] == 10
+    assert geo.options['pps_process_limits'] == {'nice': 0, 'memory_mb': 8000}
+    assert geo.options['job_queue_overflow_policy'] == 'drop_oldest'
+    assert geo.options['resource_class'] == 'geo'
+    assert 'adaptive_concurrency' not in geo.options
+    assert 'resource_classes' not in geo.options
+    assert metop.options['job_queue_overflow_policy'] == 'reject'
+    assert metop.options['pps_process_limits'] == {'nice': 5, 'memory_mb': 8000}
+    assert avhrr.options['number_of_threads'] == 4
+    assert OPTIONS['pps_process_limits'] == {'nice': 5, 'memory_mb': 8000}
+
+
+def test_find_class_by_platform_first():
+    """Test the class of the platform is taken before the class of the sensor."""
+    resource_classes = create_resource_classes(OPTIONS)
+    scene = {'platform_name': 'Metop-B', 'sensor': ['avhrr/3']}
+    assert find_resource_class(resource_classes, scene).name == 'metop'
+    scene = {'platform_name': 'NOAA-19', 'sensor': ['avhrr/3']}
+    assert find_resource_class(resource_classes, scene).name == 'avhrr'
+    scene = {'platform_name': 'Meteosat-11', 'sensor': 'seviri'}
+    assert find_resource_class(resource_classes, scene).name == 'geo'
+    assert find_resource_class(resource_classes, {'platform_name': 'NOAA-20', 'sensor': ['viirs']}) is None
+
+
+def test_no_classes():
+    """Test there are no classes by default."""
+    assert create_resource_classes({'number_of_threads': 4}) == []
+
+
+def test_class_without_platforms_or_sensors():
+    """Test a class should list platforms or sensors."""
+    with pytest.raises(ValueError):
+        create_resource_classes({'number_of_threads': 4, 'resource_classes': {'geo': {'nice': 0}}})
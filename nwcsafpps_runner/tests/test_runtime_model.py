@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the runtime model of the PPS jobs."""
+
+from datetime import datetime, timedelta
+
+from nwcsafpps_runner.runtime_model import (RuntimeModel,
+                                            create_runtime_model,
+                                            get_timeout_seconds,
+                                            make_runtime_key, percentile)
+
+
+def make_scene(minutes=1, platform_name='NOAA-20', sensor=['viirs']):
+    """Make a scene lasting *minutes*."""
+    starttime = datetime(2024, 4, 9, 8, 0)
+    return {'platform_name': platform_name, 'sensor': sensor, 'starttime': starttime,
+            'endtime': starttime + timedelta(minutes=minutes),
+            'file4pps': 'S_NWC_viirs_noaa20_12345_20240409T0800000Z_20240409T0801000Z.nc'}
+
+
+def test_runtime_key():
+    """Test the scenes are keyed by platform name, sensor and duration in minutes."""
+    assert make_runtime_key(make_scene(minutes=1.4)) == ('NOAA-20', 'viirs', 1)
+    assert make_runtime_key({'platform_name': 'Metop-B', 'sensor': 'avhrr/3'}) == ('Metop-B', 'avhrr/3', None)
+
+
+def test_percentile():
+    """Test the nearest-rank percentile."""
+    values = list(range(1, 101))
+    assert percentile(values, 95) == 95
+    assert percentile(values, 50) == 50
+    assert percentile([3, 1, 2], 100) == 3
+
+
+def test_expected_runtime():
+    """Test the expected runtime is the median of the last runtimes, once there are enough of them."""
+    model = RuntimeModel(max_samples=3, min_samples=2)
+    assert model.expected_runtime(make_scene(), default=1200) == 1200
+    model.record(make_scene(), 100)
+    assert model.expected_runtime(make_scene()) is None
+    for runtime in [200, 300, 400]:
+        model.record(make_scene(), runtime)
+    assert model.expected_runtime(make_scene()) == 300
+    assert model.runtime_percentile(make_scene(), 100) == 400
+    assert model.get_metrics() == {'runtime_keys': 1, 'runtime_samples': 3}
+
+
+def test_runtimes_scaled_to_the_scene_duration():
+    """Test the runtimes of other durations of the platform and sensor are scaled to the scene duration."""
+    model = RuntimeModel(min_samples=2)
+    model.record(make_scene(minutes=2), 100)
+    model.record(make_scene(minutes=2), 120)
+    assert model.expected_runtime(make_scene(minutes=4)) == 220
+    assert model.expected_runtime(make_scene(minutes=4, platform_name='Suomi-NPP')) is None
+
+
+def test_runtimes_are_kept_on_disk(tmp_path):
+    """Test the last runtimes are loaded again."""
+    filename = str(tmp_path / 'runtimes.db')
+    model = RuntimeModel(filename, max_samples=2, min_samples=1)
+    for runtime in [100, 200, 300]:
+        model.record(make_scene(), runtime)
+    model.close()
+
+    model = RuntimeModel(filename, max_samples=2, min_samples=1)
+    assert model.get_samples(make_scene()) == [200, 300]
+    assert model._conn.execute("SELECT COUNT(*) FROM runtimes").fetchone()[0] == 2
+    model.close()
+
+
+def test_timeout_from_observed_runtimes():
+    """Test the time out is a percentile of the runtimes, the flat time out if there are too few."""
+    options = {'maximum_pps_processing_time_in_minutes': 20,
+               'runtime_model': {'min_samples': 2, 'timeout_percentile': 100, 'timeout_factor': 2,
+                                 'min_timeout_minutes': 1}}
+    model = create_runtime_model(options)
+    assert get_timeout_seconds(make_scene(), options, model) == 1200
+    model.record(make_scene(), 100)
+    model.record(make_scene(), 200)
+    assert get_timeout_seconds(make_scene(), options, model) == 400
+    model.record(make_scene(), 10)
+    model.record(make_scene(), 10)
+    assert get_timeout_seconds(make_scene(), dict(options, runtime_model={'timeout_percentile': 50}), model) == 300
+    assert get_timeout_seconds(make_scene(), options) == 1200
+
+
+def test_timeout_is_capped():
+    """Test the time out from the runtimes is never longer than the flat time out."""
+    options = {'maximum_pps_processing_time_in_minutes': 20,
+               'runtime_model': {'min_samples': 1, 'timeout_factor': 2}}
+    model = create_runtime_model(options)
+    model.record(make_scene(), 1000)
+    assert get_timeout_seconds(make_scene(), options, model) == 1200
+
+
+def test_time_outs_raise_the_next_time_out():
+    """Test a job killed at its time out is recorded with the time out as runtime."""
+    options = {'maximum_pps_processing_time_in_minutes': 20,
+               'runtime_model': {'min_samples': 2, 'timeout_percentile': 100, 'timeout_factor': 1.5,
+                                 'min_timeout_minutes': 1}}
+    model = create_runtime_model(options)
+    model.record(make_scene(), 100)
+    model.record(make_scene(), 100)
+    assert get_timeout_seconds(make_scene(), options, model) == 150
+    model.record_timeout(make_scene(), 150)
+    assert model.get_samples(make_scene()) == [100, 100, 150]
+    assert get_timeout_seconds(make_scene(), options, model) == 225
+
+
+def test_no_model_by_default():
+    """Test there is no runtime model unless configured."""
+    assert create_runtime_model({}) is None
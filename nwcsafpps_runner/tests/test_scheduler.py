@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the schedulers for pending PPS jobs."""
+
+from datetime import datetime
+
+import pytest
+
+from nwcsafpps_runner.runtime_model import RuntimeModel
+from nwcsafpps_runner.scheduler import (DeadlineScheduler, FifoScheduler,
+                                        LeastSlackScheduler,
+                                        NewestFirstScheduler,
+                                        PlatformWeightScheduler,
+                                        ShortestExpectedJobScheduler,
+                                        create_scheduler)
+from nwcsafpps_runner.worker_pool import Job
+
+
+def make_job(job_id, platform_name, starttime, sensor=None):
+    """Make a job for a scene."""
+    scene = {'platform_name': platform_name,
+             'starttime': starttime,
+             'sensor': sensor}
+    return Job(job_id, None, (), {}, scene)
+
+
+JOBS = [make_job('old_npp', 'Suomi-NPP', datetime(2024, 4, 9, 8, 0), ['viirs']),
+        make_job('new_metop', 'Metop-B', datetime(2024, 4, 9, 9, 30), ['avhrr/3']),
+        make_job('mid_seviri', 'Meteosat-11', datetime(2024, 4, 9, 9, 0), ['seviri']),
+        make_job('new_npp', 'Suomi-NPP', datetime(2024, 4, 9, 9, 10), ['viirs'])]
+
+
+def make_runtime_model():
+    """Make a runtime model knowing the VIIRS (25 min) and SEVIRI (2 min) runtimes."""
+    model = RuntimeModel(min_samples=1)
+    model.record(JOBS[0].scene, 25 * 60)
+    model.record(JOBS[2].scene, 2 * 60)
+    return model
+
+
+def get_all(scheduler):
+    """Put all jobs in the scheduler and return the job ids in the order they are taken out."""
+    for job in JOBS:
+        scheduler.put(job)
+    return [scheduler.get().job_id for _ in range(len(scheduler))]
+
+
+class TestSchedulers:
+    """Test the job schedulers."""
+
+    def test_fifo(self):
+        """Test the fifo scheduler."""
+        assert get_all(FifoScheduler()) == ['old_npp', 'new_metop', 'mid_seviri', 'new_npp']
+
+    def test_newest_first(self):
+        """Test the newest first scheduler."""
+        assert get_all(NewestFirstScheduler()) == ['new_metop', 'new_npp', 'mid_seviri', 'old_npp']
+
+    def test_platform_weights(self):
+        """Test the platform weight scheduler, with weights per platform and sensor."""
+        scheduler = PlatformWeightScheduler({'Suomi-NPP': 3, 'seviri': 2, 'default': 1})
+        assert get_all(scheduler) == ['new_npp', 'old_npp', 'mid_seviri', 'new_metop']
+
+    def test_earliest_deadline_first(self):
+        """Test the deadline scheduler."""
+        scheduler = DeadlineScheduler({'seviri': 15, 'viirs': 120, 'default': 60})
+        # Deadlines: old_npp 10:00, new_metop 10:30, mid_seviri 09:15, new_npp 11:10
+        assert get_all(scheduler) == ['mid_seviri', 'old_npp', 'new_metop', 'new_npp']
+
+    def test_shortest_expected_job_first(self):
+        """Test the shortest expected job scheduler, with unknown runtimes last."""
+        model = make_runtime_model()
+        assert get_all(ShortestExpectedJobScheduler(model, 3600)) == ['mid_seviri', 'new_npp', 'old_npp',
+                                                                      'new_metop']
+
+    def test_least_slack_first(self):
+        """Test the least slack scheduler."""
+        model = make_runtime_model()
+        scheduler = LeastSlackScheduler(model, 3600, {'seviri': 15, 'viirs': 120, 'default': 60})
+        # Latest starts: old_npp 09:35, new_metop 09:30, mid_seviri 09:13, new_npp 10:45
+        assert get_all(scheduler) == ['mid_seviri', 'new_metop', 'old_npp', 'new_npp']
+
+    def test_get_oldest(self):
+        """Test that the job waiting the longest can be evicted whatever the priority."""
+        scheduler = NewestFirstScheduler()
+        for job in JOBS:
+            scheduler.put(job)
+        assert scheduler.get_oldest().job_id == 'old_npp'
+        assert scheduler.get().job_id == 'new_metop'
+        assert len(scheduler) == 2
+        assert {job.job_id for job in scheduler.clear()} == {'mid_seviri', 'new_npp'}
+        assert len(scheduler) == 0
+
+    def test_create_scheduler(self):
+        """Test creating the scheduler from the config."""
+        assert type(create_scheduler({})) is FifoScheduler
+        assert type(create_scheduler({'scheduler': 'newest_first'})) is NewestFirstScheduler
+        scheduler = create_scheduler({'scheduler': 'deadline', 'scene_deadlines_minutes': {'default': 10}})
+        assert scheduler.deadlines_minutes == {'default': 10}
+        with pytest.raises(ValueError):
+            create_scheduler({'scheduler': 'random'})
+        options = {'scheduler': 'least_slack', 'maximum_pps_processing_time_in_minutes': 20}
+        with pytest.raises(ValueError):
+            create_scheduler(options)
+        scheduler = create_scheduler(options, make_runtime_model())
+        assert type(scheduler) is LeastSlackScheduler
+        assert scheduler.default_seconds == 1200
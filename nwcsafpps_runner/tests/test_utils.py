@@ -20,15 +20,22 @@
 """Test utility functions."""
 import os
 import unittest
-from datetime import datetime
+from datetime import datetime, timezone
 from unittest.mock import MagicMock, patch
 
 import pytest
 
-from nwcsafpps_runner.utils import (create_xml_timestat_from_lvl1c,
+from nwcsafpps_runner.utils import (cmask_prob_dependencies_ready,
+                                    create_scene_from_msg,
+                                    create_xml_timestat_from_lvl1c,
+                                    find_existing_job_products,
+                                    find_existing_products,
                                     find_product_statistics_from_lvl1c,
-                                    get_lvl1c_file_from_msg, publish_pps_files,
-                                    ready2run)
+                                    get_cmask_prob_mode,
+                                    get_lvl1c_file_from_msg,
+                                    get_value_for_scene, publish_pps_files,
+                                    publish_skip_message, ready2run,
+                                    scene_is_too_old)
 
 TEST_MSG = """pytroll://segment/EPSSGA/1B/ file safusr.u@lxserv1043.smhi.se 2023-02-17T08:18:15.748831 v1.01 application/json {"start_time": "2023-02-17T08:03:25", "end_time": "2023-02-17T08:15:25", "orbit_number": 99999, "platform_name": "Metop-SG-A1", "sensor": "metimage", "format": "X", "type": "NETCDF", "data_processing_level": "1b", "variant": "DR", "orig_orbit_number": 23218, "uri": "/san1/polar_in/direct_readout/metimage/W_XX-EUMETSAT-Darmstadt,SAT,SGA1-VII-1B-RAD_C_EUMT_20210314224906_G_D_20070912101704_20070912101804_T_B____.nc", "uid": "W_XX-EUMETSAT-Darmstadt,SAT,SGA1-VII-1B-RAD_C_EUMT_20210314224906_G_D_20070912101704_20070912101804_T_B____.nc"}"""  # noqa: E501
 
@@ -161,6 +168,112 @@ class TestPublishPPSFiles(unittest.TestCase):
         self.assertTrue(file1 in msg_out[0].args[0])
 
 
+class TestSceneAge:
+    """Test the age limits of scenes."""
+
+    def setup_method(self):
+        """Define the scene."""
+        self.scene = {'platform_name': 'Suomi-NPP',
+                      'sensor': ['viirs'],
+                      'starttime': datetime(2024, 4, 9, 8, 0),
+                      'file4pps': '/path/to/S_NWC_viirs_npp_12345_20240409T0800000Z_20240409T0801000Z.nc'}
+        self.now = datetime(2024, 4, 9, 10, 0, tzinfo=timezone.utc)
+
+    def test_get_value_for_scene(self):
+        """Test getting config values per platform, sensor or default."""
+        assert get_value_for_scene({'Suomi-NPP': 1, 'viirs': 2, 'default': 3}, self.scene) == 1
+        assert get_value_for_scene({'viirs': 2, 'default': 3}, self.scene) == 2
+        assert get_value_for_scene({'default': 3}, self.scene) == 3
+        assert get_value_for_scene({'seviri': 3}, self.scene, 4) == 4
+        assert get_value_for_scene(None, self.scene) is None
+
+    def test_scene_is_too_old(self):
+        """Test checking the scene age against the limits."""
+        assert not scene_is_too_old(self.scene, None, now=self.now)
+        assert not scene_is_too_old(self.scene, {'seviri': 30}, now=self.now)
+        assert not scene_is_too_old(self.scene, {'viirs': 121}, now=self.now)
+        assert scene_is_too_old(self.scene, {'viirs': 119}, now=self.now)
+        assert scene_is_too_old(self.scene, {'Suomi-NPP': 60, 'viirs': 180}, now=self.now)
+
+    def test_publish_skip_message(self):
+        """Test publishing the message about a skipped scene."""
+        from posttroll.message import Message
+        input_msg = Message.decode(rawstr=TEST_MSG)
+        self.scene['orbit_number'] = 12345
+        publish_q = MagicMock()
+        publish_skip_message(input_msg, publish_q, self.scene, 'scene too old', station='norrkoping')
+        msg_out = Message.decode(publish_q.put.call_args.args[0])
+        assert msg_out.subject == '/PPS/skipped/norrkoping/polar/direct_readout/'
+        assert msg_out.data['status'] == 'skipped'
+        assert msg_out.data['reason'] == 'scene too old'
+        assert msg_out.data['platform_name'] == 'Suomi-NPP'
+        assert msg_out.data['uri'] == self.scene['file4pps']
+
+
+class TestCmaskProbMode:
+    """Test the config of how ppsCmaskProb is run."""
+
+    def test_get_cmask_prob_mode(self):
+        """Test the mode defaults to sequential and is checked."""
+        assert get_cmask_prob_mode({}) == 'sequential'
+        assert get_cmask_prob_mode({'cmask_prob_mode': 'parallel'}) == 'parallel'
+        with pytest.raises(ValueError):
+            get_cmask_prob_mode({'cmask_prob_mode': 'whenever'})
+
+    def test_cmask_prob_dependencies_ready(self, tmp_path):
+        """Test checking the products ppsCmaskProb depends on."""
+        scene = {'file4pps': '/path/to/S_NWC_viirs_npp_12345_20240409T0800000Z_20240409T0801000Z.nc'}
+        assert cmask_prob_dependencies_ready(scene, str(tmp_path), [])
+        assert not cmask_prob_dependencies_ready(scene, str(tmp_path), ['CMA'])
+        (tmp_path / 'S_NWC_CMA_npp_12345_20240409T0800000Z_20240409T0801000Z.nc').write_text('')
+        assert cmask_prob_dependencies_ready(scene, str(tmp_path), ['CMA'])
+        assert not cmask_prob_dependencies_ready(scene, str(tmp_path), ['CMA', 'CT'])
+        # A level-1c file not named as PPS expects
+        assert not cmask_prob_dependencies_ready({'file4pps': '/path/to/level1c.nc'}, str(tmp_path), ['CMA'])
+
+
+class TestExistingProducts:
+    """Test finding the products of a scene already processed."""
+
+    def setup_method(self):
+        """Set up the names."""
+        self.l1c_name = 'S_NWC_viirs_npp_12345_20240409T0800000Z_20240409T0801000Z.nc'
+        self.products = ['S_NWC_%s_npp_12345_20240409T0800000Z_20240409T0801000Z.nc' % name_tag
+                         for name_tag in ['CMA', 'CT']]
+
+    def make_files(self, tmp_path, l1c_mtime=1000, product_mtime=2000):
+        """Make the level-1c file and the products, with the given modification times."""
+        l1c_file = tmp_path / self.l1c_name
+        l1c_file.write_text('')
+        os.utime(l1c_file, (l1c_mtime, l1c_mtime))
+        for product in self.products:
+            (tmp_path / product).write_text('')
+            os.utime(tmp_path / product, (product_mtime, product_mtime))
+        return {'file4pps': str(l1c_file)}
+
+    def test_find_existing_products(self, tmp_path):
+        """Test the products are found when they are all there and newer than the level-1c file."""
+        scene = self.make_files(tmp_path)
+        assert find_existing_products(scene, str(tmp_path), ['CMA', 'CT']) == [
+            str(tmp_path / product) for product in self.products]
+        assert find_existing_products(scene, str(tmp_path), ['CMA', 'CT', 'CTTH']) is None
+
+    def test_find_existing_products_older_than_lvl1c(self, tmp_path):
+        """Test products older than the level-1c file are not taken."""
+        scene = self.make_files(tmp_path, l1c_mtime=3000)
+        assert find_existing_products(scene, str(tmp_path), ['CMA', 'CT']) is None
+
+    def test_find_existing_job_products(self, tmp_path):
+        """Test the rerun guard is only on with expected_products, and off with force_rerun."""
+        scene = self.make_files(tmp_path)
+        granules = [(scene, 'msg')]
+        assert find_existing_job_products(granules, str(tmp_path), {}) is None
+        existing = find_existing_job_products(granules, str(tmp_path), {'expected_products': ['CMA']})
+        assert existing == [(scene, 'msg', [str(tmp_path / self.products[0])])]
+        assert find_existing_job_products(granules, str(tmp_path), {'expected_products': ['CMA'],
+                                                                    'force_rerun': True}) is None
+
+
 class TestGetLvl1cFromMsg(unittest.TestCase):
     """Test publish pps files."""
 
@@ -186,6 +299,18 @@ class TestGetLvl1cFromMsg(unittest.TestCase):
             "20210314224906_G_D_20070912101704_20070912101804_T_B____.nc")
         self.assertEqual(file1, file_exp)
 
+    def test_create_scene_from_msg(self):
+        """Test creating the scene dict from the message."""
+        from posttroll.message import Message
+        input_msg = Message.decode(rawstr=TEST_MSG)
+        scene = create_scene_from_msg(input_msg)
+        self.assertEqual(scene['platform_name'], 'Metop-SG-A1')
+        self.assertEqual(scene['orbit_number'], 99999)
+        self.assertEqual(scene['satday'], '20230217')
+        self.assertEqual(scene['sathour'], '0803')
+        self.assertEqual(scene['sensor'], ['metimage'])
+        self.assertTrue(scene['file4pps'].endswith("20070912101804_T_B____.nc"))
+
     def test_get_lvl1c_file_from_msg_bad(self):
         """Test get_lvl1c_file_from_message."""
         from posttroll.message import Message
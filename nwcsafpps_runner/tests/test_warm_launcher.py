@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test launching the PPS scripts from a warm interpreter."""
+
+import asyncio
+import os
+import sys
+import time
+from unittest.mock import patch
+
+import pytest
+
+from nwcsafpps_runner.async_runner import run_subprocess
+from nwcsafpps_runner.cpu_slots import CpuSlot
+from nwcsafpps_runner.job_logs import JobLog
+from nwcsafpps_runner.process_supervisor import SupervisedProcess
+from nwcsafpps_runner.warm_launcher import WarmLauncher, get_warm_launcher
+
+FAKE_PPS_SCRIPT = """
+import os
+import sys
+print("Running PPS on", sys.argv[sys.argv.index("-af") + 1])
+print("OMP threads", os.environ.get("OMP_NUM_THREADS"), "cpus", sorted(os.sched_getaffinity(0)))
+print("Some PPS warning", file=sys.stderr)
+sys.exit(int(os.environ.get("FAKE_EXIT_CODE", "0")))
+"""
+
+
+@pytest.fixture(scope='module')
+def launcher():
+    """Get a started warm launcher."""
+    launcher = WarmLauncher(preload=['json'])
+    launcher.start()
+    return launcher
+
+
+def make_script(tmp_path, text=FAKE_PPS_SCRIPT):
+    """Write the fake PPS script."""
+    script = tmp_path / 'ppsRunAll.py'
+    script.write_text(text)
+    return str(script)
+
+
+def test_script_output_and_exit_code(launcher, tmp_path, monkeypatch):
+    """Test the script gets its arguments and environment, and its output and exit code are passed on."""
+    script = make_script(tmp_path)
+    monkeypatch.setenv("FAKE_EXIT_CODE", "3")
+    lines = []
+    cpus = sorted(os.sched_getaffinity(0))[:1]
+    proc = SupervisedProcess([sys.executable, script, '-af', 'l1c.nc'], 'scene', 10, log_func=lines.append,
+                             cpu_slot=CpuSlot(0, cpus, None), launcher=launcher)
+    proc.start()
+    result = proc.wait()
+    assert result.returncode == 3
+    assert not result.timed_out
+    assert b"Running PPS on l1c.nc" in lines
+    assert ("OMP threads 1 cpus %s" % str(cpus)).encode() in lines
+    assert b"Some PPS warning" in lines
+    assert result.rusage['max_rss_mb'] > 0
+
+
+def test_limits_are_set_before_the_script_runs(launcher, tmp_path):
+    """Test the forked script starts with its resource limits and nice level."""
+    script = make_script(tmp_path, "import os, resource\n"
+                                   "print(resource.getrlimit(resource.RLIMIT_CPU)[0], os.nice(0))\n")
+    lines = []
+    proc = SupervisedProcess([sys.executable, script], 'scene', 10, limits={'nice': 5, 'cpu_seconds': 100},
+                             log_func=lines.append, launcher=launcher)
+    proc.start()
+    assert proc.wait().returncode == 0
+    assert lines == [b"100 %d" % (os.nice(0) + 5)]
+
+
+def test_output_to_the_job_log(launcher, tmp_path):
+    """Test stdout and stderr of the forked script go to the same pipe when written to a job log."""
+    script = make_script(tmp_path)
+    job_log = JobLog(str(tmp_path / 'job.log'))
+    proc = SupervisedProcess([sys.executable, script, '-af', 'l1c.nc'], 'scene', 10, launcher=launcher,
+                             job_log=job_log)
+    proc.start()
+    assert proc.popen_obj.stderr is None
+    assert proc.wait().returncode == 0
+    output = (tmp_path / 'job.log').read_text()
+    assert "Running PPS on l1c.nc" in output
+    assert "Some PPS warning" in output
+
+
+def test_time_out_kills_the_process_group(launcher, tmp_path, is_running):
+    """Test the forked script and its children are killed on time out."""
+    pid_file = tmp_path / 'child.pid'
+    script = make_script(tmp_path, "import subprocess, time\n"
+                                   "child = subprocess.Popen(['sleep', '60'])\n"
+                                   "open(%r, 'w').write(str(child.pid))\n"
+                                   "time.sleep(60)\n" % str(pid_file))
+    start = time.monotonic()
+    proc = SupervisedProcess([sys.executable, script], 'scene', 1, kill_grace_seconds=1, launcher=launcher)
+    proc.start()
+    assert os.getpgid(proc.pgid) == proc.pgid
+    result = proc.wait()
+    assert time.monotonic() - start < 10
+    assert result.timed_out
+    assert result.returncode < 0
+    assert not is_running(int(pid_file.read_text()))
+
+
+def test_no_launcher_by_default():
+    """Test the warm launcher is only used if configured."""
+    assert get_warm_launcher({}) is None
+
+
+def test_async_run_subprocess_uses_the_launcher(launcher, tmp_path):
+    """Test the asyncio engine forks the PPS scripts from the warm launcher when configured."""
+    script = make_script(tmp_path)
+    options = {'warm_launcher': {'preload': ['json']}}
+    with patch('nwcsafpps_runner.warm_launcher.get_warm_launcher', return_value=launcher) as get_launcher:
+        with patch('nwcsafpps_runner.async_runner.get_warm_launcher', get_launcher):
+            result = asyncio.run(run_subprocess("%s %s -af l1c.nc" % (sys.executable, script), 'scene', 10,
+                                                options))
+    assert result.returncode == 0
+    get_launcher.assert_called_with(options)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the worker pool."""
+
+import threading
+from datetime import datetime
+
+import pytest
+
+from nwcsafpps_runner.scheduler import NewestFirstScheduler
+from nwcsafpps_runner.worker_pool import PoolShutDownError, WorkerPool
+
+
+class BlockingJobs(object):
+    """Jobs that wait until they are released."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = []
+        self.done = []
+        self.lock = threading.Lock()
+
+    def __call__(self, job_id):
+        with self.lock:
+            self.started.append(job_id)
+        self.release.wait(5)
+        with self.lock:
+            self.done.append(job_id)
+
+
+class TestWorkerPool:
+    """Test the worker pool."""
+
+    def test_set_concurrency(self, wait_for):
+        """Test lowering and raising the number of jobs running at the same time."""
+        jobs = BlockingJobs()
+        pool = WorkerPool(4, max_pending=0)
+        assert pool.set_concurrency(2) == 2
+        for idx in range(6):
+            pool.submit(idx, jobs, args=(idx,))
+        assert wait_for(lambda: pool.active_jobs == 2)
+        assert not wait_for(lambda: pool.active_jobs > 2, timeout=0.1)
+        assert pool.set_concurrency(10) == 4
+        assert wait_for(lambda: pool.active_jobs == 4)
+        assert pool.get_metrics()['concurrency_limit'] == 4
+        jobs.release.set()
+        assert wait_for(lambda: len(jobs.done) == 6)
+        assert len(pool.get_recent_durations()) == 6
+        pool.shutdown()
+
+    def test_unknown_overflow_policy(self):
+        """Test that an unknown overflow policy is refused."""
+        with pytest.raises(ValueError):
+            WorkerPool(1, overflow_policy='panic')
+
+    def test_fixed_number_of_threads(self, wait_for):
+        """Test that the number of threads does not grow with the backlog."""
+        jobs = BlockingJobs()
+        pool = WorkerPool(2, max_pending=0)
+        nthreads = threading.active_count()
+        for idx in range(20):
+            assert pool.submit(idx, jobs, args=(idx,))
+        assert threading.active_count() == nthreads
+        assert wait_for(lambda: pool.active_jobs == 2)
+        assert pool.queue_depth == 18
+        jobs.release.set()
+        assert wait_for(lambda: len(jobs.done) == 20)
+        pool.shutdown()
+        metrics = pool.get_metrics()
+        assert metrics['completed'] == 20
+        assert metrics['max_queue_depth'] >= 18
+
+    def test_duplicate_job_refused(self, wait_for):
+        """Test that a job already pending or running is not accepted again."""
+        jobs = BlockingJobs()
+        pool = WorkerPool(1)
+        assert pool.submit('file1', jobs, args=('file1',))
+        assert not pool.submit('file1', jobs, args=('file1',))
+        jobs.release.set()
+        assert wait_for(lambda: not pool.jobs)
+        assert pool.submit('file1', jobs, args=('file1',))
+        pool.shutdown()
+
+    def test_reject_when_full(self, wait_for):
+        """Test the reject overflow policy."""
+        jobs = BlockingJobs()
+        pool = WorkerPool(1, max_pending=1, overflow_policy='reject')
+        assert pool.submit(1, jobs, args=(1,))
+        assert wait_for(lambda: pool.active_jobs == 1)
+        assert pool.submit(2, jobs, args=(2,))
+        assert not pool.submit(3, jobs, args=(3,))
+        assert pool.get_metrics()['rejected'] == 1
+        jobs.release.set()
+        assert wait_for(lambda: len(jobs.done) == 2)
+        pool.shutdown()
+        assert jobs.done == [1, 2]
+
+    def test_drop_oldest_when_full(self, wait_for):
+        """Test the drop_oldest overflow policy."""
+        jobs = BlockingJobs()
+        evicted = []
+        pool = WorkerPool(1, max_pending=2, overflow_policy='drop_oldest', on_evict=evicted.append)
+        assert pool.submit(1, jobs, args=(1,))
+        assert wait_for(lambda: pool.active_jobs == 1)
+        for idx in [2, 3, 4]:
+            assert pool.submit(idx, jobs, args=(idx,))
+        assert pool.get_metrics()['evicted'] == 1
+        assert 2 not in pool.jobs
+        assert [job.job_id for job in evicted] == [2]
+        jobs.release.set()
+        assert wait_for(lambda: len(jobs.done) == 3)
+        pool.shutdown()
+        assert jobs.done == [1, 3, 4]
+
+    def test_block_when_full(self, wait_for):
+        """Test that the block overflow policy waits for a free slot."""
+        jobs = BlockingJobs()
+        pool = WorkerPool(1, max_pending=1, overflow_policy='block')
+        pool.submit(1, jobs, args=(1,))
+        assert wait_for(lambda: pool.active_jobs == 1)
+        pool.submit(2, jobs, args=(2,))
+
+        submitter = threading.Thread(target=pool.submit, args=(3, jobs), kwargs={'args': (3,)})
+        submitter.start()
+        submitter.join(0.2)
+        assert submitter.is_alive()
+        jobs.release.set()
+        submitter.join(5)
+        assert not submitter.is_alive()
+        assert wait_for(lambda: len(jobs.done) == 3)
+        pool.shutdown()
+
+    def test_pending_jobs_ordered_by_scheduler(self, wait_for):
+        """Test that the pending jobs are picked up in the order given by the scheduler."""
+        jobs = BlockingJobs()
+        pool = WorkerPool(1, scheduler=NewestFirstScheduler())
+        pool.submit('first', jobs, args=('first',), scene={'starttime': datetime(2024, 4, 9, 8, 0)})
+        assert wait_for(lambda: pool.active_jobs == 1)
+        for hour, job_id in [(7, 'oldest'), (10, 'newest'), (9, 'middle')]:
+            pool.submit(job_id, jobs, args=(job_id,), scene={'starttime': datetime(2024, 4, 9, hour, 0)})
+        jobs.release.set()
+        assert wait_for(lambda: len(jobs.done) == 4)
+        pool.shutdown()
+        assert jobs.done == ['first', 'newest', 'middle', 'oldest']
+
+    def test_failing_job_does_not_kill_worker(self, wait_for):
+        """Test that an exception in a job is counted and the worker survives."""
+        def failing_job():
+            raise IOError("Oh no!")
+
+        jobs = BlockingJobs()
+        jobs.release.set()
+        pool = WorkerPool(1)
+        pool.submit('bad', failing_job)
+        pool.submit('good', jobs, args=('good',))
+        assert wait_for(lambda: jobs.done == ['good'])
+        pool.shutdown()
+        metrics = pool.get_metrics()
+        assert metrics['failed'] == 1
+        assert metrics['completed'] == 1
+
+    def test_submit_after_shutdown(self):
+        """Test that jobs can not be submitted to a pool that is shut down."""
+        pool = WorkerPool(1)
+        pool.shutdown()
+        with pytest.raises(PoolShutDownError):
+            pool.submit(1, print)
@@ -27,6 +27,7 @@ import os
 import shlex
 import socket
 import threading
+from datetime import datetime, timezone
 from glob import glob
 from subprocess import PIPE, Popen
 from urllib.parse import urlparse
@@ -75,6 +76,11 @@ SUPPORTED_PPS_SATELLITES = (SUPPORTED_AVHRR_SATELLITES +
 GEOLOC_PREFIX = {'EOS-Aqua': 'MYD03', 'EOS-Terra': 'MOD03'}
 DATA1KM_PREFIX = {'EOS-Aqua': 'MYD021km', 'EOS-Terra': 'MOD021km'}
 
+#: How ppsCmaskProb is run: after ppsRunAll, in parallel with it, or as soon as
+#: the products of the PGEs in cmask_prob_depends_on are available
+CMASK_PROB_MODES = ['sequential', 'parallel', 'after_pges']
+CMASK_PROB_POLL_SECONDS = 5
+
 PPS_SENSORS = ['amsu-a', 'amsu-b', 'mhs', 'avhrr/3', 'viirs', 'modis', 'seviri', 'metimage']
 NOAA_METOP_PPS_SENSORNAMES = ['avhrr/3', 'amsu-a', 'amsu-b', 'mhs']
 
@@ -183,6 +189,34 @@ def get_lvl1c_file_from_msg(msg):
     return level1c_files[0]
 
 
+def create_scene_from_msg(msg):
+    """Create the scene dict for PPS processing from the level-1c message."""
+    if 'sensor' in msg.data and isinstance(msg.data['sensor'], list):
+        msg.data['sensor'] = msg.data['sensor'][0]
+    if 'orbit_number' not in msg.data:
+        msg.data.update({'orbit_number': 99999})
+    if 'end_time' not in msg.data:
+        msg.data.update({'end_time': 99999})
+
+    orbit_number = int(msg.data['orbit_number'])
+    platform_name = msg.data['platform_name']
+    starttime = msg.data['start_time']
+    endtime = msg.data['end_time']
+
+    satday = starttime.strftime('%Y%m%d')
+    sathour = starttime.strftime('%H%M')
+    sensors = SENSOR_LIST.get(platform_name, None)
+    scene = {'platform_name': platform_name,
+             'orbit_number': orbit_number,
+             'satday': satday, 'sathour': sathour,
+             'starttime': starttime, 'endtime': endtime,
+             'sensor': sensors
+             }
+
+    scene['file4pps'] = get_lvl1c_file_from_msg(msg)
+    return scene
+
+
 def check_host_ok(msg):
     """Check that host is ok."""
     try:
@@ -215,6 +249,64 @@ def ready2run(msg, scene, **kwargs):
         return True
 
 
+def scene_timestamp(scene):
+    """Return the scene start time as seconds since epoch, naive times taken as UTC."""
+    starttime = scene.get('starttime') if scene else None
+    if starttime is None or not hasattr(starttime, 'timestamp'):
+        return 0.0
+    if starttime.tzinfo is None:
+        starttime = starttime.replace(tzinfo=timezone.utc)
+    return starttime.timestamp()
+
+
+def get_scene_sensor(scene):
+    """Return the (first) sensor name of the scene, or None."""
+    sensor = scene.get('sensor') if scene else None
+    if isinstance(sensor, (list, tuple)):
+        sensor = sensor[0] if sensor else None
+    return sensor
+
+
+def get_value_for_scene(values, scene, default=None):
+    """Get a config value given per platform name or per sensor.
+
+    The platform name is looked up first, then the sensor and last the
+    'default' entry.
+    """
+    if not values:
+        return default
+    platform_name = scene.get('platform_name') if scene else None
+    sensor = get_scene_sensor(scene)
+    for key in (platform_name, sensor, 'default'):
+        if key is not None and key in values:
+            return values[key]
+    return default
+
+
+def get_scene_age_minutes(scene, now=None):
+    """Get the age of the scene in minutes, from its start time until *now*."""
+    if now is None:
+        now = datetime.now(tz=timezone.utc)
+    return (now.timestamp() - scene_timestamp(scene)) / 60.0
+
+
+def scene_is_too_old(scene, max_scene_age_minutes, now=None):
+    """Check if the scene is older than the age limit for its platform or sensor.
+
+    The age limits in minutes are given per platform name or sensor, with an
+    optional default. Scenes without a limit are never too old.
+    """
+    max_age = get_value_for_scene(max_scene_age_minutes, scene)
+    if max_age is None:
+        return False
+    age = get_scene_age_minutes(scene, now)
+    if age > float(max_age):
+        LOG.warning("Scene is %.1f minutes old, older than the limit of %s minutes: %s",
+                    age, str(max_age), str(scene.get('file4pps')))
+        return True
+    return False
+
+
 def terminate_process(popen_obj, scene):
     """Terminate a Popen process."""
     if popen_obj.returncode is None:
@@ -227,13 +319,82 @@ def terminate_process(popen_obj, scene):
 
 
 def create_pps_call_command(python_exec, pps_script_name, scene):
-    """Create the pps call command."""
+    """Create the pps call command, with all the level-1c files of a multi-granule scene."""
+    files4pps = scene.get('files4pps') or [scene['file4pps']]
     cmdstr = ("%s" % python_exec + " %s " % pps_script_name +
-              "-af %s" % scene['file4pps'])
+              "-af %s" % ' '.join(files4pps))
     LOG.debug("PPS call command: %s", str(cmdstr))
     return cmdstr
 
 
+def create_pps_run_all_command(options, scene):
+    """Create the call command for the PPS RunAll script, with the flags from the config."""
+    pps_run_all = options.get('run_all_script')
+    cmd_str = create_pps_call_command(options.get('python'), pps_run_all.get('name'), scene)
+    for flag in pps_run_all.get('flags') or []:
+        cmd_str = cmd_str + ' %s' % flag
+    return cmd_str
+
+
+def get_cmask_prob_mode(options):
+    """Get how ppsCmaskProb is run relative to ppsRunAll, checking the config value."""
+    mode = options.get('cmask_prob_mode', 'sequential')
+    if mode not in CMASK_PROB_MODES:
+        raise ValueError("Unknown cmask_prob_mode %s, should be one of %s" % (str(mode), str(CMASK_PROB_MODES)))
+    return mode
+
+
+def cmask_prob_dependencies_ready(scene, pps_output_dir, depends_on):
+    """Check if the products of the PGEs that ppsCmaskProb depends on are all available."""
+    for name_tag in depends_on:
+        try:
+            product = create_pps_file_from_lvl1c(scene['file4pps'], pps_output_dir, name_tag, ".nc")
+        except (KeyError, TypeError, ValueError):
+            return False
+        if not os.path.exists(product):
+            return False
+    return True
+
+
+def find_existing_products(scene, pps_output_dir, name_tags):
+    """Get the products of the scene in *pps_output_dir*, if they are all there and newer than its level-1c file.
+
+    Get None if any of them is missing or older than the level-1c file.
+    """
+    try:
+        lvl1c_mtime = os.path.getmtime(scene['file4pps'])
+    except (OSError, TypeError):
+        return None
+    products = []
+    for name_tag in name_tags:
+        try:
+            product = create_pps_file_from_lvl1c(scene['file4pps'], pps_output_dir, name_tag, ".nc")
+            if os.path.getmtime(product) <= lvl1c_mtime:
+                return None
+        except (KeyError, ValueError, OSError):
+            return None
+        products.append(product)
+    return products
+
+
+def find_existing_job_products(granules, pps_output_dir, options):
+    """Get the (scene, msg, products) of the granules if PPS need not be run again, None otherwise.
+
+    PPS need not be run again if `expected_products` is configured, all of
+    them are there for every granule, and `force_rerun` is not set.
+    """
+    name_tags = options.get('expected_products')
+    if not name_tags or options.get('force_rerun'):
+        return None
+    existing = []
+    for scene, msg in granules:
+        products = find_existing_products(scene, pps_output_dir, name_tags)
+        if products is None:
+            return None
+        existing.append((scene, msg, products))
+    return existing
+
+
 def create_xml_timestat_from_lvl1c(scene, pps_control_path):
     """From lvl1c file create XML file and return a file list."""
     try:
@@ -345,6 +506,45 @@ def publish_pps_files(input_msg, publish_q, scene, result_files, **kwargs):
             publish_q.send(pubmsg)
 
 
+def publish_skip_message(input_msg, publish_q, scene, reason, **kwargs):
+    """Publish a message telling that the scene was not processed, and why."""
+    station = kwargs.get('station', 'unknown')
+    topic = kwargs.get('topic') or '/PPS/skipped/' + station + '/polar/direct_readout/'
+
+    to_send = input_msg.data.copy()
+    to_send.pop('dataset', None)
+    to_send.pop('collection', None)
+    to_send['platform_name'] = scene['platform_name']
+    to_send['orbit_number'] = scene['orbit_number']
+    to_send['status'] = kwargs.get('status', 'skipped')
+    to_send['reason'] = reason
+    if scene.get('file4pps'):
+        to_send['uri'] = scene['file4pps']
+        to_send['uid'] = os.path.basename(scene['file4pps'])
+
+    pubmsg = Message(topic, 'info', to_send).encode()
+    LOG.info("Sending: %s", str(pubmsg))
+    publish_q.put(pubmsg)
+
+
+def publish_alert_message(input_msg, publish_q, scene, reason, **kwargs):
+    """Publish a message telling that the processing of the platform of the scene is paused, and why."""
+    station = kwargs.get('station', 'unknown')
+    topic = kwargs.get('topic') or '/PPS/alert/' + station + '/polar/direct_readout/'
+
+    to_send = {'platform_name': scene['platform_name'],
+               'status': 'paused',
+               'reason': reason}
+    if input_msg is not None and 'sensor' in input_msg.data:
+        to_send['sensor'] = input_msg.data['sensor']
+    if scene.get('file4pps'):
+        to_send['uri'] = scene['file4pps']
+
+    pubmsg = Message(topic, 'info', to_send).encode()
+    LOG.info("Sending: %s", str(pubmsg))
+    publish_q.put(pubmsg)
+
+
 def logreader(stream, log_func):
     while True:
         mystring = stream.readline()
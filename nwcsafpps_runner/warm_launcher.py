@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Launch the PPS scripts from a warm interpreter.
+
+Starting `python ppsRunAll.py` for each scene imports numpy, netCDF4 and
+the PPS modules again every time. With the warm launcher a long-lived
+fork server imports the configured modules once, and forks a process
+running the PPS script for each job::
+
+    warm_launcher:
+      preload: [numpy, netCDF4, pps_basic, pps_runall]
+
+The forked process gets its own session (process group), the environment,
+resource limits, nice level and cpu affinity of the job, and its output is
+logged as for a normal subprocess. The fork server runs the `python` of
+the runner config, so nwcsafpps_runner must be importable from it.
+
+The numerical libraries read their thread settings (OMP_NUM_THREADS...)
+when they are loaded: preloading them in the fork server fixes their
+thread count for all the jobs, whatever the cpu slot of the job.
+"""
+
+import logging
+import multiprocessing
+import os
+import runpy
+import shutil
+import sys
+import threading
+import time
+
+from nwcsafpps_runner.process_supervisor import (get_own_rusage,
+                                                 set_process_limits)
+
+LOG = logging.getLogger(__name__)
+
+#: Seconds to wait for the forked process to start its own session
+SESSION_START_TIMEOUT = 5
+
+
+def _run_script(argv, env, limits, cpus, stdout, stderr, rusage_conn):
+    """Run the python script of *argv* in the forked process, like `python script args`.
+
+    The forked process is single threaded, its limits are set before the
+    script runs. Its resource usage is sent to the runner at the end.
+    """
+    os.setsid()
+    os.dup2(stdout.fileno(), 1)
+    os.dup2((stderr or stdout).fileno(), 2)
+    stdout.close()
+    if stderr is not None:
+        stderr.close()
+    sys.stdout = open(1, 'w', buffering=1, closefd=False)
+    sys.stderr = open(2, 'w', buffering=1, closefd=False)
+    set_process_limits(limits, cpus)
+    os.environ.clear()
+    os.environ.update(env)
+    sys.argv = list(argv)
+    sys.path[0] = os.path.dirname(os.path.abspath(argv[0]))
+    try:
+        runpy.run_path(argv[0], run_name='__main__')
+    finally:
+        rusage_conn.send(get_own_rusage())
+        rusage_conn.close()
+
+
+def _open_reader(conn):
+    """Get a binary file reading the raw pipe of the connection."""
+    reader = open(os.dup(conn.fileno()), 'rb')
+    conn.close()
+    return reader
+
+
+class WarmProcess(object):
+    """A PPS script forked from the warm interpreter, with the parts of the Popen interface the runner uses."""
+
+    def __init__(self, process, stdout, stderr, rusage_conn):
+        self._process = process
+        self._rusage_conn = rusage_conn
+        self.pid = process.pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+        self.rusage = None
+
+    def poll(self):
+        """Get the exit code, None if still running."""
+        self.returncode = self._process.exitcode
+        return self.returncode
+
+    def wait(self, timeout=None):
+        """Wait for the process to finish and get its exit code, and its resource usage if it sent it."""
+        self._process.join(timeout)
+        if self.poll() is not None and not self._rusage_conn.closed:
+            try:
+                self.rusage = self._rusage_conn.recv()
+            except EOFError:
+                # Killed before sending it
+                pass
+            self._rusage_conn.close()
+        return self.returncode
+
+
+class WarmLauncher(object):
+    """Fork the PPS scripts from a fork server with the *preload* modules already imported."""
+
+    def __init__(self, preload=(), python=None):
+        self.preload = list(preload)
+        self._ctx = multiprocessing.get_context('forkserver')
+        if python:
+            # The fork server is started without a PATH lookup
+            self._ctx.set_executable(shutil.which(python) or python)
+        self._ctx.set_forkserver_preload(['__main__', __name__] + self.preload)
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the fork server now, so the first job does not pay for the preloading."""
+        from multiprocessing import forkserver
+        forkserver.ensure_running()
+        LOG.info("Warm launcher fork server started, preloading the modules: %s", str(self.preload))
+
+    def launch(self, cmd, env=None, limits=None, cpus=None, merge_stderr=False):
+        """Launch the python command *cmd* (interpreter, script and arguments) from the warm interpreter.
+
+        If *merge_stderr* is True, stderr goes to the stdout pipe, like with `stderr=STDOUT`.
+        """
+        stdout_r, stdout_w = self._ctx.Pipe(duplex=False)
+        stderr_r, stderr_w = (None, None) if merge_stderr else self._ctx.Pipe(duplex=False)
+        rusage_r, rusage_w = self._ctx.Pipe(duplex=False)
+        process = self._ctx.Process(target=_run_script,
+                                    args=(list(cmd[1:]), dict(os.environ if env is None else env),
+                                          limits or {}, cpus, stdout_w, stderr_w, rusage_w),
+                                    daemon=False)
+        with self._lock:
+            # The pipes and the process are passed to the fork server one job at a time
+            process.start()
+        stdout_w.close()
+        if stderr_w is not None:
+            stderr_w.close()
+        rusage_w.close()
+        proc = WarmProcess(process, _open_reader(stdout_r),
+                           _open_reader(stderr_r) if stderr_r is not None else None, rusage_r)
+        self._wait_for_session(proc)
+        return proc
+
+    @staticmethod
+    def _wait_for_session(proc):
+        """Wait until the process leads its own process group, so that it can be killed with it."""
+        deadline = time.monotonic() + SESSION_START_TIMEOUT
+        while time.monotonic() < deadline and proc.poll() is None:
+            try:
+                if os.getpgid(proc.pid) == proc.pid:
+                    return
+            except ProcessLookupError:
+                return
+            time.sleep(0.001)
+
+
+_LAUNCHER = None
+_LAUNCHER_LOCK = threading.Lock()
+
+
+def get_warm_launcher(options):
+    """Get the warm launcher of the runner config, started on first use. None if not configured."""
+    global _LAUNCHER
+    settings = options.get('warm_launcher')
+    if not settings:
+        return None
+    with _LAUNCHER_LOCK:
+        if _LAUNCHER is None:
+            _LAUNCHER = WarmLauncher(settings.get('preload') or [], python=options.get('python'))
+            _LAUNCHER.start()
+        return _LAUNCHER
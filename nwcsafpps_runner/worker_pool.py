@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2024 Pytroll Developers
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A fixed size worker pool with a bounded job queue for the PPS runner."""
+
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+from nwcsafpps_runner.metrics import observe_phase
+from nwcsafpps_runner.scheduler import FifoScheduler
+
+LOG = logging.getLogger(__name__)
+
+#: What to do when a job is submitted and the pending-job queue is full
+OVERFLOW_POLICIES = ['block', 'reject', 'drop_oldest']
+
+#: Number of job durations kept for the concurrency controller
+RECENT_DURATIONS = 50
+
+#: A job, *submitted* is the time.monotonic() time it was put on the queue
+Job = namedtuple('Job', ['job_id', 'target', 'args', 'kwargs', 'scene', 'submitted'], defaults=(None, ))
+
+
+class PoolShutDownError(Exception):
+    pass
+
+
+class JobQueue(object):
+    """The pending-job queue, the job bookkeeping and the counters of a pool of workers.
+
+    The locking and waiting are left to the thread based WorkerPool and to
+    the asyncio lane, which call these methods holding their own lock.
+    """
+
+    def __init__(self, nworkers, max_pending=0, overflow_policy='block', scheduler=None, name='pps-worker',
+                 on_evict=None):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError("Overflow policy %s not supported! Use one of %s" % (overflow_policy,
+                                                                                  str(OVERFLOW_POLICIES)))
+        self.name = name
+        self.nworkers = int(nworkers)
+        self.max_pending = int(max_pending)
+        self.overflow_policy = overflow_policy
+        self.on_evict = on_evict
+
+        self.jobs = set()
+        if scheduler is None:
+            scheduler = FifoScheduler()
+        self._pending = scheduler
+        self._nactive = 0
+        self.concurrency_limit = self.nworkers
+        self.recent_durations = deque(maxlen=RECENT_DURATIONS)
+        self.stats = {'submitted': 0,
+                      'rejected': 0,
+                      'evicted': 0,
+                      'completed': 0,
+                      'failed': 0,
+                      'max_queue_depth': 0}
+
+    def is_pending(self, job_id):
+        """Check if a job with this id is waiting in the queue or running."""
+        return job_id in self.jobs
+
+    def _queue_full(self):
+        return self.max_pending > 0 and len(self._pending) >= self.max_pending
+
+    def _admit(self, job_id):
+        """Check if the job can be put on the queue, evicting the oldest job with the drop_oldest policy.
+
+        Return True if it can, False if it is refused, and None if the
+        submitter has to wait for a free slot in the queue.
+        """
+        if job_id in self.jobs:
+            LOG.info("Job with id %s already pending or running!", str(job_id))
+            return False
+        if not self._queue_full():
+            return True
+        if self.overflow_policy == 'reject':
+            self.stats['rejected'] += 1
+            LOG.warning("Job queue full (%d jobs), rejecting job %s", len(self._pending), str(job_id))
+            return False
+        if self.overflow_policy == 'drop_oldest':
+            old_job = self._pending.get_oldest()
+            self.jobs.discard(old_job.job_id)
+            self.stats['evicted'] += 1
+            LOG.warning("Job queue full, dropping the oldest pending job %s", str(old_job.job_id))
+            if self.on_evict is not None:
+                self.on_evict(old_job)
+            return True
+        LOG.info("Job queue full (%d jobs), waiting for a free slot...", len(self._pending))
+        return None
+
+    def _put(self, job_id, target, args, kwargs, scene):
+        self.jobs.add(job_id)
+        self._pending.put(Job(job_id, target, args, kwargs or {}, scene, time.monotonic()))
+        self.stats['submitted'] += 1
+        self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], len(self._pending))
+
+    def _can_start(self):
+        return len(self._pending) > 0 and self._nactive < self.concurrency_limit
+
+    def _take(self):
+        job = self._pending.get()
+        self._nactive += 1
+        return job
+
+    def _done(self, job, failed, start_time):
+        self._nactive -= 1
+        self.jobs.discard(job.job_id)
+        self.stats['failed' if failed else 'completed'] += 1
+        if not failed:
+            self.recent_durations.append(time.monotonic() - start_time)
+
+    def _get_metrics(self):
+        metrics = dict(self.stats)
+        metrics['queue_depth'] = len(self._pending)
+        metrics['active_jobs'] = self._nactive
+        metrics['workers'] = self.nworkers
+        metrics['concurrency_limit'] = self.concurrency_limit
+        return metrics
+
+    def _set_concurrency(self, nworkers):
+        self.concurrency_limit = max(1, min(int(nworkers), self.nworkers))
+        return self.concurrency_limit
+
+
+class WorkerPool(JobQueue):
+    """A fixed number of worker threads fed from a bounded pending-job queue.
+
+    The worker threads are started once and live as long as the pool. Jobs
+    are identified by a *job_id*, and a job with the same id as a job already
+    pending or running is not accepted a second time. The order in which
+    pending jobs are picked up is decided by the *scheduler* (FIFO by
+    default). The number of jobs running at the same time can be lowered
+    at runtime with `set_concurrency`, down to one.
+    """
+
+    def __init__(self, max_nthreads, max_pending=0, overflow_policy='block', scheduler=None,
+                 name='pps-worker', on_evict=None):
+        """Init the pool and start the worker threads.
+
+        A *max_pending* of 0 (or less) means an unbounded pending-job queue.
+        The *on_evict* callable, if given, is called with each job evicted
+        from a full queue.
+        """
+        JobQueue.__init__(self, max_nthreads, max_pending=max_pending, overflow_policy=overflow_policy,
+                          scheduler=scheduler, name=name, on_evict=on_evict)
+        self._loop = True
+        self._cond = threading.Condition()
+
+        self._threads = []
+        for idx in range(self.nworkers):
+            thread = threading.Thread(target=self._work, name="%s-%d" % (name, idx), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def max_nthreads(self):
+        """Return the number of worker threads."""
+        return self.nworkers
+
+    @property
+    def queue_depth(self):
+        """Return the number of jobs waiting for a free worker."""
+        with self._cond:
+            return len(self._pending)
+
+    @property
+    def active_jobs(self):
+        """Return the number of jobs currently being processed."""
+        with self._cond:
+            return self._nactive
+
+    def get_metrics(self):
+        """Return a snapshot of the queue and job counters."""
+        with self._cond:
+            return self._get_metrics()
+
+    def get_recent_durations(self):
+        """Return the durations in seconds of the last jobs, oldest first."""
+        with self._cond:
+            return list(self.recent_durations)
+
+    def set_concurrency(self, nthreads):
+        """Set how many jobs may run at the same time, between 1 and the number of workers.
+
+        Running jobs are not interrupted, the new limit is applied when jobs
+        are picked up from the queue. Return the limit actually set.
+        """
+        with self._cond:
+            limit = self._set_concurrency(nthreads)
+            self._cond.notify_all()
+            return limit
+
+    def submit(self, job_id, target, args=(), kwargs=None, scene=None):
+        """Put a job on the pending-job queue.
+
+        The *scene* dict is used by the scheduler to prioritise the job.
+
+        Return True if the job was accepted and False if it was refused,
+        either because it is a duplicate or because the queue is full and the
+        overflow policy is 'reject'.
+        """
+        with self._cond:
+            if not self._loop:
+                raise PoolShutDownError("Can not submit jobs to a pool that is shut down")
+            admitted = self._admit(job_id)
+            if admitted is None:
+                while self._queue_full() and self._loop:
+                    self._cond.wait()
+                if not self._loop:
+                    raise PoolShutDownError("Pool shut down while waiting for a free slot")
+            elif not admitted:
+                return False
+            self._put(job_id, target, args, kwargs, scene)
+            self._cond.notify_all()
+        return True
+
+    def _get_job(self):
+        with self._cond:
+            while self._loop and not self._can_start():
+                self._cond.wait()
+            if not self._loop:
+                return None
+            job = self._take()
+            # Wake up a listener blocked on a full queue:
+            self._cond.notify_all()
+            return job
+
+    def _work(self):
+        while True:
+            job = self._get_job()
+            if job is None:
+                return
+            failed = False
+            start_time = time.monotonic()
+            if job.submitted is not None:
+                observe_phase('queue_wait', start_time - job.submitted)
+            try:
+                job.target(*job.args, **job.kwargs)
+            except Exception:
+                failed = True
+                LOG.exception("Job %s failed", str(job.job_id))
+            finally:
+                with self._cond:
+                    self._done(job, failed, start_time)
+                    self._cond.notify_all()
+
+    def shutdown(self, wait=True):
+        """Stop the workers, dropping jobs not yet started."""
+        with self._cond:
+            self._loop = False
+            for job in self._pending.clear():
+                self.jobs.discard(job.job_id)
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()